@@ -0,0 +1,38 @@
+import random
+
+
+def random_delete(tokens, p, rng):
+    if len(tokens) <= 1:
+        return tokens[:]
+    kept = [tok for tok in tokens if rng.random() > p]
+    return kept if kept else [tokens[rng.randrange(len(tokens))]]
+
+
+def random_swap(tokens, n, rng):
+    if len(tokens) < 2:
+        return tokens[:]
+    out = tokens[:]
+    for _ in range(n):
+        i, j = rng.sample(range(len(out)), 2)
+        out[i], out[j] = out[j], out[i]
+    return out
+
+
+def augment_tokens(tokens, rng):
+    augmented = tokens[:]
+    if rng.random() < 0.7:
+        augmented = random_delete(augmented, p=0.1, rng=rng)
+    if rng.random() < 0.7:
+        swaps = max(1, len(augmented) // 5)
+        augmented = random_swap(augmented, swaps, rng)
+    return augmented
+
+
+def tokens_to_text(tokens):
+    return "".join(tokens)
+
+
+def seeded_rng(seed, epoch, index):
+    # String seeds are hashed with SHA-512 by `random`, so the stream only
+    # depends on (seed, epoch, index) and not on the worker process.
+    return random.Random(f"{seed}:{epoch}:{index}")
@@ -0,0 +1,200 @@
+import os
+import platform
+import random
+import statistics
+import time
+import traceback
+from queue import Empty
+
+import torch
+import torch.multiprocessing as mp
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from dataset_io import column_list, read_table
+from inference_pipeline import plan_batches
+from inference_pool import available_cores
+from inference_profile import forward_context, prepare_model, save_profile
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model"))
+SAMPLE_FILE = os.getenv("SAMPLE_FILE", os.path.join(DATA_DIR, "thai_sentiment_dataset.parquet"))
+SAMPLE_SIZE = int(os.getenv("SAMPLE_SIZE", "256"))
+SEED = int(os.getenv("SEED", "42"))
+
+
+def int_list(name, default):
+    return [int(v) for v in os.getenv(name, default).split(",") if v.strip()]
+
+
+def default_threads():
+    cores = len(available_cores())
+    options = [1]
+    while options[-1] * 2 <= cores:
+        options.append(options[-1] * 2)
+    if options[-1] != cores:
+        options.append(cores)
+    return ",".join(map(str, options))
+
+
+BATCH_SIZES = int_list("BATCH_SIZES", "1,8,16,32,64")
+MAX_LENGTHS = int_list("MAX_LENGTHS", "64,128,256")
+INTRA_OP_THREADS = int_list("SWEEP_INTRA_THREADS", default_threads())
+INTEROP_THREADS = int_list("SWEEP_INTEROP_THREADS", "1,2")
+BACKENDS = [b.strip() for b in os.getenv("BACKENDS", "eager,compile").split(",") if b.strip()]
+# Batches timed per configuration, after an untimed pass over every padded
+# shape among them.
+MEASURE_BATCHES = int(os.getenv("MEASURE_BATCHES", "16"))
+# Optional p99 batch latency budget; the fastest configuration within it wins.
+LATENCY_BUDGET_MS = float(os.getenv("LATENCY_BUDGET_MS", "0"))
+# Shorter max lengths only qualify if they truncate at most this share of texts.
+MAX_TRUNCATION = float(os.getenv("MAX_TRUNCATION", "0.01"))
+
+
+def load_sample_texts():
+    texts = [str(t) for t in column_list(read_table(SAMPLE_FILE, columns=["text"]), "text")]
+    rng = random.Random(SEED)
+    return rng.sample(texts, SAMPLE_SIZE) if len(texts) > SAMPLE_SIZE else texts
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def measure(model, tokenizer, texts, batch_size, max_length, backend):
+    encoded = tokenizer(texts, truncation=True, max_length=max_length)
+    full_lengths = [len(ids) for ids in tokenizer(texts)["input_ids"]]
+    truncated = sum(length > max_length for length in full_lengths) / max(1, len(texts))
+    batches = plan_batches([len(ids) for ids in encoded["input_ids"]], batch_size)
+    # Spread the timed batches over the whole length range.
+    rng = random.Random(SEED)
+    batches = rng.sample(batches, min(len(batches), MEASURE_BATCHES))
+    padded = [
+        tokenizer.pad({k: [encoded[k][i] for i in batch] for k in encoded.keys()}, return_tensors="pt")
+        for batch in batches
+    ]
+
+    # torch.compile specialises on input shapes; every shape is compiled here,
+    # outside the timed loop, so recompiles are not counted against "compile".
+    shapes = {tuple(enc["input_ids"].shape): enc for enc in padded}
+    latencies = []
+    samples = 0
+    with torch.no_grad(), forward_context(backend):
+        for enc in shapes.values():
+            model(**enc)
+        for enc in padded:
+            start = time.perf_counter()
+            model(**enc)
+            latencies.append((time.perf_counter() - start) * 1000)
+            samples += enc["input_ids"].shape[0]
+    return {
+        "throughput": samples / (sum(latencies) / 1000),
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": percentile(latencies, 0.99),
+        "truncation_rate": truncated,
+    }
+
+
+def sweep_interop(interop, texts, results):
+    # set_num_interop_threads only works before any parallel work, so each
+    # inter-op setting is measured in its own process. Puts one dict per
+    # configuration, a traceback string if the sweep fails, and always a
+    # final None.
+    try:
+        torch.set_num_interop_threads(interop)
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
+        base_model = AutoModelForSequenceClassification.from_pretrained(MODEL_PATH)
+        base_model.eval()
+        for backend in BACKENDS:
+            model = prepare_model(base_model, backend)
+            for intra in INTRA_OP_THREADS:
+                torch.set_num_threads(intra)
+                for max_length in MAX_LENGTHS:
+                    for batch_size in BATCH_SIZES:
+                        stats = measure(model, tokenizer, texts, batch_size, max_length, backend)
+                        config = {
+                            "batch_size": batch_size,
+                            "max_length": max_length,
+                            "intra_op_threads": intra,
+                            "interop_threads": interop,
+                            "backend": backend,
+                        }
+                        results.put({**config, **stats})
+                        print(
+                            f"{backend:8} intra={intra:<3} inter={interop:<2} len={max_length:<4} bs={batch_size:<4} "
+                            f"{stats['throughput']:8.1f} samples/s  p50 {stats['p50_ms']:7.1f}ms  "
+                            f"p99 {stats['p99_ms']:7.1f}ms",
+                            flush=True,
+                        )
+    except Exception:
+        results.put(traceback.format_exc())
+    finally:
+        results.put(None)
+
+
+def pick_best(results):
+    candidates = [r for r in results if r["truncation_rate"] <= MAX_TRUNCATION]
+    if not candidates:
+        longest = max(r["max_length"] for r in results)
+        candidates = [r for r in results if r["max_length"] == longest]
+    if LATENCY_BUDGET_MS:
+        within = [r for r in candidates if r["p99_ms"] <= LATENCY_BUDGET_MS]
+        candidates = within or candidates
+    return max(candidates, key=lambda r: r["throughput"])
+
+
+def main():
+    texts = load_sample_texts()
+    print(f"Tuning {MODEL_PATH} on {len(texts)} texts")
+
+    ctx = mp.get_context("spawn")
+    results = []
+    for interop in INTEROP_THREADS:
+        queue = ctx.Queue()
+        process = ctx.Process(target=sweep_interop, args=(interop, texts, queue))
+        process.start()
+        error = None
+        while True:
+            try:
+                item = queue.get(timeout=5)
+            except Empty:
+                # Killed without reaching its finally block (e.g. by the OOM killer)
+                if not process.is_alive():
+                    break
+                continue
+            if item is None:
+                break
+            if isinstance(item, str):
+                error = item
+            else:
+                results.append(item)
+        process.join()
+        if error is not None:
+            raise RuntimeError(f"Sweep with interop_threads={interop} failed:\n{error}")
+        if process.exitcode:
+            raise RuntimeError(f"Sweep with interop_threads={interop} failed (exit code {process.exitcode})")
+
+    best = pick_best(results)
+    profile = {
+        **best,
+        "tuned_on": {
+            "samples": len(texts),
+            "cores": len(available_cores()),
+            "machine": platform.machine(),
+            "torch": torch.__version__,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "sweep": results,
+    }
+    path = save_profile(MODEL_PATH, profile)
+    print(
+        f"Best: {best['backend']} intra={best['intra_op_threads']} inter={best['interop_threads']} "
+        f"len={best['max_length']} bs={best['batch_size']} -> {best['throughput']:.1f} samples/s"
+    )
+    print(f"Profile written to {path}")
+
+
+if __name__ == "__main__":
+    main()
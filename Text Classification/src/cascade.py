@@ -0,0 +1,161 @@
+import os
+import pickle
+import time
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+
+from dataset_io import column_list, read_table
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+DATA_FILE = os.getenv("DATA_FILE", os.path.join(DATA_DIR, "thai_sentiment_dataset.parquet"))
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model"))
+STAGE1_FILE = os.getenv("STAGE1_FILE", os.path.join(DATA_DIR, "cascade_stage1.pkl"))
+SEED = int(os.getenv("SEED", "42"))
+# Share of the training split held back to calibrate the escalation threshold.
+CALIBRATION_SIZE = float(os.getenv("CALIBRATION_SIZE", "0.1"))
+# The threshold is the lowest confidence at which the cascade stays within
+# this much accuracy of always using the transformer on the calibration split.
+MAX_ACCURACY_DROP = float(os.getenv("MAX_ACCURACY_DROP", "0.01"))
+HASH_FEATURES = int(os.getenv("HASH_FEATURES", str(2**20)))
+NGRAM_MAX = int(os.getenv("NGRAM_MAX", "4"))
+
+
+def build_stage1():
+    # Character n-grams sidestep Thai word segmentation entirely, and hashing
+    # keeps the feature space fixed without a vocabulary pass.
+    return make_pipeline(
+        HashingVectorizer(
+            analyzer="char_wb",
+            ngram_range=(1, NGRAM_MAX),
+            n_features=HASH_FEATURES,
+            alternate_sign=False,
+            norm=None,
+        ),
+        TfidfTransformer(sublinear_tf=True),
+        SGDClassifier(loss="log_loss", alpha=1e-5, random_state=SEED),
+    )
+
+
+def full_probabilities(stage1, texts, num_labels):
+    # predict_proba columns follow stage1.classes_, which skips any label that
+    # was missing from the stage-1 training data; place them in the full label
+    # order (label id = column) that the transformer uses.
+    probs = np.zeros((len(texts), num_labels))
+    probs[:, stage1.classes_.astype(int)] = stage1.predict_proba(texts)
+    return probs
+
+
+def calibrate_threshold(stage1_probs, transformer_pred, labels):
+    # Sweep every distinct stage-1 confidence as a candidate threshold, from
+    # escalating nothing to escalating everything.
+    stage1_pred = stage1_probs.argmax(axis=1)
+    confidence = stage1_probs.max(axis=1)
+    target = np.mean(transformer_pred == labels) - MAX_ACCURACY_DROP
+    for threshold in np.unique(np.concatenate([[0.0], confidence, [1.01]])):
+        cascade_pred = np.where(confidence >= threshold, stage1_pred, transformer_pred)
+        if np.mean(cascade_pred == labels) >= target:
+            return float(threshold)
+    return 1.01
+
+
+class CascadePredictor:
+    # Stage 1 answers when its top probability reaches the threshold; the
+    # rest are sent to the transformer in one batched call.
+    def __init__(self, stage1, threshold, transformer):
+        self.stage1 = stage1
+        self.threshold = threshold
+        self.transformer = transformer
+        self.escalated = 0
+        self.seen = 0
+
+    @classmethod
+    def load(cls, transformer, path=STAGE1_FILE):
+        with open(path, "rb") as f:
+            saved = pickle.load(f)
+        return cls(saved["stage1"], saved["threshold"], transformer)
+
+    def predict(self, texts):
+        probs = full_probabilities(self.stage1, texts, len(self.transformer.labels)).tolist()
+        escalate = [i for i, row in enumerate(probs) if max(row) < self.threshold]
+        if escalate:
+            _, transformer_probs = self.transformer.predict([texts[i] for i in escalate])
+            for i, row in zip(escalate, transformer_probs):
+                probs[i] = row
+        self.seen += len(texts)
+        self.escalated += len(escalate)
+        labels = [self.transformer.labels[max(range(len(row)), key=row.__getitem__)] for row in probs]
+        return labels, probs
+
+
+def transformer_predict(predictor, texts):
+    _, probs = predictor.predict(texts)
+    return np.array(probs).argmax(axis=1)
+
+
+def main():
+    from test_model import SentimentPredictor
+
+    table = read_table(DATA_FILE, columns=["text", "label"])
+    texts = [str(t) for t in column_list(table, "text")]
+    labels = np.array(column_list(table, "label"))
+    # Same split as train_model.py, so the held-out texts were never seen by
+    # either stage.
+    train_idx, test_idx = train_test_split(np.arange(len(texts)), test_size=0.2, random_state=SEED)
+    fit_idx, calib_idx = train_test_split(train_idx, test_size=CALIBRATION_SIZE, random_state=SEED)
+
+    start = time.perf_counter()
+    stage1 = build_stage1()
+    stage1.fit([texts[i] for i in fit_idx], labels[fit_idx])
+    print(f"Stage 1 trained on {len(fit_idx)} texts in {time.perf_counter() - start:.1f}s")
+
+    # The transformer saw the calibration texts during training, so its
+    # accuracy there is optimistic and the threshold errs towards escalating.
+    transformer = SentimentPredictor(MODEL_PATH)
+    calib_texts = [texts[i] for i in calib_idx]
+    threshold = calibrate_threshold(
+        full_probabilities(stage1, calib_texts, len(transformer.labels)),
+        transformer_predict(transformer, calib_texts),
+        labels[calib_idx],
+    )
+    print(f"Calibrated threshold on {len(calib_idx)} texts: {threshold:.4f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(STAGE1_FILE)), exist_ok=True)
+    with open(STAGE1_FILE, "wb") as f:
+        pickle.dump({"stage1": stage1, "threshold": threshold}, f)
+    print(f"Stage 1 model saved to {STAGE1_FILE}")
+
+    test_texts = [texts[i] for i in test_idx]
+    test_labels = labels[test_idx]
+
+    start = time.perf_counter()
+    transformer_pred = transformer_predict(transformer, test_texts)
+    transformer_secs = time.perf_counter() - start
+
+    cascade = CascadePredictor(stage1, threshold, transformer)
+    start = time.perf_counter()
+    _, cascade_probs = cascade.predict(test_texts)
+    cascade_secs = time.perf_counter() - start
+    cascade_pred = np.array(cascade_probs).argmax(axis=1)
+    stage1_pred = stage1.predict(test_texts)
+
+    print(f"Held-out texts: {len(test_texts)}")
+    print(f"Stage 1 accuracy: {np.mean(stage1_pred == test_labels):.4f}")
+    print(f"Transformer accuracy: {np.mean(transformer_pred == test_labels):.4f}")
+    print(f"Cascade accuracy: {np.mean(cascade_pred == test_labels):.4f}")
+    print(f"Agreement with transformer: {np.mean(cascade_pred == transformer_pred):.4f}")
+    print(f"Escalated: {cascade.escalated} ({cascade.escalated / max(1, len(test_texts)):.1%})")
+    print(
+        f"Time per text: transformer {transformer_secs / len(test_texts) * 1000:.2f}ms, "
+        f"cascade {cascade_secs / len(test_texts) * 1000:.2f}ms "
+        f"({transformer_secs / cascade_secs:.1f}x faster)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,30 @@
 import os
 import random
 
+import numpy as np
 import pandas as pd
-from pythainlp import word_tokenize
+
+from augment import augment_tokens, tokens_to_text
+from dataset_io import SENTIMENT_SCHEMA, read_frame, write_dataset
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 SOURCE_FILE = os.getenv(
     "SOURCE_FILE",
-    os.path.join(DATA_DIR, "thai_sentiment_dataset_relabeled.csv"),
+    os.path.join(DATA_DIR, "thai_sentiment_dataset_relabeled.parquet"),
 )
-OUTPUT_FILE = os.path.join(DATA_DIR, "thai_sentiment_dataset.csv")
+OUTPUT_FILE = os.getenv("OUTPUT_FILE", os.path.join(DATA_DIR, "thai_sentiment_dataset.parquet"))
 
 SEED = 42
-AUGMENTATIONS_PER_TEXT = int(os.getenv("AUG_PER_TEXT", "3"))
+# Stored augmented copies per text. Off by default: train_model.py augments the
+# training split on the fly, and stored copies of one text would otherwise be
+# split across train and test by every train_test_split downstream.
+AUGMENTATIONS_PER_TEXT = int(os.getenv("AUG_PER_TEXT", "0"))
 USE_HF = os.getenv("USE_HF", "1") == "1"
 HF_DATASET = os.getenv("HF_DATASET", "pythainlp/wisesight_sentiment")
 HF_SPLITS = [split.strip() for split in os.getenv("HF_SPLITS", "train,validation,test").split(",") if split.strip()]
 HF_Q_LABEL = os.getenv("HF_Q_LABEL", "neutral").strip().lower()
+SEGMENTER = os.getenv("SEGMENTER", "pythainlp").strip().lower()
 
 LABEL_MAP = {
     "very negative": 0,
@@ -42,77 +49,59 @@ HF_LABEL_MAP_INT = {
 }
 
 
-def normalize_label(value):
-    if value is None:
-        return None
-    if isinstance(value, (int, float)):
-        try:
-            return int(value)
-        except ValueError:
-            return None
-    text = str(value).strip().lower()
-    if text == "":
-        return None
-    if text.isdigit():
-        return int(text)
-    return LABEL_MAP.get(text)
-
-
-def map_hf_label(value):
-    if value is None:
-        return None
-    if isinstance(value, (int, float)):
-        int_value = int(value)
-        if int_value == 3 and HF_Q_LABEL == "drop":
-            return None
-        return HF_LABEL_MAP_INT.get(int_value)
-    text = str(value).strip().lower()
-    if text.isdigit():
-        int_value = int(text)
-        if int_value == 3 and HF_Q_LABEL == "drop":
-            return None
-        return HF_LABEL_MAP_INT.get(int_value)
-    if text == "q" and HF_Q_LABEL == "drop":
-        return None
-    return HF_LABEL_MAP_STR.get(text)
-
-
-def random_delete(tokens, p, rng):
-    if len(tokens) <= 1:
-        return tokens[:]
-    kept = [tok for tok in tokens if rng.random() > p]
-    return kept if kept else [tokens[rng.randrange(len(tokens))]]
-
-
-def random_swap(tokens, n, rng):
-    if len(tokens) < 2:
-        return tokens[:]
-    out = tokens[:]
-    for _ in range(n):
-        i, j = rng.sample(range(len(out)), 2)
-        out[i], out[j] = out[j], out[i]
-    return out
-
-
-def augment_tokens(tokens, rng):
-    augmented = tokens[:]
-    if rng.random() < 0.7:
-        augmented = random_delete(augmented, p=0.1, rng=rng)
-    if rng.random() < 0.7:
-        swaps = max(1, len(augmented) // 5)
-        augmented = random_swap(augmented, swaps, rng)
-    return augmented
-
-
-def tokens_to_text(tokens):
-    return "".join(tokens)
+def split_label_column(series):
+    # Integer codes for numeric cells and digit strings, plus the normalised
+    # text of every other cell (None when the column is already numeric).
+    if pd.api.types.is_numeric_dtype(series):
+        return series.apply(np.trunc).astype("Int64"), None
+    text = series.astype("string").str.strip().str.lower()
+    digits = text.str.fullmatch(r"\d+").fillna(False)
+    codes = pd.to_numeric(text.where(digits), errors="coerce").astype("Int64")
+    return codes, text.where(~digits)
+
+
+def normalize_labels(series):
+    codes, names = split_label_column(series)
+    if names is None:
+        return codes
+    return codes.fillna(names.map(LABEL_MAP, na_action="ignore").astype("Int64"))
+
+
+def map_hf_labels(series):
+    int_map = dict(HF_LABEL_MAP_INT)
+    str_map = dict(HF_LABEL_MAP_STR)
+    if HF_Q_LABEL == "drop":
+        int_map.pop(3, None)
+        str_map.pop("q", None)
+    codes, names = split_label_column(series)
+    mapped = codes.map(int_map, na_action="ignore").astype("Int64")
+    if names is None:
+        return mapped
+    return mapped.fillna(names.map(str_map, na_action="ignore").astype("Int64"))
+
+
+def tokenize_texts(texts):
+    if SEGMENTER == "trie":
+        from trie_segmenter import load_segmenter
+
+        return load_segmenter().segment_batch(texts)
+    if SEGMENTER != "pythainlp":
+        raise ValueError(f"Unknown SEGMENTER: {SEGMENTER}")
+
+    from pythainlp import word_tokenize
+
+    return [word_tokenize(text) for text in texts]
+
+
+def empty_rows():
+    return pd.DataFrame({"text": pd.Series(dtype=str), "label": pd.Series(dtype=int)})
 
 
 def load_base_rows():
     if not os.path.exists(SOURCE_FILE):
         raise FileNotFoundError(f"Source dataset not found: {SOURCE_FILE}")
 
-    df = pd.read_csv(SOURCE_FILE)
+    df = read_frame(SOURCE_FILE)
     if "text" not in df.columns:
         raise ValueError("Expected a 'text' column in the source dataset.")
 
@@ -126,17 +115,24 @@ def load_base_rows():
     else:
         raise ValueError("No label column found in the source dataset.")
 
-    rows = []
-    for _, row in df.iterrows():
-        text = str(row["text"])
-        raw_label = row.get(label_col)
-        label = normalize_label(raw_label)
-        if label is None and label_col != "original_label" and "original_label" in df.columns:
-            label = normalize_label(row.get("original_label"))
-        if label is None:
-            continue
-        rows.append((text, label))
-    return rows
+    labels = normalize_labels(df[label_col])
+    if label_col != "original_label" and "original_label" in df.columns:
+        labels = labels.fillna(normalize_labels(df["original_label"]))
+    rows = pd.DataFrame({"text": df["text"], "label": labels}).dropna(subset=["text", "label"])
+    return rows.astype({"text": str, "label": int}).reset_index(drop=True)
+
+
+def map_hf_batch(batch):
+    size = len(next(iter(batch.values())))
+    fallback = batch.get("text", [None] * size)
+    texts = [t or f for t, f in zip(batch.get("texts", fallback), fallback)]
+    labels = batch["category"] if "category" in batch else batch.get("label", [None] * size)
+    mapped = map_hf_labels(pd.Series(labels))
+    keep = mapped.notna() & pd.Series([t is not None for t in texts])
+    return {
+        "text": [str(t) for t, k in zip(texts, keep) if k],
+        "label": mapped[keep].astype(int).tolist(),
+    }
 
 
 def load_hf_rows():
@@ -144,25 +140,23 @@ def load_hf_rows():
         from datasets import load_dataset
     except ImportError:
         print("datasets not installed; skipping Hugging Face dataset.")
-        return []
+        return empty_rows()
 
-    rows = []
+    frames = []
     for split in HF_SPLITS:
         dataset = load_dataset(HF_DATASET, split=split)
-        for item in dataset:
-            text = item.get("texts") or item.get("text")
-            label = item.get("category") if "category" in item else item.get("label")
-            mapped = map_hf_label(label)
-            if text is None or mapped is None:
-                continue
-            rows.append((str(text), mapped))
-    return rows
+        dataset = dataset.map(map_hf_batch, batched=True, remove_columns=dataset.column_names)
+        frames.append(dataset.to_pandas())
+    return pd.concat(frames, ignore_index=True) if frames else empty_rows()
 
 
 def build_dataset(rows, rng):
     data = []
-    for text, label in rows:
-        tokens = word_tokenize(text)
+    # Repeated texts are common in social-media sources; tokenize each once.
+    unique_texts = list(dict.fromkeys(rows["text"]))
+    tokens_by_text = dict(zip(unique_texts, tokenize_texts(unique_texts)))
+    token_lists = [tokens_by_text[text] for text in rows["text"]]
+    for text, label, tokens in zip(rows["text"], rows["label"], token_lists):
         data.append({"text": text, "tokens": tokens, "label": label})
         for _ in range(AUGMENTATIONS_PER_TEXT):
             aug_tokens = augment_tokens(tokens, rng)
@@ -176,10 +170,9 @@ def main():
     rng = random.Random(SEED)
     rows = load_base_rows()
     if USE_HF:
-        rows.extend(load_hf_rows())
+        rows = pd.concat([rows, load_hf_rows()], ignore_index=True)
     df = build_dataset(rows, rng)
-    os.makedirs(DATA_DIR, exist_ok=True)
-    df.to_csv(OUTPUT_FILE, index=False)
+    write_dataset(df, OUTPUT_FILE, SENTIMENT_SCHEMA)
     print(f"Dataset created and saved to {OUTPUT_FILE}")
     print(f"Total samples: {len(df)}")
     print(df.head())
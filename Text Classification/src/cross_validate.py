@@ -0,0 +1,118 @@
+import json
+import os
+import sys
+import time
+
+import torch
+from sklearn.model_selection import StratifiedKFold
+from torch.utils.data import DataLoader
+from transformers import AutoTokenizer, AutoModelForSequenceClassification
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))  # repo root, for common/
+from common.folds import run_folds, summarize
+from common.system import available_cores
+
+import train_model
+from dataset_io import column_list, read_table
+from token_cache import TokenCache
+from train_model import PadCollator, ThaiSentimentDataset, evaluate, train_epochs
+
+# K-fold cross-validation of the sentiment model, stratified by label. Folds
+# train concurrently in separate processes, each pinned to its own share of
+# the CPU cores, and all of them read the same cached token ids.
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DATA_FILE = train_model.DATA_FILE
+MODEL_NAME = os.getenv("MODEL_NAME", train_model.MODEL_NAME)
+FOLDS = int(os.getenv("FOLDS", "5"))
+# Folds trained at the same time; each gets THREADS_PER_FOLD cores
+PARALLEL_FOLDS = int(os.getenv("PARALLEL_FOLDS", "0")) or min(FOLDS, len(available_cores()))
+THREADS_PER_FOLD = int(os.getenv("THREADS_PER_FOLD", "0")) or max(1, len(available_cores()) // PARALLEL_FOLDS)
+NUM_EPOCHS = int(os.getenv("NUM_EPOCHS", str(train_model.NUM_EPOCHS)))
+OUTPUT_FILE = os.getenv("OUTPUT_FILE", os.path.join(BASE_DIR, "data", "cv_results.json"))
+
+
+def make_folds(labels, folds=FOLDS, seed=train_model.SEED):
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    return [(train_idx.tolist(), test_idx.tolist()) for train_idx, test_idx in splitter.split(labels, labels)]
+
+
+def run_fold(fold, train_idx, test_idx, model_name=MODEL_NAME, num_epochs=NUM_EPOCHS):
+    table = read_table(DATA_FILE)
+    texts = column_list(table, 'text')
+    labels = column_list(table, 'label')
+    tokens = column_list(table, 'tokens') or [None] * len(texts)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name, num_labels=5)
+    # Encoded once by the parent process; every fold loads the same cache file
+    encoded = TokenCache.load_or_encode(texts, tokenizer, DATA_FILE, max_length=train_model.MAX_LENGTH)
+
+    train_dataset = ThaiSentimentDataset(
+        [texts[i] for i in train_idx],
+        [labels[i] for i in train_idx],
+        tokenizer,
+        max_len=train_model.MAX_LENGTH,
+        tokens=[tokens[i] for i in train_idx],
+        augmentations=train_model.ONLINE_AUGMENTATIONS,
+        input_ids=[encoded[i] for i in train_idx],
+    )
+    test_dataset = ThaiSentimentDataset(
+        [texts[i] for i in test_idx],
+        [labels[i] for i in test_idx],
+        tokenizer,
+        max_len=train_model.MAX_LENGTH,
+        input_ids=[encoded[i] for i in test_idx],
+    )
+    collate = PadCollator(tokenizer.pad_token_id)
+    train_loader = DataLoader(train_dataset, batch_size=train_model.BATCH_SIZE, shuffle=True, collate_fn=collate)
+    test_loader = DataLoader(test_dataset, batch_size=train_model.BATCH_SIZE, collate_fn=collate)
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model.to(device)
+    torch.manual_seed(train_model.SEED + fold)
+    train_epochs(model, train_dataset, train_loader, device, num_epochs=num_epochs, log_prefix=f"[fold {fold}] ")
+    return evaluate(model, test_loader, device)
+
+
+def main():
+    table = read_table(DATA_FILE)
+    texts = column_list(table, 'text')
+    labels = column_list(table, 'label')
+
+    # Tokenize once up front so the fold processes only load the cache
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    TokenCache.load_or_encode(texts, tokenizer, DATA_FILE, max_length=train_model.MAX_LENGTH)
+
+    folds = make_folds(labels)
+    print(f"{FOLDS}-fold cross-validation on {len(texts)} texts: "
+          f"{PARALLEL_FOLDS} folds at a time x {THREADS_PER_FOLD} threads")
+    start = time.perf_counter()
+    fold_metrics = run_folds(folds, run_fold, (MODEL_NAME, NUM_EPOCHS), PARALLEL_FOLDS, THREADS_PER_FOLD)
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(fold_metrics)
+    for key, value in summary.items():
+        print(f"{key}: {value['mean']:.4f} ± {value['stdev']:.4f}")
+    print(f"Wall time {elapsed:.1f}s for {FOLDS} folds")
+
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "model": MODEL_NAME,
+                "data_file": DATA_FILE,
+                "folds": FOLDS,
+                "parallel_folds": PARALLEL_FOLDS,
+                "threads_per_fold": THREADS_PER_FOLD,
+                "wall_seconds": elapsed,
+                "per_fold": fold_metrics,
+                "summary": summary,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {OUTPUT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import ast
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+PARQUET_ROW_GROUP = int(os.getenv("PARQUET_ROW_GROUP", "50000"))
+
+# Labels are int64: Parquet dictionary/RLE encoding already stores the few
+# distinct values compactly, and any label value or sentinel fits.
+SENTIMENT_SCHEMA = pa.schema(
+    [
+        pa.field("text", pa.string()),
+        pa.field("tokens", pa.list_(pa.string())),
+        pa.field("label", pa.int64()),
+    ]
+)
+
+RELABELED_SCHEMA = pa.schema(
+    [
+        pa.field("text", pa.string()),
+        pa.field("label", pa.int64()),
+        pa.field("model_label", pa.string()),
+        pa.field("confidence", pa.float32()),
+    ]
+)
+
+
+def is_parquet(path):
+    return str(path).lower().endswith((".parquet", ".pq"))
+
+
+def parse_tokens(value):
+    # CSV files written by older versions store tokens as a Python list repr.
+    if isinstance(value, list):
+        return value
+    if not isinstance(value, str) or not value.startswith("["):
+        return None
+    return ast.literal_eval(value)
+
+
+def write_dataset(df, path, schema):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if not is_parquet(path):
+        df.to_csv(path, index=False)
+        return
+    columns = [name for name in schema.names if name in df.columns]
+    schema = pa.schema([schema.field(name) for name in columns])
+    with pq.ParquetWriter(path, schema, compression=PARQUET_COMPRESSION) as writer:
+        for start in range(0, len(df), PARQUET_ROW_GROUP):
+            chunk = df.iloc[start : start + PARQUET_ROW_GROUP][columns]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+
+
+def read_table(path, columns=None):
+    if is_parquet(path):
+        return pq.read_table(path, columns=columns, memory_map=True)
+    df = pd.read_csv(path, usecols=columns)
+    if "tokens" in df.columns:
+        df["tokens"] = df["tokens"].map(parse_tokens)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def read_frame(path, columns=None):
+    return read_table(path, columns=columns).to_pandas()
+
+
+def column_list(table, name):
+    if name not in table.column_names:
+        return None
+    return table.column(name).to_pylist()
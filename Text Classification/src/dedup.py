@@ -0,0 +1,133 @@
+import hashlib
+import os
+import re
+import unicodedata
+import zlib
+from difflib import SequenceMatcher
+
+import numpy as np
+
+SHINGLE_SIZE = int(os.getenv("SHINGLE_SIZE", "5"))
+MINHASH_PERM = int(os.getenv("MINHASH_PERM", "64"))
+LSH_BANDS = int(os.getenv("LSH_BANDS", "16"))
+# Signature agreement a candidate pair needs before the strict per-pair check
+# (same_content), which decides whether the pair is a near-duplicate
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.5"))
+# Representatives compared per text, in index order
+MAX_CANDIDATES = 32
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes. With a < 2**31
+# the products stay below 2**63, so everything fits in uint64.
+MERSENNE_PRIME = np.uint64(4294967311)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFC", str(text)).lower()
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def exact_key(text):
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).digest()
+
+
+def shingle_hashes(text, k=SHINGLE_SIZE):
+    if len(text) <= k:
+        return np.array([zlib.crc32(text.encode("utf-8"))], dtype=np.uint64)
+    return np.fromiter(
+        (zlib.crc32(text[i : i + k].encode("utf-8")) for i in range(len(text) - k + 1)),
+        dtype=np.uint64,
+    )
+
+
+class MinHasher:
+    def __init__(self, num_perm=MINHASH_PERM, seed=42):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2**31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 2**32, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        x = shingle_hashes(text)
+        return ((self.a[:, None] * x[None, :] + self.b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+
+def is_content_char(char):
+    # Letters, combining marks (Thai vowels and tone marks) and digits carry
+    # meaning; punctuation, symbols, emoji and spaces do not.
+    return unicodedata.category(char)[0] in "LMN"
+
+
+def is_elongation(segment, neighbours):
+    # "ดีมากกกก" vs "ดีมาก": the segment only repeats a character next to it
+    return any(neighbour and all(char == neighbour for char in segment) for neighbour in neighbours)
+
+
+def same_content(a, b):
+    # Strict check that b is a variant of a: the two may only differ in
+    # non-content characters or repeated-character elongation. Inserting a
+    # word such as "ไม่" or "not" always fails, whatever the overlap.
+    for op, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if op == "equal":
+            continue
+        removed, added = a[i1:i2], b[j1:j2]
+        if not any(map(is_content_char, removed + added)):
+            continue
+        if op == "delete" and is_elongation(removed, (a[i1 - 1 : i1], a[i2 : i2 + 1])):
+            continue
+        if op == "insert" and is_elongation(added, (b[j1 - 1 : j1], b[j2 : j2 + 1])):
+            continue
+        return False
+    return True
+
+
+def find_near_duplicates(texts, threshold=NEAR_DUP_THRESHOLD, num_perm=MINHASH_PERM, bands=LSH_BANDS):
+    # Index of the representative of every text (itself for representatives).
+    # LSH buckets only propose candidates; a text joins a representative after
+    # passing same_content against that representative itself, and members
+    # never become representatives, so A~B and B~C do not chain A to C.
+    rows = num_perm // bands
+    hasher = MinHasher(num_perm)
+    signatures = np.stack([hasher.signature(t) for t in texts]) if texts else np.zeros((0, num_perm), np.uint64)
+
+    buckets = [{} for _ in range(bands)]
+    rep_of = []
+    for i, text in enumerate(texts):
+        keys = [signatures[i, band * rows : (band + 1) * rows].tobytes() for band in range(bands)]
+        candidates = sorted({r for band, key in enumerate(keys) for r in buckets[band].get(key, ())})
+        rep = i
+        for r in candidates[:MAX_CANDIDATES]:
+            if np.mean(signatures[r] == signatures[i]) >= threshold and same_content(texts[r], text):
+                rep = r
+                break
+        rep_of.append(rep)
+        if rep == i:
+            for band, key in enumerate(keys):
+                buckets[band].setdefault(key, []).append(i)
+    return rep_of
+
+
+def deduplicate(texts, near=True):
+    # Returns, for every text, the index of the text whose prediction it
+    # should reuse, plus counts for reporting.
+    first_by_key = {}
+    rep_of = []
+    for i, text in enumerate(texts):
+        rep_of.append(first_by_key.setdefault(exact_key(text), i))
+    exact_reps = sorted(set(rep_of))
+
+    near_merged = 0
+    if near and len(exact_reps) > 1:
+        normalized = [normalize_text(texts[i]) for i in exact_reps]
+        roots = find_near_duplicates(normalized)
+        remap = {exact_reps[i]: exact_reps[root] for i, root in enumerate(roots)}
+        near_merged = sum(1 for i, root in enumerate(roots) if root != i)
+        rep_of = [remap[r] for r in rep_of]
+
+    stats = {
+        "texts": len(texts),
+        "exact_duplicates": len(texts) - len(exact_reps),
+        "near_duplicates": near_merged,
+        "representatives": len(exact_reps) - near_merged,
+    }
+    return rep_of, stats
@@ -0,0 +1,234 @@
+import copy
+import math
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from sklearn.model_selection import train_test_split
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from dataset_io import column_list, read_table
+from inference_pipeline import plan_batches
+
+try:
+    from transformers.masking_utils import create_bidirectional_mask
+except ImportError:  # transformers 4.x
+    create_bidirectional_mask = None
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model"))
+DATA_FILE = os.getenv("DATA_FILE", os.path.join(DATA_DIR, "thai_sentiment_dataset.parquet"))
+HEADS_FILE = os.getenv("HEADS_FILE", os.path.join(MODEL_PATH, "early_exit_heads.pt"))
+RETRAIN_HEADS = os.getenv("RETRAIN_HEADS", "0") == "1"
+SEED = int(os.getenv("SEED", "42"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "32"))
+MAX_LENGTH = int(os.getenv("MAX_LENGTH", "128"))
+HEAD_EPOCHS = int(os.getenv("HEAD_EPOCHS", "2"))
+HEAD_LR = float(os.getenv("HEAD_LR", "1e-3"))
+# Normalised entropy (0 = one-hot, 1 = uniform) below which a text exits.
+THRESHOLDS = [float(t) for t in os.getenv("THRESHOLDS", "0.05,0.1,0.2,0.3,0.4,0.5,0.6,0.8").split(",")]
+# Threshold used for the timed layer-by-layer run after the sweep.
+ENTROPY_THRESHOLD = float(os.getenv("ENTROPY_THRESHOLD", "0.3"))
+
+
+def normalized_entropy(probs):
+    return -(probs * torch.log(probs.clamp_min(1e-12))).sum(dim=-1) / math.log(probs.shape[-1])
+
+
+class EarlyExitClassifier:
+    # A frozen fine-tuned sequence classifier plus one head per intermediate
+    # layer. The heads are copies of the model's own classification head,
+    # trained on that layer's hidden states; the last layer keeps the original.
+    def __init__(self, model, heads=None):
+        self.model = model
+        self.model.eval()
+        for param in self.model.parameters():
+            param.requires_grad = False
+        self.base = model.base_model
+        self.num_layers = model.config.num_hidden_layers
+        self.heads = heads or torch.nn.ModuleList(
+            copy.deepcopy(model.classifier) for _ in range(self.num_layers - 1)
+        )
+        for param in self.heads.parameters():
+            param.requires_grad = True
+
+    def head(self, layer):
+        # layer is 1-based: the output of encoder layer `layer`.
+        return self.model.classifier if layer == self.num_layers else self.heads[layer - 1]
+
+    def save(self, path):
+        torch.save(self.heads.state_dict(), path)
+
+    def load_heads(self, path):
+        self.heads.load_state_dict(torch.load(path, map_location="cpu"))
+        self.heads.eval()
+
+    def train_heads(self, batches, epochs=HEAD_EPOCHS, lr=HEAD_LR):
+        # batches yields (encoding, labels). Hidden states come from the frozen
+        # model, so only the small heads receive gradients.
+        optimizer = torch.optim.AdamW(self.heads.parameters(), lr=lr)
+        for epoch in range(epochs):
+            self.heads.train()
+            total = 0.0
+            steps = 0
+            for enc, labels in batches():
+                with torch.no_grad():
+                    hidden = self.model(**enc, output_hidden_states=True).hidden_states
+                loss = sum(
+                    F.cross_entropy(self.heads[i](hidden[i + 1]), labels) for i in range(self.num_layers - 1)
+                )
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+                total += loss.item()
+                steps += 1
+            print(f"Head epoch {epoch + 1}: mean loss per head {total / max(1, steps) / (self.num_layers - 1):.4f}")
+        self.heads.eval()
+
+    @torch.no_grad()
+    def all_layer_probs(self, enc):
+        # Probabilities from every exit, shape (layers, batch, labels), for
+        # simulating any threshold from one full pass.
+        hidden = self.model(**enc, output_hidden_states=True).hidden_states
+        return torch.stack(
+            [torch.softmax(self.head(layer)(hidden[layer]), dim=-1) for layer in range(1, self.num_layers + 1)]
+        )
+
+    def _attention_mask(self, embeddings, attention_mask):
+        if create_bidirectional_mask is not None:
+            return create_bidirectional_mask(
+                config=self.model.config, inputs_embeds=embeddings, attention_mask=attention_mask
+            )
+        return self.base.get_extended_attention_mask(attention_mask, attention_mask.shape)
+
+    @torch.no_grad()
+    def predict(self, enc, threshold):
+        # Runs the encoder one layer at a time and drops texts from the batch
+        # as soon as their exit is confident enough. Returns probabilities and
+        # the number of layers each text used.
+        batch_size = enc["input_ids"].shape[0]
+        probs = torch.zeros(batch_size, self.model.config.num_labels)
+        exit_layer = torch.full((batch_size,), self.num_layers, dtype=torch.long)
+        active = torch.arange(batch_size)
+
+        hidden = self.base.embeddings(input_ids=enc["input_ids"])
+        mask = self._attention_mask(hidden, enc["attention_mask"])
+        for layer in range(1, self.num_layers + 1):
+            out = self.base.encoder.layer[layer - 1](hidden, mask)
+            hidden = out[0] if isinstance(out, tuple) else out
+            layer_probs = torch.softmax(self.head(layer)(hidden), dim=-1)
+            if layer == self.num_layers:
+                done = torch.ones(len(active), dtype=torch.bool)
+            else:
+                done = normalized_entropy(layer_probs) < threshold
+            probs[active[done]] = layer_probs[done]
+            exit_layer[active[done]] = layer
+            keep = ~done
+            if not keep.any():
+                break
+            active = active[keep]
+            hidden = hidden[keep]
+            if mask is not None:
+                mask = mask[keep]
+        return probs, exit_layer
+
+
+def encode_batches(tokenizer, texts, labels=None, shuffle_seed=None):
+    encoded = tokenizer(texts, truncation=True, max_length=MAX_LENGTH)
+    batches = plan_batches([len(ids) for ids in encoded["input_ids"]], BATCH_SIZE)
+    rng = np.random.default_rng(shuffle_seed)
+
+    def generate():
+        # A fresh batch order on every call (i.e. every epoch) when shuffling.
+        order = list(range(len(batches)))
+        if shuffle_seed is not None:
+            rng.shuffle(order)
+        for b in order:
+            batch = batches[b]
+            features = {k: [encoded[k][i] for i in batch] for k in ("input_ids", "attention_mask")}
+            enc = tokenizer.pad(features, padding=True, return_tensors="pt")
+            if labels is None:
+                yield batch, enc
+            else:
+                yield enc, torch.tensor([labels[i] for i in batch], dtype=torch.long)
+
+    return generate
+
+
+def sweep(classifier, tokenizer, texts, labels):
+    layer_probs = torch.zeros(classifier.num_layers, len(texts), classifier.model.config.num_labels)
+    for batch, enc in encode_batches(tokenizer, texts)():
+        layer_probs[:, batch] = classifier.all_layer_probs(enc)
+
+    labels = torch.tensor(labels)
+    entropy = normalized_entropy(layer_probs)
+    preds = layer_probs.argmax(dim=-1)
+    print("Accuracy per exit: " + ", ".join(
+        f"L{layer + 1} {(preds[layer] == labels).float().mean():.3f}" for layer in range(classifier.num_layers)
+    ))
+    print(f"{'threshold':>9}  {'accuracy':>8}  {'avg layers':>10}  {'speedup':>7}")
+    for threshold in THRESHOLDS:
+        confident = entropy < threshold
+        confident[-1] = True
+        exit_index = confident.float().argmax(dim=0)
+        chosen = preds.gather(0, exit_index[None]).squeeze(0)
+        avg_layers = (exit_index + 1).float().mean().item()
+        accuracy = (chosen == labels).float().mean().item()
+        print(f"{threshold:9.2f}  {accuracy:8.4f}  {avg_layers:10.2f}  {classifier.num_layers / avg_layers:6.2f}x")
+
+
+def main():
+    torch.manual_seed(SEED)
+    table = read_table(DATA_FILE, columns=["text", "label"])
+    texts = [str(t) for t in column_list(table, "text")]
+    labels = column_list(table, "label")
+    # Same split as train_model.py
+    train_idx, test_idx = train_test_split(np.arange(len(texts)), test_size=0.2, random_state=SEED)
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
+    model = AutoModelForSequenceClassification.from_pretrained(MODEL_PATH)
+    classifier = EarlyExitClassifier(model)
+    if os.path.exists(HEADS_FILE) and not RETRAIN_HEADS:
+        classifier.load_heads(HEADS_FILE)
+        print(f"Loaded exit heads from {HEADS_FILE}")
+    else:
+        train_batches = encode_batches(
+            tokenizer, [texts[i] for i in train_idx], [labels[i] for i in train_idx], shuffle_seed=SEED
+        )
+        classifier.train_heads(train_batches)
+        classifier.save(HEADS_FILE)
+        print(f"Exit heads saved to {HEADS_FILE}")
+
+    test_texts = [texts[i] for i in test_idx]
+    test_labels = [labels[i] for i in test_idx]
+    sweep(classifier, tokenizer, test_texts, test_labels)
+
+    # Timed run of the real layer-by-layer path against the plain model
+    batches = list(encode_batches(tokenizer, test_texts)())
+    start = time.perf_counter()
+    with torch.no_grad():
+        for _, enc in batches:
+            model(**enc)
+    full_secs = time.perf_counter() - start
+
+    correct = 0
+    layers_used = 0
+    start = time.perf_counter()
+    for batch, enc in batches:
+        probs, exit_layer = classifier.predict(enc, ENTROPY_THRESHOLD)
+        correct += sum(int(p == test_labels[i]) for i, p in zip(batch, probs.argmax(dim=-1).tolist()))
+        layers_used += int(exit_layer.sum())
+    exit_secs = time.perf_counter() - start
+    print(
+        f"Threshold {ENTROPY_THRESHOLD}: accuracy {correct / len(test_texts):.4f}, "
+        f"avg layers {layers_used / len(test_texts):.2f}, "
+        f"{full_secs:.2f}s full model vs {exit_secs:.2f}s early exit"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from sklearn.model_selection import train_test_split
+from transformers import AutoConfig, AutoModel, AutoTokenizer
+
+from dataset_io import column_list, read_table
+from inference_pipeline import plan_batches
+from prediction_cache import model_cache_key, resolve_revision, text_hash
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+DATA_FILE = os.getenv("DATA_FILE", os.path.join(DATA_DIR, "thai_sentiment_dataset.parquet"))
+ENCODER_NAME = os.getenv("ENCODER_NAME", "airesearch/wangchanberta-base-att-spm-uncased")
+EMBEDDING_DIR = os.getenv("EMBEDDING_DIR", os.path.join(DATA_DIR, "embeddings"))
+# Where TRAIN_MODE=features saves the trained head, next to the vectors it reads
+HEAD_FILE = os.getenv("HEAD_FILE", os.path.join(EMBEDDING_DIR, "feature_head.pt"))
+# "cls" (first token, what the classification head reads) or "mean".
+POOLING = os.getenv("POOLING", "cls")
+# Store the pooled vector of every encoder layer instead of only the last.
+PER_LAYER = os.getenv("PER_LAYER", "0") == "1"
+# Layer whose vectors the head is trained on (-1 = last; needs PER_LAYER=1 otherwise).
+FEATURE_LAYER = int(os.getenv("FEATURE_LAYER", "-1"))
+MAX_LENGTH = int(os.getenv("MAX_LENGTH", "128"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "32"))
+SEED = int(os.getenv("SEED", "42"))
+HEAD_EPOCHS = int(os.getenv("HEAD_EPOCHS", "30"))
+HEAD_LR = float(os.getenv("HEAD_LR", "1e-3"))
+# 0 = linear head; otherwise the size of one hidden layer.
+HEAD_HIDDEN = int(os.getenv("HEAD_HIDDEN", "0"))
+# Optional label remapping for label-scheme experiments, e.g. "0:0,1:0,2:1,3:2,4:2".
+LABEL_MAP = os.getenv("LABEL_MAP", "")
+
+
+class EmbeddingCache:
+    # Pooled encoder outputs as a float16 memmap of shape (rows, layers, dim),
+    # one directory per model key. Rows are appended; hashes.bin holds the
+    # 16-byte text hash of each row in the same order.
+    def __init__(self, directory, model_key, dim, layers):
+        self.model_key = model_key
+        digest = hashlib.blake2b(model_key.encode("utf-8"), digest_size=8).hexdigest()
+        self.path = os.path.join(directory, digest)
+        os.makedirs(self.path, exist_ok=True)
+        self.vectors_path = os.path.join(self.path, "vectors.f16")
+        self.hashes_path = os.path.join(self.path, "hashes.bin")
+        self.row_shape = (layers, dim)
+        self.row_bytes = layers * dim * 2
+
+        meta_path = os.path.join(self.path, "meta.json")
+        meta = {"model_key": model_key, "layers": layers, "dim": dim}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved != meta:
+                raise ValueError(f"Embedding cache at {self.path} was built with {saved}, not {meta}")
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, indent=2)
+
+        self.index = {}
+        if os.path.exists(self.hashes_path):
+            with open(self.hashes_path, "rb") as f:
+                data = f.read()
+            # A run interrupted between the two writes leaves extra vectors;
+            # only rows with a hash count.
+            rows = min(len(data) // 16, os.path.getsize(self.vectors_path) // self.row_bytes)
+            self.index = {data[i * 16 : (i + 1) * 16].hex(): i for i in range(rows)}
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, hashes, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float16).reshape(len(hashes), *self.row_shape)
+        start = len(self.index)
+        with open(self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "wb") as f:
+            f.seek(start * self.row_bytes)
+            f.write(vectors.tobytes())
+            f.truncate()
+        with open(self.hashes_path, "r+b" if os.path.exists(self.hashes_path) else "wb") as f:
+            f.seek(start * 16)
+            f.write(b"".join(bytes.fromhex(h) for h in hashes))
+            f.truncate()
+        for i, h in enumerate(hashes):
+            self.index[h] = start + i
+
+    def vectors(self):
+        return np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(len(self.index), *self.row_shape))
+
+
+def pool(hidden, attention_mask):
+    if POOLING == "mean":
+        mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+        return (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp_min(1)
+    return hidden[:, 0]
+
+
+def open_cache(encoder_name=ENCODER_NAME):
+    # Only the config is needed here, so fully cached runs never load the model.
+    config = AutoConfig.from_pretrained(encoder_name)
+    layers = config.num_hidden_layers if PER_LAYER else 1
+    revision = resolve_revision(encoder_name, "main")
+    key = f"{model_cache_key(encoder_name, revision, MAX_LENGTH)}:{POOLING}:{'layers' if PER_LAYER else 'last'}"
+    return EmbeddingCache(EMBEDDING_DIR, key, config.hidden_size, layers)
+
+
+def embed_texts(texts, cache, encoder_name=ENCODER_NAME):
+    # Runs the encoder only over texts not in the cache and returns an array of
+    # shape (len(texts), layers, dim) read from the memmap.
+    hashes = [text_hash(t) for t in texts]
+    missing = {}
+    for h, text in zip(hashes, texts):
+        if h not in cache.index and h not in missing:
+            missing[h] = text
+
+    if missing:
+        tokenizer = AutoTokenizer.from_pretrained(encoder_name)
+        encoder = AutoModel.from_pretrained(encoder_name)
+        encoder.eval()
+        missing_hashes = list(missing)
+        missing_texts = list(missing.values())
+        encoded = tokenizer(missing_texts, truncation=True, max_length=MAX_LENGTH)
+        start = time.perf_counter()
+        done = 0
+        for batch in plan_batches([len(ids) for ids in encoded["input_ids"]], BATCH_SIZE):
+            features = {k: [encoded[k][i] for i in batch] for k in ("input_ids", "attention_mask")}
+            enc = tokenizer.pad(features, padding=True, return_tensors="pt")
+            with torch.no_grad():
+                out = encoder(**enc, output_hidden_states=PER_LAYER)
+            if PER_LAYER:
+                pooled = torch.stack([pool(h, enc["attention_mask"]) for h in out.hidden_states[1:]], dim=1)
+            else:
+                pooled = pool(out.last_hidden_state, enc["attention_mask"]).unsqueeze(1)
+            cache.append([missing_hashes[i] for i in batch], pooled.float().numpy())
+            done += len(batch)
+        print(f"Encoded {done} new texts in {time.perf_counter() - start:.1f}s ({len(cache)} cached)")
+
+    rows = np.array([cache.index[h] for h in hashes], dtype=np.int64)
+    return cache.vectors()[rows]
+
+
+def build_head(dim, num_labels, hidden=HEAD_HIDDEN):
+    if hidden:
+        return torch.nn.Sequential(
+            torch.nn.Linear(dim, hidden), torch.nn.Tanh(), torch.nn.Dropout(0.1), torch.nn.Linear(hidden, num_labels)
+        )
+    return torch.nn.Linear(dim, num_labels)
+
+
+def train_head(features, labels, num_labels, epochs=HEAD_EPOCHS, lr=HEAD_LR, batch_size=256):
+    torch.manual_seed(SEED)
+    x = torch.from_numpy(np.asarray(features, dtype=np.float32))
+    y = torch.tensor(labels, dtype=torch.long)
+    head = build_head(x.shape[1], num_labels)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=lr)
+    for _ in range(epochs):
+        head.train()
+        for batch in torch.randperm(len(x)).split(batch_size):
+            optimizer.zero_grad()
+            F.cross_entropy(head(x[batch]), y[batch]).backward()
+            optimizer.step()
+    head.eval()
+    return head
+
+
+def head_accuracy(head, features, labels):
+    with torch.no_grad():
+        preds = head(torch.from_numpy(np.asarray(features, dtype=np.float32))).argmax(dim=-1)
+    return (preds == torch.tensor(labels)).float().mean().item()
+
+
+def parse_label_map(spec):
+    return {int(k): int(v) for k, v in (pair.split(":") for pair in spec.split(",") if pair.strip())}
+
+
+def train_feature_head(train_texts, train_labels, test_texts, test_labels, head_file=None):
+    # Feature-extraction training: encode once (cached), then fit only a head.
+    cache = open_cache()
+    features = embed_texts(list(train_texts) + list(test_texts), cache)[:, FEATURE_LAYER]
+    train_x, test_x = features[: len(train_texts)], features[len(train_texts) :]
+
+    if LABEL_MAP:
+        mapping = parse_label_map(LABEL_MAP)
+        train_labels = [mapping[label] for label in train_labels]
+        test_labels = [mapping[label] for label in test_labels]
+    num_labels = max(max(train_labels), max(test_labels)) + 1
+
+    start = time.perf_counter()
+    head = train_head(train_x, train_labels, num_labels)
+    print(f"Head trained on {len(train_labels)} texts in {time.perf_counter() - start:.1f}s")
+    print(f"Train accuracy: {head_accuracy(head, train_x, train_labels):.4f}")
+    print(f"Test accuracy: {head_accuracy(head, test_x, test_labels):.4f}")
+
+    if head_file:
+        os.makedirs(os.path.dirname(os.path.abspath(head_file)), exist_ok=True)
+        torch.save(
+            {
+                "encoder": ENCODER_NAME,
+                "cache_key": cache.model_key,
+                "pooling": POOLING,
+                "layer": FEATURE_LAYER,
+                "hidden": HEAD_HIDDEN,
+                "num_labels": num_labels,
+                "state_dict": head.state_dict(),
+            },
+            head_file,
+        )
+        print(f"Feature head saved to {head_file}")
+    return head
+
+
+def main():
+    table = read_table(DATA_FILE, columns=["text", "label"])
+    texts = [str(t) for t in column_list(table, "text")]
+    labels = column_list(table, "label")
+    # Same split as train_model.py
+    train_texts, test_texts, train_labels, test_labels = train_test_split(
+        texts, labels, test_size=0.2, random_state=SEED
+    )
+    train_feature_head(train_texts, train_labels, test_texts, test_labels)
+
+
+if __name__ == "__main__":
+    main()
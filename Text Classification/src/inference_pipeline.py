@@ -0,0 +1,123 @@
+import copy
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+
+def plan_batches(lengths, batch_size=32, max_tokens=0):
+    # Sort by length so each batch pads to a similar length. With max_tokens,
+    # batches are filled up to that many padded tokens instead of batch_size.
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches = []
+    current = []
+    for idx in order:
+        if current:
+            if max_tokens:
+                full = lengths[idx] * (len(current) + 1) > max_tokens
+            else:
+                full = len(current) >= batch_size
+            if full:
+                batches.append(current)
+                current = []
+        current.append(idx)
+    if current:
+        batches.append(current)
+    return batches
+
+
+class StageTimer:
+    def __init__(self):
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def summary(self):
+        return ", ".join(f"{name} {secs:.2f}s" for name, secs in self.totals.items())
+
+
+def padded_batches(encoded, batch, tokenizer):
+    features = {key: [encoded[key][i] for i in batch] for key in encoded.keys()}
+    return tokenizer.pad(features, padding=True, return_tensors="pt")
+
+
+def iter_sequential_batches(texts, tokenizer, timer, max_length=128, batch_size=32, max_tokens=0):
+    # Tokenize everything once, then batch by token length and pad per batch.
+    with timer.stage("tokenize"):
+        encoded = tokenizer(texts, truncation=True, max_length=max_length)
+    batches = plan_batches([len(ids) for ids in encoded["input_ids"]], batch_size, max_tokens)
+
+    def generate():
+        for batch in batches:
+            with timer.stage("pad"):
+                enc = padded_batches(encoded, batch, tokenizer)
+            yield batch, enc
+
+    return len(batches), generate()
+
+
+def iter_prefetched_batches(
+    texts, tokenizer, timer, workers, prefetch=4, max_length=128, batch_size=32, max_tokens=0, chunk_size=4096
+):
+    # Worker threads tokenize chunks of chunk_size texts with one bulk call
+    # each (the Rust tokenizer parallelises inside it and releases the GIL),
+    # plan batches inside the chunk by real, truncated token length and queue
+    # the padded batches, so tokenizing the next chunk overlaps the model
+    # running on this one. The batch count is only known at the end (None).
+    chunks = queue.Queue()
+    for start in range(0, len(texts), chunk_size):
+        chunks.put(range(start, min(start + chunk_size, len(texts))))
+    ready = queue.Queue(maxsize=max(1, prefetch))
+
+    def worker(tok):
+        while True:
+            try:
+                chunk = chunks.get_nowait()
+            except queue.Empty:
+                break
+            start = time.perf_counter()
+            try:
+                encoded = tok([texts[i] for i in chunk], truncation=True, max_length=max_length)
+                batches = plan_batches([len(ids) for ids in encoded["input_ids"]], batch_size, max_tokens)
+                padded = [([chunk[i] for i in batch], padded_batches(encoded, batch, tok)) for batch in batches]
+            except Exception as exc:  # surfaced in the consumer thread
+                ready.put(exc)
+                return
+            timer.add("tokenize (workers)", time.perf_counter() - start)
+            for item in padded:
+                ready.put(item)
+        ready.put(None)
+
+    # Fast tokenizers refuse concurrent calls on one instance, so every worker
+    # gets its own copy.
+    threads = [
+        threading.Thread(target=worker, args=(copy.deepcopy(tokenizer),), daemon=True)
+        for _ in range(max(1, min(workers, chunks.qsize())))
+    ]
+    for thread in threads:
+        thread.start()
+
+    def generate():
+        finished = 0
+        while finished < len(threads):
+            with timer.stage("wait"):
+                item = ready.get()
+            if item is None:
+                finished += 1
+                continue
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    return None, generate()
@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import traceback
+
+import torch
+import torch.multiprocessing as mp
+from transformers import AutoModelForSequenceClassification
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))  # repo root, for common/
+from common.system import available_cores, partition_cores
+
+# Resident memory of a spawned replica before its weights are loaded (Python,
+# torch and transformers imported), measured on Linux
+REPLICA_OVERHEAD_BYTES = 800 * 2**20
+# Room for activations and allocator slack on top of the weights
+ACTIVATION_FACTOR = 1.5
+MEMORY_FRACTION = 0.8
+
+
+def available_memory_bytes():
+    try:
+        import psutil
+
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def replica_memory_bytes(config):
+    # Weights are sized on the meta device, so nothing is allocated or downloaded.
+    with torch.device("meta"):
+        model = AutoModelForSequenceClassification.from_config(config)
+    weights = sum(p.numel() * p.element_size() for p in model.parameters())
+    return int(weights * ACTIVATION_FACTOR) + REPLICA_OVERHEAD_BYTES
+
+
+def max_replicas_for_memory(config, available=None):
+    # Replicas that fit in MEMORY_FRACTION of the available memory (None if unknown).
+    available = available if available is not None else available_memory_bytes()
+    if available is None:
+        return None
+    return max(1, int(available * MEMORY_FRACTION) // replica_memory_bytes(config))
+
+
+def candidate_layouts(num_cores, max_replicas=None):
+    # (replicas, threads per replica) pairs that use every core, with at most
+    # max_replicas replicas.
+    limit = min(num_cores, max_replicas or num_cores)
+    return [(n, num_cores // n) for n in range(1, limit + 1) if num_cores % n == 0]
+
+
+def _replica_main(model_name, revision, cores, threads, tasks, results):
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name, revision=revision)
+        model.eval()
+    except Exception:
+        results.put((None, None, traceback.format_exc()))
+        return
+    results.put((None, "ready", None))
+
+    while True:
+        item = tasks.get()
+        if item is None:
+            break
+        batch_id, enc = item
+        try:
+            with torch.no_grad():
+                probs = torch.softmax(model(**enc).logits, dim=-1).tolist()
+            results.put((batch_id, probs, None))
+        except Exception:
+            results.put((batch_id, None, traceback.format_exc()))
+
+
+class InferencePool:
+    # N model replicas in separate processes, each pinned to its own cores.
+    # Batches go through a shared task queue; results come back in order.
+    def __init__(self, model_name, config, replicas, threads_per_replica, revision="main", in_flight_per_replica=2):
+        self.model_name = model_name
+        self.config = config
+        self.replicas = replicas
+        self.threads_per_replica = threads_per_replica
+        self.revision = revision
+        self.max_in_flight = replicas * in_flight_per_replica
+        self.processes = []
+
+    def start(self):
+        ctx = mp.get_context("spawn")
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        for cores in partition_cores(self.replicas, self.threads_per_replica):
+            process = ctx.Process(
+                target=_replica_main,
+                args=(self.model_name, self.revision, cores, self.threads_per_replica, self.tasks, self.results),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        for _ in self.processes:
+            _, _, error = self.results.get()
+            if error:
+                self.close()
+                raise RuntimeError(f"Model replica failed to start:\n{error}")
+        return self
+
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=30)
+        self.processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def map(self, batches):
+        # batches yields (indices, encoding); yields (indices, probs) in the
+        # same order while keeping every replica busy.
+        batches = iter(batches)
+        pending = {}
+        finished = {}
+        next_submit = next_out = 0
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self.max_in_flight:
+                try:
+                    indices, enc = next(batches)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[next_submit] = indices
+                self.tasks.put((next_submit, dict(enc)))
+                next_submit += 1
+            if not pending:
+                return
+            batch_id, probs, error = self.results.get()
+            if error:
+                raise RuntimeError(f"Model replica failed:\n{error}")
+            finished[batch_id] = (pending.pop(batch_id), probs)
+            while next_out in finished:
+                yield finished.pop(next_out)
+                next_out += 1
+
+
+def autotune_layout(model_name, config, batches, revision="main", layouts=None):
+    # Times every (replicas, threads) layout that fits in memory on the same
+    # sample batches and returns the fastest one with the measured samples/sec
+    # per layout.
+    if layouts is None:
+        limit = max_replicas_for_memory(config)
+        if limit is not None:
+            print(f"  Memory allows at most {limit} replicas")
+        layouts = candidate_layouts(len(available_cores()), limit)
+    samples = sum(len(indices) for indices, _ in batches)
+    results = {}
+    for replicas, threads in layouts:
+        with InferencePool(model_name, config, replicas, threads, revision=revision) as pool:
+            warmup = batches[:replicas]
+            for _ in pool.map(warmup):
+                pass
+            start = time.perf_counter()
+            for _ in pool.map(batches):
+                pass
+            results[(replicas, threads)] = samples / (time.perf_counter() - start)
+        print(f"  {replicas} replicas x {threads} threads: {results[(replicas, threads)]:.1f} samples/s")
+    best = max(results, key=results.get)
+    return best, results
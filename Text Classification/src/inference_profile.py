@@ -0,0 +1,67 @@
+import json
+import os
+from contextlib import nullcontext
+
+import torch
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PROFILE_DIR = os.path.join(BASE_DIR, "data", "profiles")
+PROFILE_NAME = "inference_profile.json"
+USE_PROFILE = os.getenv("INFERENCE_PROFILE", "1") == "1"
+
+
+def profile_path(model_name):
+    # Local checkpoints keep their profile next to the weights; hub models
+    # get one under data/profiles.
+    if os.path.isdir(model_name):
+        return os.path.join(model_name, PROFILE_NAME)
+    return os.path.join(PROFILE_DIR, model_name.replace("/", "__") + ".json")
+
+
+def load_profile(model_name):
+    path = profile_path(model_name)
+    if not USE_PROFILE or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_profile(model_name, profile):
+    path = profile_path(model_name)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    return path
+
+
+def setting(profile, env_name, key, default, cast=int):
+    # Explicit environment variables win over the tuned profile.
+    value = os.getenv(env_name)
+    if value is not None and value != "":
+        return cast(value)
+    return cast(profile.get(key, default))
+
+
+def apply_threads(profile):
+    intra = setting(profile, "INTRA_OP_THREADS", "intra_op_threads", 0)
+    inter = setting(profile, "INTEROP_THREADS", "interop_threads", 0)
+    if intra:
+        torch.set_num_threads(intra)
+    if inter:
+        try:
+            torch.set_num_interop_threads(inter)
+        except RuntimeError:
+            # Only allowed before the first inter-op parallel work.
+            pass
+
+
+def prepare_model(model, backend):
+    if backend == "compile":
+        return torch.compile(model)
+    return model
+
+
+def forward_context(backend):
+    if backend == "bf16":
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return nullcontext()
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from array import array
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def resolve_revision(model_name, revision):
+    # Branch and tag names move; predictions are cached under the commit sha
+    # they resolve to, so a hub update starts a fresh cache entry.
+    if os.path.isdir(model_name) or re.fullmatch(r"[0-9a-f]{40}", revision):
+        return revision
+    try:
+        from huggingface_hub import HfApi
+
+        return HfApi().model_info(model_name, revision=revision).sha
+    except Exception as error:
+        # Offline: the sha of the locally cached snapshot of that revision
+        from huggingface_hub import snapshot_download
+
+        try:
+            path = snapshot_download(model_name, revision=revision, local_files_only=True)
+        except Exception:
+            raise RuntimeError(f"Cannot resolve {model_name}@{revision} to a commit sha: {error}") from error
+        return os.path.basename(path)
+
+
+def model_cache_key(model_name, revision, max_length):
+    if os.path.isdir(model_name):
+        # Local checkpoints have no revision; use the weights' mtime so that
+        # retraining in place invalidates old predictions.
+        stamps = [
+            int(os.path.getmtime(os.path.join(model_name, name)))
+            for name in sorted(os.listdir(model_name))
+            if name.endswith((".safetensors", ".bin"))
+        ]
+        revision = "-".join(map(str, stamps)) or revision
+    return f"{model_name}@{revision}:{max_length}"
+
+
+class PredictionCache:
+    def __init__(self, path, model_key):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.model_key = model_key
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "model_key TEXT NOT NULL, text_hash TEXT NOT NULL, probs BLOB NOT NULL, "
+            "PRIMARY KEY (model_key, text_hash)) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS models (model_key TEXT PRIMARY KEY, id2label TEXT NOT NULL)")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def get_id2label(self):
+        row = self.conn.execute("SELECT id2label FROM models WHERE model_key = ?", (self.model_key,)).fetchone()
+        if row is None:
+            return None
+        return {int(k): v for k, v in json.loads(row[0]).items()}
+
+    def set_id2label(self, id2label):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO models (model_key, id2label) VALUES (?, ?)",
+            (self.model_key, json.dumps({str(k): v for k, v in id2label.items()}, ensure_ascii=False)),
+        )
+        self.conn.commit()
+
+    def get_many(self, hashes, chunk_size=500):
+        found = {}
+        hashes = list(hashes)
+        for start in range(0, len(hashes), chunk_size):
+            chunk = hashes[start : start + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT text_hash, probs FROM predictions WHERE model_key = ? AND text_hash IN ({placeholders})",
+                [self.model_key, *chunk],
+            )
+            for key, blob in rows:
+                probs = array("f")
+                probs.frombytes(blob)
+                found[key] = probs.tolist()
+        return found
+
+    def put_many(self, items):
+        # Committed per call so an interrupted run keeps every finished batch.
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO predictions (model_key, text_hash, probs) VALUES (?, ?, ?)",
+            [(self.model_key, key, array("f", probs).tobytes()) for key, probs in items],
+        )
+        self.conn.commit()
@@ -0,0 +1,294 @@
+import copy
+import hashlib
+import json
+import os
+import time
+
+import torch
+from tokenizers import Tokenizer, pre_tokenizers
+from transformers import AutoTokenizer, AutoModelForSequenceClassification, PreTrainedTokenizerFast
+
+from dataset_io import column_list, read_table
+
+# Shrinks a fine-tuned model to the part of its vocabulary our data actually
+# uses: ids are counted over the sentiment dataset and ThaiNER.jsonl, the
+# unused ones are dropped from the tokenizer and the embedding matrix, and the
+# pruned model is checked against the original on texts held out of counting.
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model"))
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", MODEL_PATH.rstrip("/\\") + "-pruned")
+DATA_FILE = os.getenv("DATA_FILE", os.path.join(BASE_DIR, "data", "thai_sentiment_dataset.parquet"))
+NER_FILE = os.getenv(
+    "NER_FILE", os.path.join(BASE_DIR, "..", "Thai Named Entity Recognition Corpus", "data", "ThaiNER.jsonl")
+)
+# More texts to count, e.g. logged production traffic (plain text, one per line)
+EXTRA_FILES = [path for path in os.getenv("EXTRA_FILES", "").split(",") if path]
+MAX_LENGTH = int(os.getenv("MAX_LENGTH", "512"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "32"))
+# Percentage of texts (by hash) left out of counting and used to verify the
+# pruned model, so the check covers text it was not pruned for
+HOLDOUT_PERCENT = int(os.getenv("HOLDOUT_PERCENT", "10"))
+# Held-out texts used to check predictions (0 = all of them)
+VERIFY_SAMPLE = int(os.getenv("VERIFY_SAMPLE", "0"))
+# Largest share of held-out texts whose predicted label may change
+MAX_LABEL_CHANGES = float(os.getenv("MAX_LABEL_CHANGES", "0.01"))
+CONFIG_TOKEN_KEYS = ("pad_token_id", "bos_token_id", "eos_token_id", "sep_token_id", "cls_token_id")
+
+
+def load_texts():
+    texts = []
+    if os.path.exists(DATA_FILE):
+        texts.extend(column_list(read_table(DATA_FILE, columns=["text"]), "text"))
+    if os.path.exists(NER_FILE):
+        with open(NER_FILE, encoding="utf-8") as f:
+            for line in f:
+                item = json.loads(line)
+                if item.get("tokens"):
+                    texts.append("".join(item["tokens"]))
+    for path in EXTRA_FILES:
+        with open(path, encoding="utf-8") as f:
+            texts.extend(line.rstrip("\n") for line in f)
+    texts = [text for text in texts if text]
+    if not texts:
+        raise SystemExit(f"No texts found in {DATA_FILE} or {NER_FILE}")
+    return texts
+
+
+def split_holdout(texts, percent=HOLDOUT_PERCENT):
+    # (counted, held out); membership depends only on the text
+    counted, held_out = [], []
+    for text in texts:
+        bucket = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big") % 100
+        (held_out if bucket < percent else counted).append(text)
+    return counted, held_out
+
+
+def count_used_ids(tokenizer, texts, batch_size=1024):
+    used = set()
+    for i in range(0, len(texts), batch_size):
+        encoded = tokenizer(texts[i : i + batch_size], truncation=True, max_length=MAX_LENGTH)
+        for ids in encoded["input_ids"]:
+            used.update(ids)
+    return used
+
+
+def parse_merge(merge):
+    # tokenizer.json stores merges as "a b" strings or [a, b] pairs
+    return tuple(merge.split(" ", 1)) if isinstance(merge, str) else tuple(merge)
+
+
+def uses_byte_level(component):
+    # True if a (possibly nested Sequence) pre-tokenizer maps text to bytes
+    if not component:
+        return False
+    if component["type"] == "ByteLevel":
+        return True
+    return any(uses_byte_level(c) for c in component.get("pretokenizers", ()))
+
+
+def keep_ids(tokenizer_json, used_ids, special_ids):
+    # Used and special ids, plus what each model type needs to produce them:
+    # for BPE every token a kept token is merged from, for both BPE and
+    # Unigram every single-character token (and every byte for byte-level
+    # or byte-fallback BPE) so unseen text still has a segmentation.
+    model = tokenizer_json["model"]
+    keep = set(used_ids) | set(special_ids)
+    if model["type"] == "BPE":
+        vocab = model["vocab"]
+        prefix = model.get("continuing_subword_prefix") or ""
+        suffix = model.get("end_of_word_suffix") or ""
+        for token, i in vocab.items():
+            if prefix and token.startswith(prefix):
+                token = token[len(prefix):]
+            if suffix and token.endswith(suffix):
+                token = token[: -len(suffix)]
+            if len(token) == 1:
+                keep.add(i)
+        if uses_byte_level(tokenizer_json.get("pre_tokenizer")):
+            keep |= {vocab[char] for char in pre_tokenizers.ByteLevel.alphabet() if char in vocab}
+        if model.get("byte_fallback"):
+            keep |= {vocab[f"<0x{byte:02X}>"] for byte in range(256) if f"<0x{byte:02X}>" in vocab}
+        id_to_token = {i: token for token, i in vocab.items()}
+        parts = {}
+        for merge in model["merges"]:
+            left, right = parse_merge(merge)
+            parts.setdefault(left + right, (left, right))
+        stack = [id_to_token[i] for i in keep if i in id_to_token]
+        while stack:
+            for part in parts.get(stack.pop(), ()):
+                if vocab[part] not in keep:
+                    keep.add(vocab[part])
+                    stack.append(part)
+    elif model["type"] == "Unigram":
+        for i, (piece, _) in enumerate(model["vocab"]):
+            if len(piece.lstrip("▁")) <= 1:
+                keep.add(i)
+    else:
+        raise ValueError(f"Pruning {model['type']} tokenizers is not supported")
+    return sorted(keep)
+
+
+def remap_post_processor(processor, old_to_new):
+    if processor is None:
+        return None
+    processor = copy.deepcopy(processor)
+    kind = processor["type"]
+    if kind == "TemplateProcessing":
+        for token in processor["special_tokens"].values():
+            token["ids"] = [old_to_new[i] for i in token["ids"]]
+    elif kind in ("RobertaProcessing", "BertProcessing"):
+        for key in ("sep", "cls"):
+            token, old_id = processor[key]
+            processor[key] = [token, old_to_new[old_id]]
+    elif kind == "Sequence":
+        processor["processors"] = [remap_post_processor(p, old_to_new) for p in processor["processors"]]
+    return processor
+
+
+def prune_tokenizer_json(tokenizer_json, kept_ids):
+    old_to_new = {old: new for new, old in enumerate(kept_ids)}
+    pruned = copy.deepcopy(tokenizer_json)
+    model = pruned["model"]
+    if model["type"] == "BPE":
+        vocab = {token: old_to_new[i] for token, i in model["vocab"].items() if i in old_to_new}
+        model["vocab"] = vocab
+        # A merge whose result was never used on the corpus never fired there
+        model["merges"] = [
+            merge for merge in model["merges"]
+            if all(part in vocab for part in parse_merge(merge)) and "".join(parse_merge(merge)) in vocab
+        ]
+    else:
+        model["vocab"] = [model["vocab"][i] for i in kept_ids]
+        if model.get("unk_id") is not None:
+            model["unk_id"] = old_to_new[model["unk_id"]]
+    for token in pruned["added_tokens"]:
+        token["id"] = old_to_new[token["id"]]
+    pruned["post_processor"] = remap_post_processor(pruned.get("post_processor"), old_to_new)
+    return pruned, old_to_new
+
+
+def prune_model(model, kept_ids, old_to_new):
+    index = torch.tensor(kept_ids, dtype=torch.long)
+    old_embeddings = model.get_input_embeddings()
+    pad_id = model.config.pad_token_id
+    new_pad = old_to_new.get(pad_id) if pad_id is not None else None
+    new_embeddings = torch.nn.Embedding(len(kept_ids), old_embeddings.embedding_dim, padding_idx=new_pad)
+    new_embeddings.weight.data = old_embeddings.weight.data[index].clone()
+    model.set_input_embeddings(new_embeddings)
+
+    # Heads tied to the vocabulary (e.g. an LM head) shrink the same way
+    output_embeddings = model.get_output_embeddings()
+    if output_embeddings is not None:
+        output_embeddings.weight.data = output_embeddings.weight.data[index].clone()
+        if getattr(output_embeddings, "bias", None) is not None:
+            output_embeddings.bias.data = output_embeddings.bias.data[index].clone()
+        output_embeddings.out_features = len(kept_ids)
+
+    # RoBERTa-style position ids are counted from the padding id
+    embeddings_module = getattr(getattr(model, model.base_model_prefix, model), "embeddings", None)
+    if embeddings_module is not None and hasattr(embeddings_module, "padding_idx") and new_pad is not None:
+        embeddings_module.padding_idx = new_pad
+
+    model.config.vocab_size = len(kept_ids)
+    for key in CONFIG_TOKEN_KEYS:
+        old_id = getattr(model.config, key, None)
+        if old_id is not None:
+            setattr(model.config, key, old_to_new[old_id])
+    return model
+
+
+def parameter_bytes(model):
+    return sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+def predict(model, tokenizer, texts):
+    logits = []
+    with torch.no_grad():
+        for i in range(0, len(texts), BATCH_SIZE):
+            enc = tokenizer(
+                texts[i : i + BATCH_SIZE], truncation=True, max_length=MAX_LENGTH, padding=True, return_tensors="pt"
+            )
+            logits.append(model(**enc).logits)
+    return torch.cat(logits)
+
+
+def compare_tokens(tokenizer, pruned_tokenizer, old_to_new, texts):
+    # Texts whose token sequence changes after remapping, and texts that get
+    # more <unk> tokens than before
+    old_ids = tokenizer(texts, truncation=True, max_length=MAX_LENGTH)["input_ids"]
+    new_ids = pruned_tokenizer(texts, truncation=True, max_length=MAX_LENGTH)["input_ids"]
+    old_unk, new_unk = tokenizer.unk_token_id, pruned_tokenizer.unk_token_id
+    changed = sum([old_to_new.get(i, -1) for i in old] != new for old, new in zip(old_ids, new_ids))
+    new_unknowns = sum(new.count(new_unk) > old.count(old_unk) for old, new in zip(old_ids, new_ids))
+    return changed, new_unknowns
+
+
+def verify(original, pruned, tokenizer, pruned_tokenizer, old_to_new, texts):
+    # Token sequences and predictions of the pruned model on texts it was not
+    # pruned for; words never counted may be split into more pieces
+    changed, new_unknowns = compare_tokens(tokenizer, pruned_tokenizer, old_to_new, texts)
+    old_logits = predict(original, tokenizer, texts)
+    new_logits = predict(pruned, pruned_tokenizer, texts)
+    label_mismatches = int((old_logits.argmax(-1) != new_logits.argmax(-1)).sum())
+    max_diff = float((old_logits - new_logits).abs().max())
+    return changed, new_unknowns, label_mismatches, max_diff
+
+
+def main():
+    counted, held_out = split_holdout(load_texts())
+    if not counted or not held_out:
+        raise SystemExit(f"HOLDOUT_PERCENT={HOLDOUT_PERCENT} leaves no texts to count or to verify on")
+    print(f"Counting token ids over {len(counted)} texts, verifying on {len(held_out)} held-out texts")
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
+    model = AutoModelForSequenceClassification.from_pretrained(MODEL_PATH)
+    model.eval()
+
+    tokenizer_json = json.loads(tokenizer.backend_tokenizer.to_str())
+    used = count_used_ids(tokenizer, counted)
+    special_ids = set(tokenizer.all_special_ids) | {token["id"] for token in tokenizer_json["added_tokens"]}
+    config_ids = (getattr(model.config, key, None) for key in CONFIG_TOKEN_KEYS)
+    special_ids |= {i for i in config_ids if i is not None}
+    kept_ids = keep_ids(tokenizer_json, used, special_ids)
+    vocab_size = tokenizer.backend_tokenizer.get_vocab_size()
+    print(f"{len(used)} ids used, keeping {len(kept_ids)} of {vocab_size}")
+
+    pruned_json, old_to_new = prune_tokenizer_json(tokenizer_json, kept_ids)
+    pruned_tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=Tokenizer.from_str(json.dumps(pruned_json)),
+        model_max_length=tokenizer.model_max_length,
+        **{key: value for key, value in tokenizer.special_tokens_map.items()},
+    )
+    before = parameter_bytes(model)
+    pruned_model = prune_model(copy.deepcopy(model), kept_ids, old_to_new)
+    pruned_model.eval()
+    after = parameter_bytes(pruned_model)
+
+    # Counted texts only use kept ids, so they must encode exactly as before
+    counted_mismatches, _ = compare_tokens(tokenizer, pruned_tokenizer, old_to_new, counted)
+    if counted_mismatches:
+        raise SystemExit(f"{counted_mismatches} counted texts encode differently after pruning; nothing was saved.")
+
+    sample = held_out if not VERIFY_SAMPLE else held_out[:: max(1, len(held_out) // VERIFY_SAMPLE)][:VERIFY_SAMPLE]
+    start = time.perf_counter()
+    changed, new_unknowns, label_mismatches, max_diff = verify(
+        model, pruned_model, tokenizer, pruned_tokenizer, old_to_new, sample
+    )
+    print(f"Verified {len(sample)} held-out texts in {time.perf_counter() - start:.1f}s: "
+          f"{changed} token sequences changed, {new_unknowns} with new <unk>, "
+          f"{label_mismatches} prediction mismatches, max logit difference {max_diff:.2e}")
+    if new_unknowns or label_mismatches > MAX_LABEL_CHANGES * len(sample):
+        raise SystemExit(
+            "Pruned model changes too many held-out predictions (MAX_LABEL_CHANGES) or produces new <unk> "
+            "tokens; count more representative texts (EXTRA_FILES). Nothing was saved."
+        )
+
+    pruned_model.save_pretrained(OUTPUT_DIR)
+    pruned_tokenizer.save_pretrained(OUTPUT_DIR)
+    saved = before - after
+    print(f"Parameters: {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB "
+          f"(saved {saved / 2**20:.1f} MB, {saved / before:.1%}); vocabulary {vocab_size} -> {len(kept_ids)}")
+    print(f"Pruned model saved to {OUTPUT_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
+import math
 import os
 import random
+from contextlib import nullcontext
 
 import pandas as pd
 import torch
 from datasets import load_dataset
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
+from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer
+
+from dedup import deduplicate, exact_key
+from inference_pool import InferencePool, autotune_layout, available_cores, max_replicas_for_memory
+from inference_pipeline import StageTimer, iter_prefetched_batches, iter_sequential_batches
+from inference_profile import apply_threads, forward_context, load_profile, prepare_model, setting
+from dataset_io import RELABELED_SCHEMA, column_list, read_frame, read_table, write_dataset
+from prediction_cache import PredictionCache, model_cache_key, resolve_revision, text_hash
 
 try:
     from tqdm import tqdm
@@ -15,17 +24,60 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
 MODEL_NAME = os.getenv("MODEL_NAME", "tabularisai/multilingual-sentiment-analysis")
+# Branch, tag or commit; resolved to a commit sha before loading or caching
+MODEL_REVISION = os.getenv("MODEL_REVISION", "main")
 HF_DATASET = os.getenv("HF_DATASET", "pythainlp/wisesight_sentiment")
 HF_SPLITS = [s.strip() for s in os.getenv("HF_SPLITS", "train,validation,test").split(",") if s.strip()]
+# Optional local Parquet/CSV file to relabel instead of the HF dataset.
+SOURCE_FILE = os.getenv("SOURCE_FILE", "")
 OUTPUT_FILE = os.getenv(
     "OUTPUT_FILE",
-    os.path.join(DATA_DIR, "thai_sentiment_dataset_relabeled.csv"),
+    os.path.join(DATA_DIR, "thai_sentiment_dataset_relabeled.parquet"),
 )
 
+# Probabilities are cached per (model, revision, text hash); set CACHE_FILE=""
+# to disable. Re-runs only pay for texts that are not cached yet.
+CACHE_FILE = os.getenv("CACHE_FILE", os.path.join(DATA_DIR, "relabel_cache.sqlite"))
+# "exact", "near" (exact + near-duplicates that differ only in punctuation,
+# emoji, spacing or elongated characters) or "off". Only one text per group is
+# sent to the model; its label is fanned out.
+DEDUP = os.getenv("DEDUP", "exact").strip().lower()
+
 MAX_SAMPLES = int(os.getenv("MAX_SAMPLES", "20000"))
-BATCH_SIZE = int(os.getenv("BATCH_SIZE", "32"))
+# Batch size, max length, threads and backend come from the profile written
+# by autotune.py when one exists; explicit environment variables still win.
+PROFILE = load_profile(MODEL_NAME)
+BATCH_SIZE = setting(PROFILE, "BATCH_SIZE", "batch_size", 32)
+MAX_LENGTH = setting(PROFILE, "MAX_LENGTH", "max_length", 128)
+BACKEND = setting(PROFILE, "INFERENCE_BACKEND", "backend", "eager", cast=str)
+# When set, batches are filled up to this many (padded) tokens instead of
+# BATCH_SIZE texts.
+MAX_BATCH_TOKENS = int(os.getenv("MAX_BATCH_TOKENS", "0"))
+# Tokenizer threads that encode chunks of PIPELINE_CHUNK texts while the main
+# thread runs the model (0 = tokenize everything up front, then run batches in
+# sequence). Batches are length-sorted within each chunk.
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "0"))
+PIPELINE_CHUNK = int(os.getenv("PIPELINE_CHUNK", "4096"))
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", "4"))
+# Model replicas in separate processes, each pinned to THREADS_PER_REPLICA
+# cores (default: cores // REPLICAS). "auto" times every layout on
+# AUTOTUNE_SAMPLE texts and keeps the fastest.
+REPLICAS = os.getenv("REPLICAS", "1").strip().lower()
+THREADS_PER_REPLICA = int(os.getenv("THREADS_PER_REPLICA", "0"))
+AUTOTUNE_SAMPLE = int(os.getenv("AUTOTUNE_SAMPLE", "512"))
+# Split the source across machines by text hash. Each shard writes its rows
+# unbalanced next to OUTPUT_FILE; MERGE_SHARDS=1 combines and balances them.
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+MERGE_SHARDS = os.getenv("MERGE_SHARDS", "0") == "1"
 SEED = int(os.getenv("SEED", "42"))
 
+# Streaming mode labels the (seeded, shuffled) source in chunks and stops once
+# every class reservoir holds MAX_SAMPLES // 5 * (1 + OVERSAMPLE_MARGIN) rows.
+STREAMING = os.getenv("STREAMING", "0") == "1"
+STREAM_CHUNK = int(os.getenv("STREAM_CHUNK", "1024"))
+OVERSAMPLE_MARGIN = float(os.getenv("OVERSAMPLE_MARGIN", "0.2"))
+
 POS_VERY_THRESHOLD = float(os.getenv("POS_VERY_THRESHOLD", "0.75"))
 NEG_VERY_THRESHOLD = float(os.getenv("NEG_VERY_THRESHOLD", "0.75"))
 
@@ -44,20 +96,17 @@ def resolve_label_name(id2label, label_id):
     return str(label)
 
 
-def predict_labels(texts, tokenizer, model, device):
-    enc = tokenizer(
-        texts,
-        truncation=True,
-        padding=True,
-        max_length=128,
-        return_tensors="pt",
-    )
+def predict_labels(enc, model, device):
     enc = {k: v.to(device) for k, v in enc.items()}
-    with torch.no_grad():
+    with torch.no_grad(), forward_context(BACKEND if device.type == "cpu" else "eager"):
         outputs = model(**enc)
         probs = torch.softmax(outputs.logits, dim=-1)
-    confidences, label_ids = torch.max(probs, dim=-1)
-    return label_ids.cpu().tolist(), confidences.cpu().tolist()
+    return probs.cpu().tolist()
+
+
+def probs_to_prediction(probs):
+    label_id = max(range(len(probs)), key=probs.__getitem__)
+    return label_id, probs[label_id]
 
 
 def balance_and_cap(rows, rng):
@@ -83,41 +132,309 @@ def balance_and_cap(rows, rng):
     return selected
 
 
+def relabel_texts(texts, tokenizer, model, device, desc="Relabeling", on_batch=None):
+    timer = StageTimer()
+    batching = dict(max_length=MAX_LENGTH, batch_size=BATCH_SIZE, max_tokens=MAX_BATCH_TOKENS)
+    if PIPELINE_WORKERS > 0:
+        num_batches, batches = iter_prefetched_batches(
+            texts,
+            tokenizer,
+            timer,
+            PIPELINE_WORKERS,
+            prefetch=PREFETCH_DEPTH,
+            chunk_size=PIPELINE_CHUNK,
+            **batching,
+        )
+    else:
+        num_batches, batches = iter_sequential_batches(texts, tokenizer, timer, **batching)
+
+    probs = [None] * len(texts)
+    # Real tokens, padded tokens and batches seen
+    counts = [0, 0, 0]
+
+    def counted():
+        for batch, enc in batches:
+            counts[0] += int(enc["attention_mask"].sum())
+            counts[1] += enc["attention_mask"].numel()
+            counts[2] += 1
+            yield batch, enc
+
+    def run_local():
+        for batch, enc in counted():
+            with timer.stage("forward"):
+                batch_probs = predict_labels(enc, model, device)
+            yield batch, batch_probs
+
+    # With a replica pool the forward passes run in other processes; the
+    # "pool" stage is the wall time of the whole loop.
+    results = model.map(counted()) if isinstance(model, InferencePool) else run_local()
+    if tqdm:
+        results = tqdm(results, total=num_batches, desc=desc, unit="batch")
+    with timer.stage("pool") if isinstance(model, InferencePool) else nullcontext():
+        for batch, batch_probs in results:
+            with timer.stage("collect"):
+                for i, row in zip(batch, batch_probs):
+                    probs[i] = row
+                if on_batch:
+                    on_batch(batch, batch_probs)
+
+    real_tokens, padded_tokens, seen_batches = counts
+    if padded_tokens:
+        print(f"{desc}: {seen_batches} batches, {real_tokens / padded_tokens:.1%} of padded tokens are real")
+        print(f"{desc} timings: {timer.summary()}")
+    return probs
+
+
+class LazyModel:
+    # Loaded on first use, so re-deriving labels from cached probabilities
+    # (e.g. after changing thresholds) never touches the model.
+    def __init__(self, device, revision=MODEL_REVISION, tuning_texts=None):
+        self.device = device
+        self.revision = revision
+        self.tuning_texts = tuning_texts or []
+        self.tokenizer = None
+        self.model = None
+
+    def load(self):
+        if self.model is None:
+            self.tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, revision=self.revision)
+            if REPLICAS == "1":
+                self.model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, revision=self.revision)
+                self.model.to(self.device)
+                self.model.eval()
+                if self.device.type == "cpu":
+                    self.model = prepare_model(self.model, BACKEND)
+            else:
+                config = AutoConfig.from_pretrained(MODEL_NAME, revision=self.revision)
+                replicas, threads = self.pool_layout(config)
+                print(f"Starting {replicas} model replicas x {threads} threads")
+                self.model = InferencePool(MODEL_NAME, config, replicas, threads, revision=self.revision).start()
+        return self.tokenizer, self.model
+
+    def pool_layout(self, config):
+        if REPLICAS != "auto":
+            replicas = int(REPLICAS)
+            threads = THREADS_PER_REPLICA or max(1, len(available_cores()) // replicas)
+            limit = max_replicas_for_memory(config)
+            if limit is not None and replicas > limit:
+                print(f"Warning: {replicas} replicas may not fit in memory; about {limit} do")
+            return replicas, threads
+        _, batches = iter_sequential_batches(
+            self.tuning_texts, self.tokenizer, StageTimer(), MAX_LENGTH, BATCH_SIZE, MAX_BATCH_TOKENS
+        )
+        print(f"Autotuning replica layout on {len(self.tuning_texts)} texts")
+        best, _ = autotune_layout(MODEL_NAME, config, list(batches), revision=self.revision)
+        return best
+
+    def close(self):
+        if isinstance(self.model, InferencePool):
+            self.model.close()
+
+
+def predict_texts(texts, cache, lazy_model, desc="Relabeling"):
+    hashes = [text_hash(t) for t in texts]
+    probs = cache.get_many(set(hashes)) if cache else {}
+    first_index = {}
+    for i, key in enumerate(hashes):
+        if key not in probs:
+            first_index.setdefault(key, i)
+    missing = list(first_index)
+
+    if missing:
+        tokenizer, model = lazy_model.load()
+        if cache:
+            cache.set_id2label(model.config.id2label)
+
+        def store(batch, batch_probs):
+            cache.put_many((missing[i], row) for i, row in zip(batch, batch_probs))
+
+        missing_texts = [texts[first_index[key]] for key in missing]
+        predicted = relabel_texts(
+            missing_texts,
+            tokenizer,
+            model,
+            lazy_model.device,
+            desc=desc,
+            on_batch=store if cache else None,
+        )
+        probs.update(zip(missing, predicted))
+    return [probs[key] for key in hashes], len(missing)
+
+
+class QuotaReservoirs:
+    # One reservoir (Algorithm R) per class, so classes that fill early keep
+    # a uniform sample of everything seen while rarer classes catch up.
+    def __init__(self, capacity, rng, num_classes=5):
+        self.capacity = capacity
+        self.rng = rng
+        self.items = {label: [] for label in range(num_classes)}
+        self.seen = {label: 0 for label in range(num_classes)}
+
+    def add(self, row):
+        label = row["label"]
+        self.seen[label] += 1
+        items = self.items[label]
+        if len(items) < self.capacity:
+            items.append(row)
+            return
+        j = self.rng.randrange(self.seen[label])
+        if j < self.capacity:
+            items[j] = row
+
+    def full(self):
+        return all(len(items) >= self.capacity for items in self.items.values())
+
+    def rows(self):
+        return [row for label in sorted(self.items) for row in self.items[label]]
+
+
+class Relabeler:
+    def __init__(self, texts, rep_of, cache, lazy_model):
+        self.texts = texts
+        self.rep_of = rep_of
+        self.cache = cache
+        self.lazy_model = lazy_model
+        self.rep_probs = {}
+        self.requested = 0
+        self.passes = 0
+
+    def id2label(self):
+        if self.lazy_model.model is None and self.cache:
+            id2label = self.cache.get_id2label()
+            if id2label is not None:
+                return id2label
+        return self.lazy_model.load()[1].config.id2label
+
+    def label_rows(self, indices, desc="Relabeling"):
+        if not indices:
+            return []
+        needed = sorted({self.rep_of[i] for i in indices} - self.rep_probs.keys())
+        if needed:
+            probs, passes = predict_texts([self.texts[r] for r in needed], self.cache, self.lazy_model, desc)
+            self.rep_probs.update(zip(needed, probs))
+            self.requested += len(needed)
+            self.passes += passes
+
+        id2label = self.id2label()
+        rows = []
+        for i in indices:
+            label_id, conf = probs_to_prediction(self.rep_probs[self.rep_of[i]])
+            label_name = resolve_label_name(id2label, label_id)
+            rows.append(
+                {
+                    "text": self.texts[i],
+                    "label": label_name_to_class(label_name, conf),
+                    "model_label": label_name,
+                    "confidence": round(float(conf), 4),
+                }
+            )
+        return rows
+
+
+def stream_relabel(relabeler, rng):
+    capacity = math.ceil(MAX_SAMPLES // 5 * (1 + OVERSAMPLE_MARGIN) / SHARD_COUNT)
+    reservoirs = QuotaReservoirs(capacity, rng)
+    order = list(range(len(relabeler.texts)))
+    rng.shuffle(order)
+
+    labelled = 0
+    for start in range(0, len(order), STREAM_CHUNK):
+        chunk = order[start : start + STREAM_CHUNK]
+        for row in relabeler.label_rows(chunk, desc=f"Relabeling chunk {start // STREAM_CHUNK + 1}"):
+            reservoirs.add(row)
+        labelled += len(chunk)
+        if reservoirs.full():
+            print(f"All class quotas ({capacity} each) filled after {labelled} of {len(order)} texts")
+            break
+    else:
+        print(f"Source exhausted before every class quota was filled: {reservoirs.seen}")
+    return reservoirs.rows(), labelled
+
+
+def shard_path(index, count):
+    root, ext = os.path.splitext(OUTPUT_FILE)
+    return f"{root}.shard-{index}-of-{count}{ext}"
+
+
+def in_shard(text):
+    return int.from_bytes(exact_key(text)[:8], "big") % SHARD_COUNT == SHARD_INDEX
+
+
+def merge_shards(rng):
+    frames = [read_frame(shard_path(i, SHARD_COUNT)) for i in range(SHARD_COUNT)]
+    rows = balance_and_cap(pd.concat(frames, ignore_index=True).to_dict("records"), rng)
+    write_dataset(pd.DataFrame(rows), OUTPUT_FILE, RELABELED_SCHEMA)
+    print(f"Merged {SHARD_COUNT} shards into {OUTPUT_FILE}")
+    print(f"Total samples: {len(rows)}")
+
+
+def iter_source_texts():
+    if SOURCE_FILE:
+        table = read_table(SOURCE_FILE, columns=["text"])
+        yield os.path.basename(SOURCE_FILE), column_list(table, "text")
+        return
+    for split in HF_SPLITS:
+        dataset = load_dataset(HF_DATASET, split=split)
+        yield split, dataset["texts"] if "texts" in dataset.column_names else dataset["text"]
+
+
 def main():
     rng = random.Random(SEED)
+    if MERGE_SHARDS:
+        merge_shards(rng)
+        return
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if PROFILE:
+        print(f"Using inference profile: batch_size={BATCH_SIZE}, max_length={MAX_LENGTH}, backend={BACKEND}")
+    if REPLICAS == "1":
+        apply_threads(PROFILE)
 
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME)
-    model.to(device)
-    model.eval()
+    texts = [str(t) for _, split_texts in iter_source_texts() for t in split_texts]
+    if SHARD_COUNT > 1:
+        texts = [t for t in texts if in_shard(t)]
+        print(f"Shard {SHARD_INDEX + 1} of {SHARD_COUNT}: {len(texts)} texts")
 
-    rows = []
-    for split in HF_SPLITS:
-        dataset = load_dataset(HF_DATASET, split=split)
-        texts = dataset["texts"] if "texts" in dataset.column_names else dataset["text"]
-        total = len(texts)
-        batch_range = range(0, total, BATCH_SIZE)
-        if tqdm:
-            batch_range = tqdm(batch_range, desc=f"Relabeling {split}", unit="batch")
-        for i in batch_range:
-            batch_texts = [str(t) for t in texts[i : i + BATCH_SIZE]]
-            label_ids, confidences = predict_labels(batch_texts, tokenizer, model, device)
-            for text, label_id, conf in zip(batch_texts, label_ids, confidences):
-                label_name = resolve_label_name(model.config.id2label, label_id)
-                label = label_name_to_class(label_name, conf)
-                rows.append(
-                    {
-                        "text": text,
-                        "label": label,
-                        "model_label": label_name,
-                        "confidence": round(float(conf), 4),
-                    }
-                )
+    revision = resolve_revision(MODEL_NAME, MODEL_REVISION)
+    if revision != MODEL_REVISION:
+        print(f"Model revision {MODEL_REVISION} resolved to {revision}")
+    cache = None
+    if CACHE_FILE:
+        cache = PredictionCache(CACHE_FILE, model_cache_key(MODEL_NAME, revision, MAX_LENGTH))
+    lazy_model = LazyModel(device, revision, tuning_texts=texts[:AUTOTUNE_SAMPLE])
+    if DEDUP == "off":
+        rep_of = list(range(len(texts)))
+    else:
+        rep_of, stats = deduplicate(texts, near=DEDUP == "near")
+        print(
+            f"{stats['exact_duplicates']} exact and {stats['near_duplicates']} near duplicates, "
+            f"{stats['representatives']} representatives"
+        )
+
+    relabeler = Relabeler(texts, rep_of, cache, lazy_model)
+    if STREAMING:
+        rows, labelled = stream_relabel(relabeler, rng)
+    else:
+        rows = relabeler.label_rows(range(len(texts)))
+        labelled = len(texts)
 
+    lazy_model.close()
+    if cache:
+        cache.close()
+    if labelled:
+        # Texts answered by a representative's prediction, then by the cache
+        by_dedup = labelled - relabeler.requested
+        by_cache = relabeler.requested - relabeler.passes
+        print(
+            f"Forward passes: {relabeler.passes} for {labelled} texts; saved {by_dedup} "
+            f"({by_dedup / labelled:.1%}) by deduplication and {by_cache} ({by_cache / labelled:.1%}) by the cache"
+        )
+    if SHARD_COUNT > 1:
+        path = shard_path(SHARD_INDEX, SHARD_COUNT)
+        write_dataset(pd.DataFrame(rows), path, RELABELED_SCHEMA)
+        print(f"Shard rows saved to {path}; run with MERGE_SHARDS=1 once every shard is done")
+        return
     rows = balance_and_cap(rows, rng)
-    os.makedirs(DATA_DIR, exist_ok=True)
-    pd.DataFrame(rows).to_csv(OUTPUT_FILE, index=False)
+    write_dataset(pd.DataFrame(rows), OUTPUT_FILE, RELABELED_SCHEMA)
     print(f"Relabeled dataset saved to {OUTPUT_FILE}")
     print(f"Total samples: {len(rows)}")
 
@@ -1,22 +1,31 @@
+import csv
+import json
+import os
+import sys
+
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
-# Load the trained model and tokenizer
-model_path = 'Text Classification/src/model'
-tokenizer = AutoTokenizer.from_pretrained(model_path)
-model = AutoModelForSequenceClassification.from_pretrained(model_path)
+from inference_pipeline import plan_batches
+from inference_profile import apply_threads, forward_context, load_profile, prepare_model, setting
+
+MODEL_PATH = os.getenv("MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model"))
+# JSONL/JSON/CSV file (or "-" for stdin) to score; without it the examples below are run.
+INPUT_FILE = os.getenv("INPUT_FILE", "")
+# "jsonl", "json", "csv" or "text" (one text per line); guessed from the extension by default.
+INPUT_FORMAT = os.getenv("INPUT_FORMAT", "")
+TEXT_FIELD = os.getenv("TEXT_FIELD", "text")
+# Results are written as JSONL, to stdout unless OUTPUT_FILE is set.
+OUTPUT_FILE = os.getenv("OUTPUT_FILE", "-")
+# Texts held in memory at once; each chunk is sorted by length into batches.
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "4096"))
+# Score with the cascade from cascade.py: the linear model answers confident
+# texts and only the rest reach the transformer.
+CASCADE = os.getenv("CASCADE", "0") == "1"
 
 # Sentiment labels
 sentiment_labels = ["Very Negative", "Negative", "Neutral", "Positive", "Very Positive"]
 
-# Function to predict sentiment
-def predict_sentiment(text):
-    inputs = tokenizer(text, return_tensors='pt', truncation=True, padding=True, max_length=128)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        predictions = torch.argmax(outputs.logits, dim=-1)
-    return sentiment_labels[predictions.item()]
-
 # Test with some examples
 test_texts = [
     "ร้านนี้ดีมาก ชอบอาหาร",
@@ -24,8 +33,136 @@ test_texts = [
     "สินค้าดี ราคาถูก"
 ]
 
-for text in test_texts:
-    sentiment = predict_sentiment(text)
-    print(f"Text: {text}")
-    print(f"Sentiment: {sentiment}")
-    print("-" * 30)
\ No newline at end of file
+
+class SentimentPredictor:
+    def __init__(self, model_path=MODEL_PATH, device=None):
+        # Settings tuned by autotune.py, if it has been run for this model
+        profile = load_profile(model_path)
+        apply_threads(profile)
+        self.batch_size = setting(profile, "BATCH_SIZE", "batch_size", 32)
+        self.max_length = setting(profile, "MAX_LENGTH", "max_length", 128)
+        self.labels = sentiment_labels
+        self.device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.backend = setting(profile, "INFERENCE_BACKEND", "backend", "eager", cast=str)
+        if self.device.type != "cpu":
+            self.backend = "eager"
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        model.to(self.device)
+        model.eval()
+        self.model = prepare_model(model, self.backend)
+
+    def predict_batch(self, texts):
+        # Returns the label and the full probability vector for every text.
+        if not texts:
+            return [], []
+        inputs = self.tokenizer(
+            list(texts), return_tensors="pt", truncation=True, padding=True, max_length=self.max_length
+        )
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        with torch.no_grad(), forward_context(self.backend):
+            probs = torch.softmax(self.model(**inputs).logits.float(), dim=-1).cpu()
+        labels = [sentiment_labels[i] for i in probs.argmax(dim=-1).tolist()]
+        return labels, probs.tolist()
+
+    def predict(self, texts):
+        # Any number of texts, grouped into batches of similar length.
+        labels = [None] * len(texts)
+        probs = [None] * len(texts)
+        for batch in plan_batches([len(t) for t in texts], self.batch_size):
+            batch_labels, batch_probs = self.predict_batch([texts[i] for i in batch])
+            for i, label, row in zip(batch, batch_labels, batch_probs):
+                labels[i] = label
+                probs[i] = row
+        return labels, probs
+
+    def predict_sentiment(self, text):
+        return self.predict_batch([text])[0][0]
+
+
+def input_format(path):
+    if INPUT_FORMAT:
+        return INPUT_FORMAT.lower()
+    if path.endswith(".jsonl"):
+        return "jsonl"
+    if path.endswith(".json"):
+        return "json"
+    if path.endswith(".csv"):
+        return "csv"
+    return "text"
+
+
+def iter_records(f, fmt):
+    if fmt == "csv":
+        yield from csv.DictReader(f)
+        return
+    if fmt == "json":
+        # A JSON array of records (or a single record) has to be parsed whole.
+        data = json.load(f)
+        yield from data if isinstance(data, list) else [data]
+        return
+    for line in f:
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        yield json.loads(line) if fmt == "jsonl" else {TEXT_FIELD: line}
+
+
+def iter_chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def score_stream(predictor, records, out):
+    scored = 0
+    for chunk in iter_chunks(records, CHUNK_SIZE):
+        texts = [str(record.get(TEXT_FIELD) or "") for record in chunk]
+        labels, probs = predictor.predict(texts)
+        for record, label, row in zip(chunk, labels, probs):
+            # An input "label" (e.g. the gold label) is kept as it is
+            record["predicted_label"] = label
+            record["confidence"] = round(max(row), 4)
+            record["probs"] = [round(p, 4) for p in row]
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        scored += len(chunk)
+        print(f"Scored {scored} texts", file=sys.stderr)
+    if getattr(predictor, "escalated", None) is not None:
+        print(f"Escalated to the transformer: {predictor.escalated} of {scored}", file=sys.stderr)
+
+
+def main():
+    predictor = SentimentPredictor()
+    if CASCADE:
+        from cascade import CascadePredictor
+
+        predictor = CascadePredictor.load(predictor)
+    if not INPUT_FILE:
+        labels, _ = predictor.predict(test_texts)
+        for text, sentiment in zip(test_texts, labels):
+            print(f"Text: {text}")
+            print(f"Sentiment: {sentiment}")
+            print("-" * 30)
+        return
+
+    fmt = input_format(INPUT_FILE)
+    source = sys.stdin if INPUT_FILE == "-" else open(INPUT_FILE, "r", encoding="utf-8", newline="")
+    out = sys.stdout if OUTPUT_FILE == "-" else open(OUTPUT_FILE, "w", encoding="utf-8")
+    try:
+        score_stream(predictor, iter_records(source, fmt), out)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
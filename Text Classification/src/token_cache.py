@@ -0,0 +1,62 @@
+import hashlib
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))  # repo root, for common/
+from common.hashing import file_hash
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+TOKEN_CACHE_DIR = os.getenv("TOKEN_CACHE_DIR", os.path.join(BASE_DIR, "data", "token_cache"))
+
+
+def tokenizer_fingerprint(tokenizer):
+    # The serialized fast tokenizer covers vocab, merges, normalizer and
+    # special tokens; slow tokenizers fall back to name and vocab.
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        payload = backend.to_str()
+    else:
+        payload = f"{tokenizer.name_or_path}:{sorted(tokenizer.get_vocab().items())}"
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class TokenCache:
+    # Every text of a dataset file encoded once and stored as one flat int32
+    # tensor plus offsets, so sequences are cheap slices with no padding.
+    def __init__(self, ids, offsets):
+        self.ids = ids
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.ids[self.offsets[idx] : self.offsets[idx + 1]]
+
+    @classmethod
+    def load_or_encode(cls, texts, tokenizer, data_file, max_length=128, batch_size=1024):
+        key = f"{file_hash(data_file)}-{tokenizer_fingerprint(tokenizer)}-{max_length}"
+        path = os.path.join(TOKEN_CACHE_DIR, f"{key}.pt")
+        if os.path.exists(path):
+            saved = torch.load(path)
+            print(f"Loaded {len(saved['offsets']) - 1} pre-tokenized texts from {path}")
+            return cls(saved["ids"], saved["offsets"])
+
+        start = time.perf_counter()
+        sequences = []
+        for i in range(0, len(texts), batch_size):
+            encoded = tokenizer(list(texts[i : i + batch_size]), truncation=True, max_length=max_length)
+            sequences.extend(encoded["input_ids"])
+        offsets = torch.zeros(len(sequences) + 1, dtype=torch.long)
+        offsets[1:] = torch.cumsum(torch.tensor([len(s) for s in sequences], dtype=torch.long), dim=0)
+        ids = torch.tensor([token for seq in sequences for token in seq], dtype=torch.int32)
+
+        os.makedirs(TOKEN_CACHE_DIR, exist_ok=True)
+        tmp_path = path + ".tmp"
+        torch.save({"ids": ids, "offsets": offsets}, tmp_path)
+        os.replace(tmp_path, path)
+        print(f"Tokenized {len(sequences)} texts in {time.perf_counter() - start:.1f}s, cached at {path}")
+        return cls(ids, offsets)
@@ -1,86 +1,231 @@
-import pandas as pd
+import os
+
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from sklearn.metrics import accuracy_score, f1_score
 from sklearn.model_selection import train_test_split
 from torch.utils.data import Dataset, DataLoader
 
-# Load dataset
-df = pd.read_csv('D:/Github/Natural-Language-Processing/Text Classification/data/thai_sentiment_dataset.csv')
+from augment import augment_tokens, seeded_rng, tokens_to_text
+from dataset_io import column_list, read_table
+from token_cache import TokenCache
+from training_perf import ThroughputMeter, autocast_context, make_adamw, use_bf16
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DATA_FILE = os.getenv("DATA_FILE", os.path.join(BASE_DIR, "data", "thai_sentiment_dataset.parquet"))
+MODEL_NAME = "airesearch/wangchanberta-base-att-spm-uncased"
+OUTPUT_DIR = 'Text Classification/src/model'
 
-# Split into train and test
-train_texts, test_texts, train_labels, test_labels = train_test_split(
-    df['text'].tolist(), df['label'].tolist(), test_size=0.2, random_state=42
-)
+SEED = 42
+NUM_EPOCHS = 3
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "8"))
+MAX_LENGTH = int(os.getenv("MAX_LENGTH", "128"))
+# Augmented variants generated per training text and epoch. create_dataset.py
+# stores no augmented copies by default (AUG_PER_TEXT=0), so this replaces them.
+ONLINE_AUGMENTATIONS = int(os.getenv("ONLINE_AUGMENTATIONS", "3"))
+NUM_WORKERS = int(os.getenv("NUM_WORKERS", "0"))
+# "finetune" trains the whole model; "features" encodes the dataset once with a
+# frozen encoder (cached in data/embeddings, see embedding_cache.py) and only
+# trains a classification head on top.
+TRAIN_MODE = os.getenv("TRAIN_MODE", "finetune")
+# Opt-in CPU performance mode: bf16 autocast (where the CPU supports it),
+# torch.compile, gradient accumulation and fused AdamW. Each part can be
+# overridden on its own.
+PERF_MODE = os.getenv("PERF_MODE", "0") == "1"
+BF16 = os.getenv("BF16", "auto" if PERF_MODE else "0")
+COMPILE = os.getenv("COMPILE", "1" if PERF_MODE else "0") == "1"
+FUSED_ADAMW = os.getenv("FUSED_ADAMW", "1" if PERF_MODE else "0") == "1"
+# Optimizer steps every GRAD_ACCUM_STEPS batches (effective batch = BATCH_SIZE * steps).
+GRAD_ACCUM_STEPS = int(os.getenv("GRAD_ACCUM_STEPS", "4" if PERF_MODE else "1"))
 
-# Load pre-trained tokenizer and model for Thai
-model_name = "airesearch/wangchanberta-base-att-spm-uncased"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSequenceClassification.from_pretrained(model_name, num_labels=5)
 
 # Custom Dataset class
 class ThaiSentimentDataset(Dataset):
-    def __init__(self, texts, labels, tokenizer, max_len=128):
+    def __init__(
+        self, texts, labels, tokenizer, max_len=128, tokens=None, augmentations=0, seed=SEED, input_ids=None
+    ):
         self.texts = texts
+        # Pre-tokenized ids of the original texts (see token_cache.py); only
+        # augmented variants are tokenized on the fly.
+        self.input_ids = input_ids
         self.labels = labels
         self.tokenizer = tokenizer
         self.max_len = max_len
+        self.tokens = tokens
+        # Without segmented tokens there is nothing to augment, so every
+        # "variant" would be another copy of the original text
+        self.augmentations = augmentations if tokens is not None and any(tokens) else 0
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        # DataLoader workers receive a fresh copy of the dataset every epoch,
+        # so setting this before iterating reseeds augmentation everywhere.
+        self.epoch = epoch
 
     def __len__(self):
-        return len(self.texts)
+        return len(self.texts) * (1 + self.augmentations)
+
+    def get_text(self, idx):
+        base_idx, variant = divmod(idx, 1 + self.augmentations)
+        tokens = self.tokens[base_idx] if variant else None
+        if not tokens:
+            return self.texts[base_idx], base_idx
+        rng = seeded_rng(self.seed, self.epoch, idx)
+        return tokens_to_text(augment_tokens(tokens, rng)), base_idx
 
     def __getitem__(self, idx):
-        text = self.texts[idx]
-        label = self.labels[idx]
-        encoding = self.tokenizer(
-            text,
-            truncation=True,
-            padding='max_length',
-            max_length=self.max_len,
-            return_tensors='pt'
-        )
+        base_idx, variant = divmod(idx, 1 + self.augmentations)
+        if self.input_ids is not None and not (variant and self.tokens[base_idx]):
+            input_ids = self.input_ids[base_idx].long()
+        else:
+            text, base_idx = self.get_text(idx)
+            encoding = self.tokenizer(text, truncation=True, max_length=self.max_len)
+            input_ids = torch.tensor(encoding['input_ids'], dtype=torch.long)
+        # Unpadded; PadCollator pads each batch to its longest sequence
+        return {
+            'input_ids': input_ids,
+            'labels': torch.tensor(self.labels[base_idx], dtype=torch.long)
+        }
+
+
+class PadCollator:
+    def __init__(self, pad_token_id):
+        self.pad_token_id = pad_token_id
+
+    def __call__(self, batch):
+        length = max(len(item['input_ids']) for item in batch)
+        input_ids = torch.full((len(batch), length), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+        for i, item in enumerate(batch):
+            n = len(item['input_ids'])
+            input_ids[i, :n] = item['input_ids']
+            attention_mask[i, :n] = 1
         return {
-            'input_ids': encoding['input_ids'].flatten(),
-            'attention_mask': encoding['attention_mask'].flatten(),
-            'labels': torch.tensor(label, dtype=torch.long)
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'labels': torch.stack([item['labels'] for item in batch])
         }
 
-# Create datasets
-train_dataset = ThaiSentimentDataset(train_texts, train_labels, tokenizer)
-test_dataset = ThaiSentimentDataset(test_texts, test_labels, tokenizer)
-
-# Create DataLoaders
-train_loader = DataLoader(train_dataset, batch_size=8, shuffle=True)
-test_loader = DataLoader(test_dataset, batch_size=8)
-
-# Set device
-device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-model.to(device)
-
-# Optimizer
-optimizer = torch.optim.AdamW(model.parameters(), lr=5e-5)
-
-# Training loop
-num_epochs = 3
-for epoch in range(num_epochs):
-    model.train()
-    total_loss = 0
-    for batch in train_loader:
-        input_ids = batch['input_ids'].to(device)
-        attention_mask = batch['attention_mask'].to(device)
-        labels = batch['labels'].to(device)
-        
+
+def train_epochs(model, train_dataset, train_loader, device, num_epochs=NUM_EPOCHS, log_prefix=""):
+    # Optimizer
+    optimizer = make_adamw(model.parameters(), lr=5e-5, fused=FUSED_ADAMW)
+    bf16 = use_bf16(BF16)
+    # The compiled wrapper shares its parameters with `model`, which is what gets saved
+    train_step_model = torch.compile(model, dynamic=True) if COMPILE else model
+    if PERF_MODE:
+        print(f"{log_prefix}Performance mode: bf16={bf16}, compile={COMPILE}, fused AdamW={FUSED_ADAMW}, "
+              f"effective batch {BATCH_SIZE * GRAD_ACCUM_STEPS}")
+    meter = ThroughputMeter()
+
+    # Training loop
+    for epoch in range(num_epochs):
+        model.train()
+        train_dataset.set_epoch(epoch)
+        meter.reset()
+        total_loss = 0
         optimizer.zero_grad()
-        outputs = model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
-        loss = outputs.loss
-        loss.backward()
-        optimizer.step()
-        
-        total_loss += loss.item()
-    
-    print(f"Epoch {epoch+1}, Loss: {total_loss / len(train_loader)}")
-
-# Save the model
-model.save_pretrained('Text Classification/src/model')
-tokenizer.save_pretrained('Text Classification/src/model')
-
-print("Model trained and saved to Text Classification/src/model")
\ No newline at end of file
+        for step, batch in enumerate(train_loader, start=1):
+            input_ids = batch['input_ids'].to(device)
+            attention_mask = batch['attention_mask'].to(device)
+            labels = batch['labels'].to(device)
+
+            with autocast_context(device, bf16):
+                outputs = train_step_model(input_ids=input_ids, attention_mask=attention_mask, labels=labels)
+            loss = outputs.loss
+            (loss / GRAD_ACCUM_STEPS).backward()
+            if step % GRAD_ACCUM_STEPS == 0 or step == len(train_loader):
+                optimizer.step()
+                optimizer.zero_grad()
+
+            total_loss += loss.item()
+            meter.add(attention_mask)
+
+        print(f"{log_prefix}Epoch {epoch+1}, Loss: {total_loss / len(train_loader)}, {meter.summary()}")
+
+
+def evaluate(model, loader, device):
+    model.eval()
+    predictions, references = [], []
+    with torch.no_grad():
+        for batch in loader:
+            logits = model(
+                input_ids=batch['input_ids'].to(device), attention_mask=batch['attention_mask'].to(device)
+            ).logits
+            predictions.extend(logits.argmax(dim=-1).tolist())
+            references.extend(batch['labels'].tolist())
+    return {
+        "accuracy": accuracy_score(references, predictions),
+        "macro_f1": f1_score(references, predictions, average="macro"),
+    }
+
+
+def main():
+    # Load dataset (memory-mapped when stored as Parquet)
+    table = read_table(DATA_FILE)
+    texts = column_list(table, 'text')
+    labels = column_list(table, 'label')
+    tokens = column_list(table, 'tokens')
+    if tokens is None:
+        if ONLINE_AUGMENTATIONS:
+            print("No 'tokens' column in the dataset; training without on-the-fly augmentation.")
+        tokens = [None] * len(texts)
+
+    # Split into train and test
+    train_texts, test_texts, train_labels, test_labels, train_tokens, _, train_idx, test_idx = train_test_split(
+        texts, labels, tokens, list(range(len(texts))), test_size=0.2, random_state=SEED
+    )
+
+    if TRAIN_MODE == "features":
+        from embedding_cache import HEAD_FILE, train_feature_head
+
+        # The head is an experiment artifact; OUTPUT_DIR stays a loadable fine-tuned model
+        train_feature_head(train_texts, train_labels, test_texts, test_labels, head_file=HEAD_FILE)
+        return
+
+    # Load pre-trained tokenizer and model for Thai
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModelForSequenceClassification.from_pretrained(MODEL_NAME, num_labels=5)
+
+    # Tokenize the whole dataset once; cached by data file and tokenizer hash
+    encoded = TokenCache.load_or_encode(texts, tokenizer, DATA_FILE, max_length=MAX_LENGTH)
+
+    # Create datasets; only the training split is augmented
+    train_dataset = ThaiSentimentDataset(
+        train_texts,
+        train_labels,
+        tokenizer,
+        max_len=MAX_LENGTH,
+        tokens=train_tokens,
+        augmentations=ONLINE_AUGMENTATIONS,
+        input_ids=[encoded[i] for i in train_idx],
+    )
+    test_dataset = ThaiSentimentDataset(
+        test_texts, test_labels, tokenizer, max_len=MAX_LENGTH, input_ids=[encoded[i] for i in test_idx]
+    )
+
+    # Create DataLoaders with per-batch dynamic padding
+    collate = PadCollator(tokenizer.pad_token_id)
+    train_loader = DataLoader(
+        train_dataset, batch_size=BATCH_SIZE, shuffle=True, num_workers=NUM_WORKERS, collate_fn=collate
+    )
+    test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, num_workers=NUM_WORKERS, collate_fn=collate)
+
+    # Set device
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model.to(device)
+
+    train_epochs(model, train_dataset, train_loader, device)
+    metrics = evaluate(model, test_loader, device)
+    print(f"Test accuracy {metrics['accuracy']:.4f}, macro-F1 {metrics['macro_f1']:.4f}")
+
+    # Save the model
+    model.save_pretrained(OUTPUT_DIR)
+    tokenizer.save_pretrained(OUTPUT_DIR)
+
+    print(f"Model trained and saved to {OUTPUT_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+from contextlib import nullcontext
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))  # repo root, for common/
+from common.system import cpu_bf16_supported, peak_rss_mb
+
+
+def use_bf16(setting):
+    # setting is "auto", "1" or "0"
+    if setting == "auto":
+        return cpu_bf16_supported()
+    return setting == "1"
+
+
+def autocast_context(device, enabled):
+    if not enabled:
+        return nullcontext()
+    return torch.autocast(device.type, dtype=torch.bfloat16)
+
+
+def make_adamw(params, lr, fused=False, **kwargs):
+    params = list(params)
+    if fused:
+        try:
+            return torch.optim.AdamW(params, lr=lr, fused=True, **kwargs)
+        except (RuntimeError, TypeError):
+            # Fused AdamW needs torch >= 2.4 on CPU
+            pass
+    return torch.optim.AdamW(params, lr=lr, **kwargs)
+
+
+class ThroughputMeter:
+    # Counts real (unpadded) tokens and reports tokens/sec and peak RSS.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.tokens = 0
+        self.samples = 0
+        self.start = time.perf_counter()
+
+    def add(self, attention_mask):
+        self.tokens += int(attention_mask.sum())
+        self.samples += attention_mask.shape[0]
+
+    def summary(self):
+        seconds = time.perf_counter() - self.start
+        rss = peak_rss_mb()
+        rss_text = f", peak RSS {rss:.0f} MB" if rss is not None else ""
+        return (
+            f"{self.tokens / seconds:.0f} tokens/s, {self.samples / seconds:.1f} samples/s "
+            f"({seconds:.1f}s){rss_text}"
+        )
@@ -0,0 +1,408 @@
+import json
+import os
+import random
+import sys
+import time
+from array import array
+from multiprocessing import Pool
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+VOCAB_CORPUS = os.getenv(
+    "VOCAB_CORPUS",
+    os.path.join(BASE_DIR, "..", "Thai Named Entity Recognition Corpus", "data", "ThaiNER.jsonl"),
+)
+USER_DICT = os.getenv("USER_DICT", "")
+TRIE_FILE = os.getenv("TRIE_FILE", os.path.join(DATA_DIR, "thai_vocab.trie"))
+
+BENCH_FILE = os.getenv("BENCH_FILE", "")
+BENCH_SAMPLES = int(os.getenv("BENCH_SAMPLES", "2000"))
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", "1"))
+SEED = 42
+
+TRIE_MAGIC = "thai-da-trie/1"
+
+# Leading vowels never end a cluster; following vowels, tone marks and
+# diacritics never start one. Everything else in the Thai block is a base.
+THAI_LEADING = set("เแโใไ")
+THAI_FOLLOWING = set("ะัาำิีึืฺุู็่้๊๋์ํ๎ๅ")
+
+
+def is_thai(ch):
+    return "฀" <= ch <= "๿"
+
+
+class DoubleArrayTrie:
+    def __init__(self, base, check, terminal, alphabet):
+        self.base = base
+        self.check = check
+        self.terminal = terminal
+        self.alphabet = alphabet
+        self.codes = {ch: i + 1 for i, ch in enumerate(alphabet)}
+
+    @classmethod
+    def build(cls, words):
+        words = sorted({w for w in words if w})
+        alphabet = sorted({ch for w in words for ch in w})
+        codes = {ch: i + 1 for i, ch in enumerate(alphabet)}
+
+        base = [0]
+        check = [-1]
+        terminal = bytearray(1)
+
+        def ensure(size):
+            if size > len(check):
+                grow = size - len(check)
+                base.extend([0] * grow)
+                check.extend([-1] * grow)
+                terminal.extend(bytes(grow))
+
+        next_check_pos = 1
+        # Each entry is (node, depth, lo, hi): words[lo:hi] share the prefix
+        # that leads to node and are all at least `depth` characters long.
+        stack = [(0, 0, 0, len(words))]
+        while stack:
+            node, depth, lo, hi = stack.pop()
+            if len(words[lo]) == depth:
+                terminal[node] = 1
+                lo += 1
+            if lo >= hi:
+                continue
+
+            children = []
+            start = lo
+            for i in range(lo + 1, hi + 1):
+                if i == hi or words[i][depth] != words[start][depth]:
+                    children.append((codes[words[start][depth]], start, i))
+                    start = i
+
+            # First-fit search for a base offset. Like darts, skip the densely
+            # packed prefix of the array once it is almost full.
+            first_code = children[0][0]
+            pos = max(next_check_pos, first_code + 1) - 1
+            occupied = 0
+            seen_free = False
+            while True:
+                pos += 1
+                if pos < len(check) and check[pos] != -1:
+                    occupied += 1
+                    continue
+                if not seen_free:
+                    next_check_pos = pos
+                    seen_free = True
+                b = pos - first_code
+                ensure(b + children[-1][0] + 1)
+                if all(check[b + code] == -1 for code, _, _ in children):
+                    break
+            if occupied / (pos - next_check_pos + 1) >= 0.95:
+                next_check_pos = pos
+
+            base[node] = b
+            for code, _, _ in children:
+                check[b + code] = node
+            for code, c_lo, c_hi in reversed(children):
+                stack.append((b + code, depth + 1, c_lo, c_hi))
+
+        return cls(array("i", base), array("i", check), bytes(terminal), alphabet)
+
+    def __len__(self):
+        return len(self.check)
+
+    def __contains__(self, word):
+        node = self._walk(word)
+        return node is not None and bool(self.terminal[node])
+
+    def _walk(self, word):
+        node = 0
+        for ch in word:
+            code = self.codes.get(ch)
+            if code is None:
+                return None
+            nxt = self.base[node] + code
+            if nxt >= len(self.check) or self.check[nxt] != node:
+                return None
+            node = nxt
+        return node
+
+    def prefix_ends(self, text, start):
+        base, check, terminal, codes = self.base, self.check, self.terminal, self.codes
+        size = len(check)
+        node = 0
+        for i in range(start, len(text)):
+            code = codes.get(text[i])
+            if code is None:
+                return
+            nxt = base[node] + code
+            if nxt >= size or check[nxt] != node:
+                return
+            node = nxt
+            if terminal[node]:
+                yield i + 1
+
+    def save(self, path, source=None):
+        header = {
+            "magic": TRIE_MAGIC,
+            "byteorder": sys.byteorder,
+            "size": len(self.check),
+            "alphabet": "".join(self.alphabet),
+            "source": source,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.base.tofile(f)
+            self.check.tofile(f)
+            f.write(self.terminal)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            header = json.loads(f.readline().decode("utf-8"))
+            if header.get("magic") != TRIE_MAGIC:
+                raise ValueError(f"Not a compiled trie file: {path}")
+            size = header["size"]
+            base = array("i")
+            check = array("i")
+            base.fromfile(f, size)
+            check.fromfile(f, size)
+            terminal = f.read(size)
+        if header["byteorder"] != sys.byteorder:
+            base.byteswap()
+            check.byteswap()
+        trie = cls(base, check, terminal, list(header["alphabet"]))
+        trie.source = header.get("source")
+        return trie
+
+
+def char_clusters(text):
+    # Boundaries where a word is allowed to start or end. Thai text is split
+    # into simplified character clusters, non-Thai text into runs of
+    # letters/digits, whitespace runs and single punctuation marks.
+    bounds = [0]
+    n = len(text)
+    i = 0
+    while i < n:
+        ch = text[i]
+        j = i + 1
+        if is_thai(ch):
+            if ch in THAI_LEADING:
+                while j < n and text[j] in THAI_LEADING:
+                    j += 1
+                if j < n and is_thai(text[j]):
+                    j += 1
+            while j < n and text[j] in THAI_FOLLOWING:
+                j += 1
+        elif ch.isspace():
+            while j < n and text[j].isspace():
+                j += 1
+        elif ch.isalnum():
+            while j < n and text[j].isalnum() and not is_thai(text[j]):
+                j += 1
+        bounds.append(j)
+        i = j
+    return bounds
+
+
+class TrieSegmenter:
+    def __init__(self, trie):
+        self.trie = trie
+
+    def segment(self, text):
+        if not text:
+            return []
+        bounds = char_clusters(text)
+        is_bound = bytearray(len(text) + 1)
+        next_bound = [0] * (len(text) + 1)
+        for k, pos in enumerate(bounds):
+            is_bound[pos] = 1
+            if k + 1 < len(bounds):
+                next_bound[pos] = bounds[k + 1]
+
+        # Maximal matching: minimise unknown clusters first, then tokens.
+        inf = (len(text) + 1, len(text) + 1)
+        best = {0: (0, 0)}
+        back = {}
+        for pos in bounds[:-1]:
+            cost = best.get(pos)
+            if cost is None:
+                continue
+            unknown, count = cost
+            matched = False
+            for end in self.trie.prefix_ends(text, pos):
+                if not is_bound[end]:
+                    continue
+                matched = True
+                candidate = (unknown, count + 1)
+                if candidate < best.get(end, inf):
+                    best[end] = candidate
+                    back[end] = (pos, True)
+            if not matched or text[pos].isspace():
+                end = next_bound[pos]
+                candidate = (unknown + (0 if text[pos].isspace() else 1), count + 1)
+                if candidate < best.get(end, inf):
+                    best[end] = candidate
+                    back[end] = (pos, False)
+
+        spans = []
+        end = len(text)
+        while end > 0:
+            start, known = back[end]
+            spans.append((start, end, known))
+            end = start
+        spans.reverse()
+
+        tokens = []
+        pending = None
+        for start, end, known in spans:
+            if not known and is_thai(text[start]):
+                pending = start if pending is None else pending
+                continue
+            if pending is not None:
+                tokens.append(text[pending:start])
+                pending = None
+            tokens.append(text[start:end])
+        if pending is not None:
+            tokens.append(text[pending:])
+        return tokens
+
+    def segment_batch(self, texts, workers=SEGMENT_WORKERS, chunksize=256):
+        texts = ["" if t is None else str(t) for t in texts]
+        if workers <= 1 or len(texts) < chunksize * 2:
+            return [self.segment(t) for t in texts]
+        with Pool(workers, initializer=_init_worker, initargs=(self.trie,)) as pool:
+            return pool.map(_segment_in_worker, texts, chunksize=chunksize)
+
+
+_worker_segmenter = None
+
+
+def _init_worker(trie):
+    global _worker_segmenter
+    _worker_segmenter = TrieSegmenter(trie)
+
+
+def _segment_in_worker(text):
+    return _worker_segmenter.segment(text)
+
+
+def read_corpus_vocab(path):
+    words = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            words.update(t for t in json.loads(line).get("tokens") or [] if t and t.strip())
+    return words
+
+
+def read_user_dict(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def vocab_sources():
+    sources = [VOCAB_CORPUS]
+    if USER_DICT:
+        sources.append(USER_DICT)
+    return [
+        {"path": os.path.abspath(p), "size": os.path.getsize(p), "mtime": int(os.path.getmtime(p))}
+        for p in sources
+    ]
+
+
+def load_segmenter(rebuild=False):
+    source = vocab_sources()
+    if not rebuild and os.path.exists(TRIE_FILE):
+        trie = DoubleArrayTrie.load(TRIE_FILE)
+        if trie.source == source:
+            return TrieSegmenter(trie)
+
+    words = read_corpus_vocab(VOCAB_CORPUS)
+    if USER_DICT:
+        words |= read_user_dict(USER_DICT)
+    trie = DoubleArrayTrie.build(words)
+    trie.save(TRIE_FILE, source=source)
+    print(f"Compiled {len(words)} words into {TRIE_FILE} ({len(trie)} cells)")
+    return TrieSegmenter(trie)
+
+
+def load_bench_texts():
+    if BENCH_FILE:
+        import pandas as pd
+
+        if BENCH_FILE.endswith(".jsonl"):
+            df = pd.read_json(BENCH_FILE, lines=True)
+        else:
+            df = pd.read_csv(BENCH_FILE)
+        col = "text" if "text" in df.columns else "texts"
+        texts = [str(t) for t in df[col].dropna()]
+    else:
+        texts = []
+        with open(VOCAB_CORPUS, "r", encoding="utf-8") as f:
+            for line in f:
+                tokens = json.loads(line).get("tokens") if line.strip() else None
+                if tokens:
+                    texts.append("".join(tokens))
+    rng = random.Random(SEED)
+    if len(texts) > BENCH_SAMPLES:
+        texts = rng.sample(texts, BENCH_SAMPLES)
+    return texts
+
+
+def boundary_set(tokens):
+    out = set()
+    pos = 0
+    for tok in tokens:
+        pos += len(tok)
+        out.add(pos)
+    return out
+
+
+def agreement(pred_batches, ref_batches):
+    tp = n_pred = n_ref = exact = 0
+    for pred, ref in zip(pred_batches, ref_batches):
+        p, r = boundary_set(pred), boundary_set(ref)
+        tp += len(p & r)
+        n_pred += len(p)
+        n_ref += len(r)
+        exact += pred == ref
+    precision = tp / n_pred if n_pred else 0.0
+    recall = tp / n_ref if n_ref else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "boundary_precision": round(precision, 4),
+        "boundary_recall": round(recall, 4),
+        "boundary_f1": round(f1, 4),
+        "exact_match": round(exact / max(1, len(ref_batches)), 4),
+    }
+
+
+def main():
+    segmenter = load_segmenter(rebuild=os.getenv("REBUILD", "0") == "1")
+    texts = load_bench_texts()
+    chars = sum(len(t) for t in texts)
+    print(f"Benchmarking on {len(texts)} texts ({chars} characters)")
+
+    start = time.perf_counter()
+    trie_tokens = segmenter.segment_batch(texts)
+    trie_secs = time.perf_counter() - start
+    print(f"trie      : {trie_secs:.3f}s ({chars / trie_secs:,.0f} chars/s)")
+
+    try:
+        from pythainlp import word_tokenize
+    except ImportError:
+        print("pythainlp not installed; skipping agreement report.")
+        return
+
+    start = time.perf_counter()
+    ref_tokens = [word_tokenize(t) for t in texts]
+    ref_secs = time.perf_counter() - start
+    print(f"pythainlp : {ref_secs:.3f}s ({chars / ref_secs:,.0f} chars/s)")
+    print(f"speedup   : {ref_secs / trie_secs:.1f}x")
+    for key, value in agreement(trie_tokens, ref_tokens).items():
+        print(f"{key:18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
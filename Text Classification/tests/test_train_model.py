@@ -0,0 +1,20 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from train_model import ThaiSentimentDataset
+
+
+def test_no_tokens_column_disables_augmentation():
+    texts = ["อาหารอร่อยมาก", "บริการแย่"]
+    dataset = ThaiSentimentDataset(texts, [4, 0], tokenizer=None, tokens=[None] * len(texts), augmentations=3)
+    assert len(dataset) == len(texts)
+    assert [dataset.get_text(i)[0] for i in range(len(dataset))] == texts
+
+
+def test_tokens_enable_augmentation():
+    texts = ["อาหารอร่อยมาก", "บริการแย่"]
+    tokens = [["อาหาร", "อร่อย", "มาก"], ["บริการ", "แย่"]]
+    dataset = ThaiSentimentDataset(texts, [4, 0], tokenizer=None, tokens=tokens, augmentations=3)
+    assert len(dataset) == len(texts) * 4
@@ -0,0 +1,207 @@
+"""
+Fast path for the bundled BPE tokenizer (tokenizer/tokenizer.json at the
+repository root): loaded once per process, parallel batch encoding through the
+Rust `tokenizers` library, and optional on-disk caching of the ids of whole
+corpus files.
+
+Run as a script to benchmark it on ThaiNER.jsonl: tokens/sec, fertility
+(subwords per corpus word), <unk> rate and truncation rate at MAX_LENGTHS, on
+the segmented words and on the raw (joined) text. Hub tokenizers listed in
+COMPARE_TOKENIZERS are measured the same way.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+from functools import lru_cache, partial
+from pathlib import Path
+
+import numpy as np
+from tokenizers import Tokenizer
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))  # repo root, for common/
+from common.hashing import file_hash
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+TOKENIZER_FILE = Path(os.getenv('TOKENIZER_FILE', str(REPO_ROOT / 'tokenizer' / 'tokenizer.json')))
+DATA_FILE = Path(os.getenv('DATA_FILE', str(Path(__file__).resolve().parents[1] / 'data' / 'ThaiNER.jsonl')))
+CACHE_DIR = Path(os.getenv('TOKEN_IDS_DIR', str(DATA_FILE.parent / 'token_ids')))
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', '4096'))
+MAX_LENGTHS = [int(n) for n in os.getenv('MAX_LENGTHS', '128,512').split(',')]
+REPEATS = int(os.getenv('REPEATS', '3'))
+COMPARE_TOKENIZERS = [name for name in os.getenv('COMPARE_TOKENIZERS', '').split(',') if name]
+# <bos>/<eos> a model input adds around the bundled tokenizer's output, which
+# has no post-processor of its own
+SPECIAL_TOKENS = 2
+
+# Threads used by encode_batch; the Rust thread pool reads this on first use
+if os.getenv('THREADS'):
+    os.environ['RAYON_NUM_THREADS'] = os.environ['THREADS']
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(path=TOKENIZER_FILE):
+    """The tokenizer at `path`, parsed once per process"""
+    return Tokenizer.from_file(str(path))
+
+
+def encode_batch(texts, tokenizer=None, add_special_tokens=False):
+    """
+    Ids for a batch of texts, encoded in parallel. Each text is either a string
+    or a list of words (pre-segmented, as in ThaiNER `tokens`).
+    """
+    tokenizer = tokenizer or load_tokenizer()
+    if not texts:
+        return []
+    pretokenized = isinstance(texts[0], list)
+    encodings = tokenizer.encode_batch(texts, is_pretokenized=pretokenized, add_special_tokens=add_special_tokens)
+    return [encoding.ids for encoding in encodings]
+
+
+def iter_texts(path, field='tokens'):
+    """`field` of every JSONL record that has it, or every line of a text file"""
+    path = Path(path)
+    with path.open('r', encoding='utf-8') as f:
+        for line in f:
+            if path.suffix != '.jsonl':
+                yield line.rstrip('\n')
+                continue
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if field in item:
+                yield item[field]
+
+
+def iter_batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def encode_file(path, field='tokens', tokenizer_file=TOKENIZER_FILE, cache_dir=CACHE_DIR, batch_size=BATCH_SIZE):
+    """
+    Ids of every text in a corpus file as a flat int32 array plus int64 offsets
+    (text i is ids[offsets[i]:offsets[i + 1]]). With a cache_dir, results are
+    stored under a key of file contents, tokenizer and field and memory-mapped
+    on later calls.
+    """
+    path = Path(path)
+    tokenizer = load_tokenizer(Path(tokenizer_file))
+    if cache_dir is not None:
+        key_source = json.dumps([file_hash(path), file_hash(tokenizer_file), field])
+        key = hashlib.blake2b(key_source.encode('utf-8'), digest_size=12).hexdigest()
+        ids_path = Path(cache_dir) / f'{key}.ids.npy'
+        offsets_path = Path(cache_dir) / f'{key}.offsets.npy'
+        # Offsets are written last; their presence marks a complete entry
+        if offsets_path.exists():
+            return np.load(ids_path, mmap_mode='r'), np.load(offsets_path, mmap_mode='r')
+
+    chunks, lengths = [], []
+    for batch in iter_batches(iter_texts(path, field), batch_size):
+        for ids in encode_batch(batch, tokenizer):
+            chunks.append(np.asarray(ids, dtype=np.int32))
+            lengths.append(len(ids))
+    ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    if cache_dir is not None:
+        ids_path.parent.mkdir(parents=True, exist_ok=True)
+        np.save(ids_path, ids)
+        np.save(offsets_path, offsets)
+    return ids, offsets
+
+
+def benchmark(name, encode, docs, num_words, unk_id=None, specials=0, max_lengths=MAX_LENGTHS, repeats=REPEATS):
+    """
+    Times `encode` (a batch of docs -> id lists) over all docs, best of
+    `repeats`, and reports throughput, fertility, <unk> rate and truncation.
+    `specials` is the number of special tokens a model input adds on top.
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        encoded = [ids for batch in iter_batches(docs, BATCH_SIZE) for ids in encode(batch)]
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    lengths = np.array([len(ids) for ids in encoded])
+    subwords = int(lengths.sum())
+    unknown = sum(ids.count(unk_id) for ids in encoded) if unk_id is not None else 0
+    return {
+        'name': name,
+        'seconds': best,
+        'tokens_per_sec': subwords / best,
+        'words_per_sec': num_words / best,
+        'fertility': subwords / num_words,
+        'unk_rate': unknown / max(subwords, 1),
+        'truncated': {n: float(np.mean(lengths + specials > n)) for n in max_lengths},
+    }
+
+
+def print_results(results):
+    header = f"{'tokenizer':<40} {'tok/s':>10} {'words/s':>10} {'fertility':>9} {'unk':>7}"
+    header += ''.join(f' {f"trunc@{n}":>10}' for n in MAX_LENGTHS)
+    print(header)
+    for r in results:
+        row = f"{r['name']:<40} {r['tokens_per_sec']:>10.0f} {r['words_per_sec']:>10.0f} {r['fertility']:>9.3f} {r['unk_rate']:>7.2%}"
+        row += ''.join(f" {r['truncated'][n]:>10.2%}" for n in MAX_LENGTHS)
+        print(row)
+
+
+def corpus_documents(data_file=DATA_FILE):
+    """Segmented and raw (words joined without spaces) documents, and the word count"""
+    words = [tokens for tokens in iter_texts(data_file, 'tokens') if tokens]
+    return words, [''.join(tokens) for tokens in words], sum(len(tokens) for tokens in words)
+
+
+def file_tokenizer_results(words, raw, num_words, tokenizer_file=TOKENIZER_FILE, label='bundled'):
+    tokenizer = load_tokenizer(Path(tokenizer_file))
+    encode = partial(encode_batch, tokenizer=tokenizer)
+    unk_id = tokenizer.token_to_id('<unk>')
+    return [
+        benchmark(f'{label} (segmented)', encode, words, num_words, unk_id, SPECIAL_TOKENS),
+        benchmark(f'{label} (raw text)', encode, raw, num_words, unk_id, SPECIAL_TOKENS),
+    ]
+
+
+def hub_results(model_name, words, raw, num_words):
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    specials = tokenizer.num_special_tokens_to_add()
+
+    def encode(batch):
+        return tokenizer(batch, is_split_into_words=isinstance(batch[0], list), add_special_tokens=False)['input_ids']
+
+    return [
+        benchmark(f'{model_name} (segmented)', encode, words, num_words, tokenizer.unk_token_id, specials),
+        benchmark(f'{model_name} (raw text)', encode, raw, num_words, tokenizer.unk_token_id, specials),
+    ]
+
+
+def main():
+    words, raw, num_words = corpus_documents()
+    print(f'{len(words)} documents, {num_words} words from {DATA_FILE}')
+    print(f"Threads: {os.getenv('RAYON_NUM_THREADS') or os.cpu_count()}, batch size {BATCH_SIZE}, best of {REPEATS}")
+
+    start = time.perf_counter()
+    load_tokenizer.cache_clear()
+    load_tokenizer()
+    print(f'Loaded {TOKENIZER_FILE} in {time.perf_counter() - start:.3f}s')
+
+    results = file_tokenizer_results(words, raw, num_words)
+    for model_name in COMPARE_TOKENIZERS:
+        results.extend(hub_results(model_name, words, raw, num_words))
+    print_results(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Records which part of ThaiNER.jsonl a saved model was trained on (byte offset,
+line count and a hash of that prefix), so later runs can pick up only the
+lines appended since.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+STATE_NAME = 'corpus_state.json'
+
+
+def prefix_hash(data_file, length, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    remaining = length
+    with Path(data_file).open('rb') as f:
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def corpus_snapshot(data_file):
+    """Offset, line count and prefix hash of the corpus as it is now"""
+    data_file = Path(data_file)
+    offset = data_file.stat().st_size
+    with data_file.open('rb') as f:
+        lines = sum(1 for _ in f)
+    return {'offset': offset, 'lines': lines, 'prefix_hash': prefix_hash(data_file, offset)}
+
+
+def save_state(model_dir, data_file, **extra):
+    state = {**corpus_snapshot(data_file), **extra}
+    path = Path(model_dir) / STATE_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    return state
+
+
+def load_state(model_dir):
+    path = Path(model_dir) / STATE_NAME
+    if not path.exists():
+        return None
+    with path.open('r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def is_append_only(state, data_file):
+    """True if the corpus still starts with exactly the bytes the model saw"""
+    data_file = Path(data_file)
+    if data_file.stat().st_size < state['offset']:
+        return False
+    return prefix_hash(data_file, state['offset']) == state['prefix_hash']
+
+
+def iter_prefix(state, data_file, skip_lines=()):
+    """Parse the lines the model was trained on (up to the recorded offset), leaving out the 1-based skip_lines"""
+    with Path(data_file).open('rb') as f:
+        line_no = 0
+        while f.tell() < state['offset']:
+            line = f.readline()
+            if not line:
+                break
+            line_no += 1
+            line = line.decode('utf-8').strip()
+            if line and line_no not in skip_lines:
+                yield json.loads(line)
+
+
+def iter_appended(state, data_file, skip_lines=()):
+    """Parse the lines added after the recorded offset, leaving out the 1-based skip_lines"""
+    with Path(data_file).open('rb') as f:
+        f.seek(state['offset'])
+        for line_no, line in enumerate(f, start=state['lines'] + 1):
+            line = line.decode('utf-8').strip()
+            if line and line_no not in skip_lines:
+                yield json.loads(line)
@@ -0,0 +1,148 @@
+"""
+K-fold cross-validation of the NER model, stratified by domain. The corpus is
+encoded once into the shared memory-mapped cache of streaming_dataset.py, and
+folds train concurrently in separate processes, each pinned to its own share
+of the CPU cores. Per-fold precision/recall/F1 and their mean and standard
+deviation are written to data/cv_results.json.
+"""
+
+import json
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from sklearn.model_selection import StratifiedKFold
+from torch.utils.data import Dataset
+from transformers import AutoTokenizer, AutoModelForTokenClassification, DataCollatorForTokenClassification, Trainer
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))  # repo root, for common/
+from common.folds import run_folds, summarize
+from common.system import available_cores
+
+import train_model
+from streaming_dataset import encode_corpus, iter_corpus, scan_labels
+from train_model import (
+    DATA_FILE, ENCODED_DIR, VALIDATE, build_label_maps, build_training_args, check_corpus, make_compute_metrics
+)
+
+MODEL_NAME = os.getenv('MODEL_NAME', train_model.MODEL_NAME)
+FOLDS = int(os.getenv('FOLDS', '5'))
+SEED = int(os.getenv('SEED', '42'))
+OUTPUT_FILE = Path(os.getenv('OUTPUT_FILE', str(DATA_FILE.parent / 'cv_results.json')))
+NUM_EPOCHS = float(os.getenv('NUM_EPOCHS', '3'))
+# Folds trained at the same time; each gets THREADS_PER_FOLD cores
+PARALLEL_FOLDS = int(os.getenv('PARALLEL_FOLDS', '0')) or min(FOLDS, len(available_cores()))
+THREADS_PER_FOLD = int(os.getenv('THREADS_PER_FOLD', '0')) or max(1, len(available_cores()) // PARALLEL_FOLDS)
+
+
+def stratification_keys(data_file, folds=FOLDS, skip_lines=()):
+    """Domain of every example, with domains rarer than `folds` pooled into one bucket"""
+    domains = [item.get('domain') or '' for item in iter_corpus(data_file, skip_lines)]
+    counts = Counter(domains)
+    return [domain if counts[domain] >= folds else '<rare>' for domain in domains]
+
+
+def make_folds(keys, folds=FOLDS, seed=SEED):
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    return [(train_idx.tolist(), test_idx.tolist()) for train_idx, test_idx in splitter.split(keys, keys)]
+
+
+def encode_all(tokenizer, label_to_id, skip_lines=()):
+    """Every example, in corpus order, as one encoded split (cached on disk)"""
+    return encode_corpus(DATA_FILE, tokenizer, label_to_id, ENCODED_DIR, test_percent=0, skip_lines=skip_lines)['train']
+
+
+class EncodedSubset(Dataset):
+    """Examples of an EncodedSplit selected by index"""
+
+    def __init__(self, split, indices):
+        self.split = split
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        return self.split.example(self.indices[idx])
+
+
+def run_fold(fold, train_idx, test_idx, label_list, model_name=MODEL_NAME, skip_lines=()):
+    label_to_id, id_to_label = build_label_maps(label_list)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForTokenClassification.from_pretrained(
+        model_name,
+        num_labels=len(label_list),
+        id2label=id_to_label,
+        label2id=label_to_id,
+        ignore_mismatched_sizes=True,
+    )
+    encoded = encode_all(tokenizer, label_to_id, skip_lines)
+
+    # Only the final model is evaluated, on the held-out fold
+    args = build_training_args(
+        output_dir=f'./results_cv/fold{fold}',
+        num_train_epochs=NUM_EPOCHS,
+        eval_strategy='no',
+        save_strategy='no',
+        load_best_model_at_end=False,
+        seed=SEED + fold,
+    )
+    trainer = Trainer(
+        model=model,
+        args=args,
+        train_dataset=EncodedSubset(encoded, train_idx),
+        eval_dataset=EncodedSubset(encoded, test_idx),
+        data_collator=DataCollatorForTokenClassification(tokenizer),
+        compute_metrics=make_compute_metrics(id_to_label),
+    )
+    trainer.train()
+    metrics = trainer.evaluate()
+    return {key: metrics[f'eval_{key}'] for key in ('precision', 'recall', 'f1')}
+
+
+def main():
+    # Validated like train_model.py; with SKIP_INVALID=1 records with errors are left out
+    skip_lines = check_corpus(DATA_FILE) if VALIDATE else set()
+    label_list = scan_labels(DATA_FILE, skip_lines)
+    label_to_id, _ = build_label_maps(label_list)
+
+    # Encode once up front so the fold processes only open the memory maps
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    encoded = encode_all(tokenizer, label_to_id, skip_lines)
+
+    keys = stratification_keys(DATA_FILE, skip_lines=skip_lines)
+    folds = make_folds(keys)
+    print(f'{FOLDS}-fold cross-validation on {len(encoded)} examples ({len(set(keys))} domain strata): '
+          f'{PARALLEL_FOLDS} folds at a time x {THREADS_PER_FOLD} threads')
+    start = time.perf_counter()
+    fold_metrics = run_folds(folds, run_fold, (label_list, MODEL_NAME, skip_lines), PARALLEL_FOLDS, THREADS_PER_FOLD)
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(fold_metrics)
+    for key, value in summary.items():
+        print(f"{key}: {value['mean']:.4f} ± {value['stdev']:.4f}")
+    print(f'Wall time {elapsed:.1f}s for {FOLDS} folds')
+
+    OUTPUT_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with OUTPUT_FILE.open('w', encoding='utf-8') as f:
+        json.dump(
+            {
+                'model': MODEL_NAME,
+                'data_file': str(DATA_FILE),
+                'folds': FOLDS,
+                'parallel_folds': PARALLEL_FOLDS,
+                'threads_per_fold': THREADS_PER_FOLD,
+                'wall_seconds': elapsed,
+                'per_fold': fold_metrics,
+                'summary': summary,
+            },
+            f,
+            indent=2,
+        )
+    print(f'Results written to {OUTPUT_FILE}')
+
+
+if __name__ == '__main__':
+    main()
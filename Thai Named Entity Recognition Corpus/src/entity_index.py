@@ -0,0 +1,282 @@
+"""
+Inverted entity index over ThaiNER.jsonl. `build` decodes every BIO sequence
+into spans once and writes postings (entity text, entity type and domain ->
+sorted sentence numbers) as one flat uint32 array plus a JSON directory, with
+a span table and the byte offset of every sentence for fetching matches.
+Queries combine field:value terms with AND, OR and parentheses.
+
+    python src/entity_index.py build
+    python src/entity_index.py 'type:ORGANIZATION AND domain:finance'
+    python src/entity_index.py 'text:"ธนาคารกรุงเทพ" OR text:กสิกรไทย'
+"""
+
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from validate_corpus import check_record
+
+DATA_FILE = Path(os.getenv('DATA_FILE', str(Path(__file__).resolve().parents[1] / 'data' / 'ThaiNER.jsonl')))
+INDEX_DIR = Path(os.getenv('INDEX_DIR', str(DATA_FILE.parent / 'entity_index')))
+LIMIT = int(os.getenv('LIMIT', '20'))
+FIELDS = ('text', 'type', 'domain')
+
+
+def decode_spans(tags):
+    """(type, start, end) spans of a BIO sequence; a stray I- tag starts a new span"""
+    spans = []
+    current = None
+    for i, tag in enumerate(tags):
+        prefix, _, label = tag.partition('-')
+        if prefix == 'I' and current is not None and current[0] == label:
+            current[2] = i + 1
+            continue
+        if current is not None:
+            spans.append(tuple(current))
+            current = None
+        if prefix in ('B', 'I') and label:
+            current = [label, i, i + 1]
+    if current is not None:
+        spans.append(tuple(current))
+    return spans
+
+
+def normalize(field, value):
+    value = unicodedata.normalize('NFC', value).strip()
+    if field == 'type':
+        # 'B-ID' and 'ID' name the same entity type
+        value = re.sub(r'^[BI]-', '', value).upper()
+    else:
+        value = value.casefold()
+    return value
+
+
+def build_index(data_file=DATA_FILE, index_dir=INDEX_DIR):
+    """
+    Writes the index; returns the term count per field, the number of indexed
+    sentences and spans, and the ids of records left out because their tokens
+    and tags cannot be aligned (see validate_corpus.check_record)
+    """
+    postings = {field: defaultdict(list) for field in FIELDS}
+    offsets, ids, spans = [], [], []
+    skipped = []
+    types = {}
+    with Path(data_file).open('rb') as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            issues, usable = check_record(item)
+            if any(check == 'length_mismatch' for check, _ in issues) or ('tags' in item and not usable):
+                # Spans would pair tags with the wrong tokens
+                skipped.append(item.get('id') if isinstance(item, dict) else None)
+                continue
+            doc = len(offsets)
+            offsets.append(offset)
+            ids.append(item.get('id'))
+            if item.get('domain'):
+                postings['domain'][normalize('domain', item['domain'])].append(doc)
+            tokens = item.get('tokens') or []
+            for label, start, end in decode_spans(item.get('tags') or []):
+                type_idx = types.setdefault(label, len(types))
+                spans.append((doc, type_idx, start, end))
+                postings['type'][normalize('type', label)].append(doc)
+                text = ''.join(tokens[start:end])
+                if text:
+                    postings['text'][normalize('text', text)].append(doc)
+
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    directory = {field: {} for field in FIELDS}
+    with (index_dir / 'postings.bin').open('wb') as out:
+        position = 0
+        for field in FIELDS:
+            for term in sorted(postings[field]):
+                docs = np.unique(np.asarray(postings[field][term], dtype=np.uint32))
+                out.write(docs.tobytes())
+                directory[field][term] = [position, len(docs)]
+                position += len(docs)
+    np.save(index_dir / 'spans.npy', np.asarray(spans, dtype=np.int32).reshape(-1, 4))
+    np.save(index_dir / 'doc_offsets.npy', np.asarray(offsets, dtype=np.int64))
+    stat = Path(data_file).stat()
+    meta = {
+        'source': {'path': str(data_file), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns},
+        'ids': ids,
+        'types': sorted(types, key=types.get),
+        'directory': directory,
+        'skipped': skipped,
+    }
+    # Written last; its presence marks a complete index
+    with (index_dir / 'directory.json').open('w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return {field: len(directory[field]) for field in FIELDS}, len(offsets), len(spans), skipped
+
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|(\w+):(?:"([^"]*)"|(\S+?))(?=\s|\)|$)|"([^"]*)"|(\S+?)(?=\s|\)|$))')
+
+
+def tokenize_query(query):
+    """('(' | ')' | 'AND' | 'OR' | (field, value)) tokens of a query string"""
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = TOKEN_PATTERN.match(query, position)
+        if not match or match.end() == position:
+            raise ValueError(f'Cannot parse query at: {query[position:]!r}')
+        position = match.end()
+        opening, closing, field, quoted_value, value, quoted_text, word = match.groups()
+        if opening or closing:
+            tokens.append(opening or closing)
+        elif field is not None:
+            if field not in FIELDS:
+                raise ValueError(f'Unknown field {field!r}; use one of {", ".join(FIELDS)}')
+            tokens.append((field, quoted_value if quoted_value is not None else value))
+        elif word is not None and word.upper() in ('AND', 'OR'):
+            tokens.append(word.upper())
+        else:
+            # A bare word or quoted phrase searches entity text
+            tokens.append(('text', quoted_text if quoted_text is not None else word))
+    return tokens
+
+
+class EntityIndex:
+    def __init__(self, index_dir=INDEX_DIR):
+        index_dir = Path(index_dir)
+        with (index_dir / 'directory.json').open('r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.source = meta['source']
+        self.ids = meta['ids']
+        self.types = meta['types']
+        self.directory = meta['directory']
+        self.postings = np.memmap(index_dir / 'postings.bin', dtype=np.uint32, mode='r')
+        self.spans_table = np.load(index_dir / 'spans.npy', mmap_mode='r')
+        self.doc_offsets = np.load(index_dir / 'doc_offsets.npy', mmap_mode='r')
+
+    def is_stale(self):
+        """True if the corpus changed since the index was built"""
+        path = Path(self.source['path'])
+        if not path.exists():
+            return True
+        stat = path.stat()
+        return stat.st_size != self.source['size'] or stat.st_mtime_ns != self.source['mtime_ns']
+
+    def lookup(self, field, value):
+        entry = self.directory[field].get(normalize(field, value))
+        if entry is None:
+            return np.zeros(0, dtype=np.uint32)
+        start, length = entry
+        return self.postings[start:start + length]
+
+    def search(self, query):
+        """Sorted sentence numbers matching the query"""
+        tokens = tokenize_query(query)
+        position = 0
+
+        # expression := conjunction (OR conjunction)*; conjunction := term (AND? term)*
+        def peek():
+            return tokens[position] if position < len(tokens) else None
+
+        def expression():
+            nonlocal position
+            result = conjunction()
+            while peek() == 'OR':
+                position += 1
+                result = np.union1d(result, conjunction())
+            return result
+
+        def conjunction():
+            nonlocal position
+            result = term()
+            while peek() not in (None, 'OR', ')'):
+                if peek() == 'AND':
+                    position += 1
+                result = np.intersect1d(result, term(), assume_unique=True)
+            return result
+
+        def term():
+            nonlocal position
+            token = peek()
+            position += 1
+            if token == '(':
+                result = expression()
+                if peek() != ')':
+                    raise ValueError('Missing closing parenthesis')
+                position += 1
+                return result
+            if isinstance(token, tuple):
+                return np.asarray(self.lookup(*token))
+            if token is None:
+                raise ValueError('Query ends where a term is expected')
+            raise ValueError(f'Unexpected {token!r} in query')
+
+        result = expression()
+        if position != len(tokens):
+            raise ValueError(f'Unexpected {tokens[position]!r} in query')
+        return result
+
+    def spans(self, doc):
+        """(type, start, end) entity spans of one sentence"""
+        rows = self.spans_table[np.searchsorted(self.spans_table[:, 0], doc):]
+        rows = rows[:np.searchsorted(rows[:, 0], doc, side='right')]
+        return [(self.types[t], int(start), int(end)) for _, t, start, end in rows]
+
+    def document(self, doc):
+        """The corpus record of one sentence, read from its byte offset"""
+        with Path(self.source['path']).open('rb') as f:
+            f.seek(int(self.doc_offsets[doc]))
+            return json.loads(f.readline())
+
+
+def print_matches(index, docs, limit=LIMIT):
+    for doc in docs[:limit]:
+        item = index.document(int(doc))
+        tokens = item.get('tokens') or []
+        entities = ', '.join(f"{label}:{''.join(tokens[start:end])}" for label, start, end in index.spans(int(doc)))
+        print(f"{item.get('id')}\t{item.get('domain', '')}\t{''.join(tokens)}\t[{entities}]")
+    if len(docs) > limit:
+        print(f'... {len(docs) - limit} more (set LIMIT to show more)')
+
+
+def main():
+    if len(sys.argv) < 2:
+        raise SystemExit(__doc__)
+    if sys.argv[1] == 'build':
+        start = time.perf_counter()
+        terms, docs, spans, skipped = build_index()
+        print(f'Indexed {docs} sentences and {spans} entity spans from {DATA_FILE} '
+              f'in {time.perf_counter() - start:.2f}s: {terms} terms, written to {INDEX_DIR}')
+        if skipped:
+            print(f"Skipped {len(skipped)} records whose tokens and tags differ in length or are not lists "
+                  f"(e.g. {', '.join(str(i) for i in skipped[:5])}); run src/validate_corpus.py for details")
+        return
+
+    if not (INDEX_DIR / 'directory.json').exists():
+        raise SystemExit(f'No index in {INDEX_DIR}; run: python src/entity_index.py build')
+    index = EntityIndex()
+    if index.is_stale():
+        print(f"Warning: {index.source['path']} changed since the index was built; rebuild it", file=sys.stderr)
+    query = ' '.join(sys.argv[1:])
+    start = time.perf_counter()
+    try:
+        docs = index.search(query)
+    except ValueError as e:
+        raise SystemExit(f'Invalid query: {e}')
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f'{len(docs)} sentences match {query!r} ({elapsed:.2f} ms)')
+    print_matches(index, docs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Low-memory NER data pipeline: stream the corpus, assign train/test by a hash
+of each example's id, encode once to flat int32 files on disk and read them
+back through memory maps in an IterableDataset.
+"""
+
+import hashlib
+import json
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+from torch.utils.data import IterableDataset, get_worker_info
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))  # repo root, for common/
+from common.hashing import file_hash
+
+ENCODE_BATCH = 256
+
+
+def iter_corpus(data_file, skip_lines=()):
+    """Yield tagged examples one line at a time, leaving out the 1-based skip_lines"""
+    with Path(data_file).open('r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip() or line_no in skip_lines:
+                continue
+            item = json.loads(line)
+            if 'tags' in item:  # Only use entries with tags format
+                yield item
+
+
+def split_of(item, test_percent=20):
+    """Deterministic 'train'/'test' assignment from the example id"""
+    key = str(item.get('id') or json.dumps(item['tokens'], ensure_ascii=False))
+    bucket = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big') % 100
+    return 'test' if bucket < test_percent else 'train'
+
+
+def split_record(test_percent=20):
+    """How split_of assigns examples; saved with a model so later runs can check for the same split"""
+    return {'scheme': 'id_blake2b_mod100', 'test_percent': test_percent}
+
+
+def scan_labels(data_file, skip_lines=()):
+    """Sorted tag set of the corpus, read without keeping examples in memory"""
+    all_tags = set()
+    for item in iter_corpus(data_file, skip_lines):
+        all_tags.update(item['tags'])
+    return sorted(all_tags)
+
+
+def align_labels(word_ids, tags, label_to_id):
+    """Tag on the first sub-token of each word, -100 elsewhere"""
+    labels = []
+    previous_word_idx = None
+    for word_idx in word_ids:
+        if word_idx is None or word_idx == previous_word_idx:
+            labels.append(-100)
+        else:
+            labels.append(label_to_id[tags[word_idx]])
+        previous_word_idx = word_idx
+    return labels
+
+
+class EncodedSplit:
+    """input_ids and labels of one split as flat int32 memmaps plus offsets"""
+
+    def __init__(self, directory, split):
+        self.ids_path = directory / f'{split}.ids.bin'
+        self.labels_path = directory / f'{split}.labels.bin'
+        self.offsets_path = directory / f'{split}.offsets.npy'
+
+    def exists(self):
+        return self.offsets_path.exists()
+
+    def open(self):
+        self.offsets = np.load(self.offsets_path)
+        total = int(self.offsets[-1])
+        if total == 0:  # Empty files cannot be memory-mapped
+            self.ids = self.labels = np.zeros(0, dtype=np.int32)
+            return self
+        self.ids = np.memmap(self.ids_path, dtype=np.int32, mode='r', shape=(total,))
+        self.labels = np.memmap(self.labels_path, dtype=np.int32, mode='r', shape=(total,))
+        return self
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def example(self, idx):
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return {
+            'input_ids': self.ids[start:end].tolist(),
+            'attention_mask': [1] * (end - start),
+            'labels': self.labels[start:end].tolist(),
+        }
+
+
+def encode_corpus(data_file, tokenizer, label_to_id, cache_root, max_len=512, test_percent=20, skip_lines=()):
+    """
+    Encode the corpus once into cache_root/<key>/{train,test}.*, where the key
+    covers the corpus contents, tokenizer, labels, max_len and skipped lines.
+    Only one batch of examples is held in memory while encoding.
+    """
+    tokenizer_id = getattr(tokenizer, 'backend_tokenizer', None)
+    tokenizer_id = tokenizer_id.to_str() if tokenizer_id is not None else tokenizer.name_or_path
+    key_source = json.dumps(
+        [file_hash(data_file), tokenizer_id, sorted(label_to_id.items()), max_len, test_percent, sorted(skip_lines)]
+    )
+    directory = Path(cache_root) / hashlib.blake2b(key_source.encode('utf-8'), digest_size=12).hexdigest()
+    splits = {name: EncodedSplit(directory, name) for name in ('train', 'test')}
+    if all(split.exists() for split in splits.values()):
+        print(f'Using encoded corpus in {directory}')
+        return {name: split.open() for name, split in splits.items()}
+
+    directory.mkdir(parents=True, exist_ok=True)
+    files = {
+        name: (split.ids_path.open('wb'), split.labels_path.open('wb'), [0])
+        for name, split in splits.items()
+    }
+
+    def flush(batch):
+        encoding = tokenizer(
+            [item['tokens'] for item in batch], is_split_into_words=True, truncation=True, max_length=max_len
+        )
+        for i, item in enumerate(batch):
+            ids_file, labels_file, offsets = files[split_of(item, test_percent)]
+            input_ids = encoding['input_ids'][i]
+            labels = align_labels(encoding.word_ids(i), item['tags'], label_to_id)
+            ids_file.write(np.asarray(input_ids, dtype=np.int32).tobytes())
+            labels_file.write(np.asarray(labels, dtype=np.int32).tobytes())
+            offsets.append(offsets[-1] + len(input_ids))
+
+    batch = []
+    try:
+        for item in iter_corpus(data_file, skip_lines):
+            batch.append(item)
+            if len(batch) >= ENCODE_BATCH:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        for ids_file, labels_file, _ in files.values():
+            ids_file.close()
+            labels_file.close()
+    # Offsets are written last; their presence marks a complete split
+    for name, split in splits.items():
+        np.save(split.offsets_path, np.asarray(files[name][2], dtype=np.int64))
+
+    counts = {name: len(files[name][2]) - 1 for name in files}
+    print(f'Encoded corpus to {directory}: {counts}')
+    return {name: split.open() for name, split in splits.items()}
+
+
+class StreamingNERDataset(IterableDataset):
+    """
+    Streams encoded examples from an EncodedSplit. With shuffle_buffer > 0 the
+    order is shuffled within a sliding buffer, reseeded every epoch.
+    """
+
+    def __init__(self, split, shuffle_buffer=0, seed=42):
+        self.split = split
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.split)
+
+    def __iter__(self):
+        indices = range(len(self.split))
+        worker = get_worker_info()
+        if worker is not None:
+            indices = indices[worker.id::worker.num_workers]
+        if not self.shuffle_buffer:
+            for idx in indices:
+                yield self.split.example(idx)
+            return
+
+        rng = random.Random(f'{self.seed}:{self.epoch}')
+        buffer = []
+        for idx in indices:
+            buffer.append(idx)
+            if len(buffer) >= self.shuffle_buffer:
+                yield self.split.example(buffer.pop(rng.randrange(len(buffer))))
+        rng.shuffle(buffer)
+        for idx in buffer:
+            yield self.split.example(idx)
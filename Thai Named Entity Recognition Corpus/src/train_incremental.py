@@ -0,0 +1,125 @@
+"""
+Incremental NER fine-tuning: continue from the saved ./model checkpoint on the
+lines appended to ThaiNER.jsonl since it was trained, mixed with a replay
+sample of older examples. The model is only replaced when F1 on the fixed,
+id-hashed test split does not regress.
+"""
+
+import os
+import random
+from pathlib import Path
+
+from transformers import AutoTokenizer, AutoModelForTokenClassification, DataCollatorForTokenClassification
+from transformers import Trainer, TrainingArguments
+
+from corpus_state import is_append_only, iter_appended, iter_prefix, load_state, save_state
+from streaming_dataset import iter_corpus, split_of, split_record
+from train_model import DATA_FILE, VALIDATE, NERDataset, check_corpus, make_compute_metrics
+
+MODEL_DIR = Path(os.getenv('MODEL_DIR', './model'))
+# Older training examples replayed per new example, to limit forgetting
+REPLAY_RATIO = float(os.getenv('REPLAY_RATIO', '2.0'))
+# The new model may score at most this much F1 below the old one
+F1_TOLERANCE = float(os.getenv('F1_TOLERANCE', '0.0'))
+TEST_PERCENT = int(os.getenv('TEST_PERCENT', '20'))
+EPOCHS = float(os.getenv('INCREMENTAL_EPOCHS', '1'))
+LEARNING_RATE = float(os.getenv('INCREMENTAL_LR', '2e-5'))
+SEED = int(os.getenv('SEED', '42'))
+
+
+def sample_replay(state, data_file, size, rng, skip_lines=()):
+    """Reservoir sample of training-split examples the model has already seen"""
+    reservoir = []
+    seen = 0
+    for item in iter_prefix(state, data_file, skip_lines):
+        if 'tags' not in item or split_of(item, TEST_PERCENT) != 'train':
+            continue
+        seen += 1
+        if len(reservoir) < size:
+            reservoir.append(item)
+        else:
+            j = rng.randrange(seen)
+            if j < size:
+                reservoir[j] = item
+    return reservoir
+
+
+def main():
+    state = load_state(MODEL_DIR)
+    if state is None:
+        raise SystemExit(f'No corpus state in {MODEL_DIR}; train the full model with train_model.py first.')
+    if not is_append_only(state, DATA_FILE):
+        raise SystemExit(
+            f'{DATA_FILE} was modified before offset {state["offset"]}, not only appended to; '
+            'retrain the full model with train_model.py.'
+        )
+    # The F1 gate is only meaningful if the test split held out of the base
+    # model is the one evaluated here
+    if state.get('split') != split_record(TEST_PERCENT):
+        raise SystemExit(
+            f"{MODEL_DIR} was trained with split {state.get('split')}, not {split_record(TEST_PERCENT)}; "
+            'its test examples may have been trained on. Retrain the full model with train_model.py '
+            '(with the same TEST_PERCENT).'
+        )
+
+    # Validated like train_model.py; with SKIP_INVALID=1 records with errors are left out
+    skip_lines = check_corpus(DATA_FILE) if VALIDATE else set()
+    appended = [item for item in iter_appended(state, DATA_FILE, skip_lines) if 'tags' in item]
+    new_train = [item for item in appended if split_of(item, TEST_PERCENT) == 'train']
+    print(f'{len(appended)} new tagged examples since the last checkpoint, {len(new_train)} for training')
+    if not new_train:
+        print('Nothing new to train on.')
+        return
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR)
+    model = AutoModelForTokenClassification.from_pretrained(MODEL_DIR)
+    label_to_id = {label: int(i) for label, i in model.config.label2id.items()}
+    id_to_label = {int(i): label for i, label in model.config.id2label.items()}
+    unknown = {tag for item in appended for tag in item['tags']} - label_to_id.keys()
+    if unknown:
+        raise SystemExit(f'New tags {sorted(unknown)} are not in the model; retrain with train_model.py.')
+
+    rng = random.Random(SEED)
+    replay = sample_replay(state, DATA_FILE, int(len(new_train) * REPLAY_RATIO), rng, skip_lines)
+    train_data = new_train + replay
+    rng.shuffle(train_data)
+    test_data = [item for item in iter_corpus(DATA_FILE, skip_lines) if split_of(item, TEST_PERCENT) == 'test']
+    print(f'Training on {len(new_train)} new + {len(replay)} replayed examples; {len(test_data)} test examples')
+
+    args = TrainingArguments(
+        output_dir='./results_incremental',
+        num_train_epochs=EPOCHS,
+        learning_rate=LEARNING_RATE,
+        per_device_train_batch_size=8,
+        per_device_eval_batch_size=8,
+        weight_decay=0.01,
+        logging_steps=10,
+        save_strategy='no',
+        seed=SEED,
+    )
+    trainer = Trainer(
+        model=model,
+        args=args,
+        train_dataset=NERDataset(train_data, tokenizer, label_to_id),
+        eval_dataset=NERDataset(test_data, tokenizer, label_to_id),
+        data_collator=DataCollatorForTokenClassification(tokenizer),
+        compute_metrics=make_compute_metrics(id_to_label),
+    )
+
+    before = trainer.evaluate()['eval_f1']
+    print(f'F1 before: {before:.4f}')
+    trainer.train()
+    after = trainer.evaluate()['eval_f1']
+    print(f'F1 after: {after:.4f}')
+
+    if after < before - F1_TOLERANCE:
+        raise SystemExit(f'F1 regressed ({before:.4f} -> {after:.4f}); keeping the previous model in {MODEL_DIR}.')
+
+    model.save_pretrained(MODEL_DIR)
+    tokenizer.save_pretrained(MODEL_DIR)
+    save_state(MODEL_DIR, DATA_FILE, split=split_record(TEST_PERCENT), test_f1=after)
+    print(f'Model updated in {MODEL_DIR}')
+
+
+if __name__ == '__main__':
+    main()
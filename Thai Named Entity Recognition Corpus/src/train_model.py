@@ -1,51 +1,128 @@
 import json
-import torch
+import os
 from transformers import AutoTokenizer, AutoModelForTokenClassification, TrainingArguments, Trainer
-from sklearn.model_selection import train_test_split
+from transformers import DataCollatorForTokenClassification
 from torch.utils.data import Dataset
+from seqeval.metrics import precision_score, recall_score, f1_score
 import numpy as np
 
 from pathlib import Path
 
-# Load dataset (resolve path relative to this script)
-data = []
-data_file = Path(__file__).resolve().parents[1] / 'data' / 'ThaiNER.jsonl'
-if not data_file.exists():
-    raise SystemExit(f"Data file not found: {data_file}. Ensure you're running the script from the repository root or provide the correct path.")
-
-with data_file.open('r', encoding='utf-8') as f:
-    for line in f:
-        item = json.loads(line)
-        if 'tags' in item:  # Only use entries with tags format
-            data.append(item)
-
-print(f'Loaded {len(data)} examples from {data_file}')
-
-# Extract unique labels
-all_tags = set()
-for item in data:
-    all_tags.update(item['tags'])
-label_list = sorted(list(all_tags))
-label_to_id = {label: i for i, label in enumerate(label_list)}
-id_to_label = {i: label for label, i in label_to_id.items()}
-
-print(f"Labels: {label_list}")
-print(f"Number of labels: {len(label_list)}")
-
-# Split data
-train_data, test_data = train_test_split(data, test_size=0.2, random_state=42)
-
-# Load model and tokenizer
-model_name = "Pavarissy/phayathaibert-thainer"
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForTokenClassification.from_pretrained(
-        model_name, 
-        num_labels=len(label_list), 
-        id2label=id_to_label, 
-        label2id=label_to_id,
-        ignore_mismatched_sizes=True
+from corpus_state import save_state
+from streaming_dataset import StreamingNERDataset, encode_corpus, scan_labels, split_of, split_record
+from training_perf import ThroughputCallback, TokenCountingCollator, perf_training_kwargs
+from validate_corpus import REPORT_FILE, error_lines, print_summary, validate_files, write_report
+
+DATA_FILE = Path(os.getenv('DATA_FILE', str(Path(__file__).resolve().parents[1] / 'data' / 'ThaiNER.jsonl')))
+MODEL_NAME = "Pavarissy/phayathaibert-thainer"
+
+# Opt-in CPU performance mode: bf16 autocast (where the CPU supports it),
+# torch.compile, gradient accumulation and fused AdamW. Each part can be
+# overridden on its own.
+PERF_MODE = os.getenv('PERF_MODE', '0') == '1'
+BF16 = os.getenv('BF16', 'auto' if PERF_MODE else '0')
+COMPILE = os.getenv('COMPILE', '1' if PERF_MODE else '0') == '1'
+FUSED_ADAMW = os.getenv('FUSED_ADAMW', '1' if PERF_MODE else '0') == '1'
+GRAD_ACCUM_STEPS = int(os.getenv('GRAD_ACCUM_STEPS', '4' if PERF_MODE else '1'))
+
+# Train/test membership comes from a hash of each id (TEST_PERCENT of ids go
+# to test), so the split stays the same as the corpus grows and
+# train_incremental.py evaluates on examples this run never trained on.
+TEST_PERCENT = int(os.getenv('TEST_PERCENT', '20'))
+
+# Low-memory mode: gradient checkpointing, and examples streamed from an
+# encoded copy of the corpus on disk instead of lists of dicts.
+LOW_MEMORY = os.getenv('LOW_MEMORY', '0') == '1'
+ENCODED_DIR = Path(os.getenv('ENCODED_DIR', str(DATA_FILE.parent / 'encoded')))
+SHUFFLE_BUFFER = int(os.getenv('SHUFFLE_BUFFER', '1024'))
+# Move eval predictions to the CPU every N steps instead of keeping them all
+EVAL_ACCUMULATION_STEPS = int(os.getenv('EVAL_ACCUMULATION_STEPS', '8'))
+
+# The corpus is validated before training (see validate_corpus.py) and errors
+# stop the run; with SKIP_INVALID=1 the records with errors are left out.
+VALIDATE = os.getenv('VALIDATE', '1') == '1'
+SKIP_INVALID = os.getenv('SKIP_INVALID', '0') == '1'
+
+
+def check_corpus(data_file):
+    """Validate the corpus; returns the line numbers to leave out of training"""
+    report = validate_files([data_file])
+    write_report(report)
+    if not report['errors']:
+        return set()
+    print_summary(report)
+    if not SKIP_INVALID:
+        raise SystemExit(
+            f"{data_file} has {report['errors']} errors (see {REPORT_FILE}). Fix them, or set SKIP_INVALID=1 "
+            "to train without those records (VALIDATE=0 skips validation)."
+        )
+    skip_lines = error_lines(report, data_file)
+    print(f'Leaving out {len(skip_lines)} records with errors')
+    return skip_lines
+
+
+def load_data(data_file, skip_lines=()):
+    """Load tagged examples from the corpus"""
+    if not data_file.exists():
+        raise SystemExit(f"Data file not found: {data_file}. Ensure you're running the script from the repository root or provide the correct path.")
+
+    data = []
+    with data_file.open('r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            if line_no in skip_lines:
+                continue
+            item = json.loads(line)
+            if 'tags' in item:  # Only use entries with tags format
+                data.append(item)
+
+    print(f'Loaded {len(data)} examples from {data_file}')
+    return data
+
+
+def collect_labels(data):
+    """Extract unique labels"""
+    all_tags = set()
+    for item in data:
+        all_tags.update(item['tags'])
+    return sorted(list(all_tags))
+
+
+def build_label_maps(label_list):
+    label_to_id = {label: i for i, label in enumerate(label_list)}
+    id_to_label = {i: label for label, i in label_to_id.items()}
+    return label_to_id, id_to_label
+
+
+def encode_example(item, tokenizer, label_to_id, max_len=512):
+    """Tokenize one example and align its tags to the first sub-token of each word"""
+    tokens = item['tokens']
+    tags = item['tags']
+
+    # Tokenize (unpadded; the data collator pads each batch)
+    encoding = tokenizer(
+        tokens,
+        is_split_into_words=True,
+        truncation=True,
+        max_length=max_len,
     )
 
+    # Align labels
+    word_ids = encoding.word_ids()
+    labels = []
+    previous_word_idx = None
+    for word_idx in word_ids:
+        if word_idx is None:
+            labels.append(-100)
+        elif word_idx != previous_word_idx:
+            labels.append(label_to_id[tags[word_idx]])
+        else:
+            labels.append(-100)
+        previous_word_idx = word_idx
+
+    encoding['labels'] = labels
+    return dict(encoding)
+
+
 # Custom Dataset
 class NERDataset(Dataset):
     def __init__(self, data, tokenizer, label_to_id, max_len=512):
@@ -58,91 +135,115 @@ class NERDataset(Dataset):
         return len(self.data)
 
     def __getitem__(self, idx):
-        item = self.data[idx]
-        tokens = item['tokens']
-        tags = item['tags']
-
-        # Tokenize
-        encoding = self.tokenizer(
-            tokens,
-            is_split_into_words=True,
-            truncation=True,
-            padding='max_length',
-            max_length=self.max_len,
-            return_tensors='pt'
+        return encode_example(self.data[idx], self.tokenizer, self.label_to_id, self.max_len)
+
+
+def make_compute_metrics(id_to_label):
+    def compute_metrics(p):
+        predictions, labels = p
+        preds = np.argmax(predictions, axis=2)
+        true_labels, pred_labels = [], []
+        for i in range(len(labels)):
+            t, pr = [], []
+            for j, lab in enumerate(labels[i]):
+                if lab != -100:
+                    t.append(id_to_label[lab])
+                    pr.append(id_to_label[preds[i][j]])
+            true_labels.append(t)
+            pred_labels.append(pr)
+        return {
+            'precision': precision_score(true_labels, pred_labels),
+            'recall': recall_score(true_labels, pred_labels),
+            'f1': f1_score(true_labels, pred_labels),
+        }
+    return compute_metrics
+
+
+def build_training_args(output_dir='./results', **overrides):
+    kwargs = dict(
+        output_dir=output_dir,
+        num_train_epochs=3,
+        per_device_train_batch_size=8,
+        per_device_eval_batch_size=8,
+        warmup_steps=500,
+        weight_decay=0.01,
+        logging_steps=10,
+        eval_strategy="epoch",
+        save_strategy="epoch",
+        load_best_model_at_end=True,
+        metric_for_best_model='f1',
+    )
+    # logging_dir was removed in transformers 5
+    if 'logging_dir' in TrainingArguments.__dataclass_fields__:
+        kwargs['logging_dir'] = './logs'
+    if LOW_MEMORY:
+        kwargs['gradient_checkpointing'] = True
+        kwargs['eval_accumulation_steps'] = EVAL_ACCUMULATION_STEPS
+    if PERF_MODE:
+        kwargs.update(perf_training_kwargs(BF16, COMPILE, FUSED_ADAMW, GRAD_ACCUM_STEPS))
+        print(f"Performance mode: {perf_training_kwargs(BF16, COMPILE, FUSED_ADAMW, GRAD_ACCUM_STEPS)}")
+    kwargs.update(overrides)
+    return TrainingArguments(**kwargs)
+
+
+def main():
+    skip_lines = check_corpus(DATA_FILE) if VALIDATE and DATA_FILE.exists() else set()
+    if LOW_MEMORY:
+        label_list = scan_labels(DATA_FILE, skip_lines)
+    else:
+        data = load_data(DATA_FILE, skip_lines)
+        label_list = collect_labels(data)
+    label_to_id, id_to_label = build_label_maps(label_list)
+
+    print(f"Labels: {label_list}")
+    print(f"Number of labels: {len(label_list)}")
+
+    # Load model and tokenizer
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModelForTokenClassification.from_pretrained(
+            MODEL_NAME,
+            num_labels=len(label_list),
+            id2label=id_to_label,
+            label2id=label_to_id,
+            ignore_mismatched_sizes=True
         )
 
-        # Align labels
-        word_ids = encoding.word_ids()
-        labels = []
-        previous_word_idx = None
-        for word_idx in word_ids:
-            if word_idx is None:
-                labels.append(-100)
-            elif word_idx != previous_word_idx:
-                labels.append(self.label_to_id[tags[word_idx]])
-            else:
-                labels.append(-100)
-            previous_word_idx = word_idx
-
-        encoding['labels'] = torch.tensor(labels)
-        return {k: v.squeeze() for k, v in encoding.items()}
-
-# Create datasets
-train_dataset = NERDataset(train_data, tokenizer, label_to_id)
-test_dataset = NERDataset(test_data, tokenizer, label_to_id)
-
-# Data collator and metrics
-from transformers import DataCollatorForTokenClassification
-from seqeval.metrics import precision_score, recall_score, f1_score
+    # Create datasets
+    if LOW_MEMORY:
+        encoded = encode_corpus(
+            DATA_FILE, tokenizer, label_to_id, ENCODED_DIR, test_percent=TEST_PERCENT, skip_lines=skip_lines
+        )
+        train_dataset = StreamingNERDataset(encoded['train'], shuffle_buffer=SHUFFLE_BUFFER)
+        test_dataset = StreamingNERDataset(encoded['test'])
+    else:
+        # Split data
+        train_data = [item for item in data if split_of(item, TEST_PERCENT) == 'train']
+        test_data = [item for item in data if split_of(item, TEST_PERCENT) == 'test']
+        train_dataset = NERDataset(train_data, tokenizer, label_to_id)
+        test_dataset = NERDataset(test_data, tokenizer, label_to_id)
+
+    # Data collator pads each batch to its longest sequence and counts tokens
+    data_collator = TokenCountingCollator(DataCollatorForTokenClassification(tokenizer))
+
+    # Trainer
+    trainer = Trainer(
+        model=model,
+        args=build_training_args(),
+        train_dataset=train_dataset,
+        eval_dataset=test_dataset,
+        data_collator=data_collator,
+        compute_metrics=make_compute_metrics(id_to_label),
+        callbacks=[ThroughputCallback(data_collator)],
+    )
+
+    # Train
+    trainer.train()
+
+    # Save model, with the corpus offset and split it was trained on for train_incremental.py
+    model.save_pretrained('./model')
+    tokenizer.save_pretrained('./model')
+    save_state('./model', DATA_FILE, split=split_record(TEST_PERCENT))
+
 
-data_collator = DataCollatorForTokenClassification(tokenizer)
-
-def compute_metrics(p):
-    predictions, labels = p
-    preds = np.argmax(predictions, axis=2)
-    true_labels, pred_labels = [], []
-    for i in range(len(labels)):
-        t, pr = [], []
-        for j, lab in enumerate(labels[i]):
-            if lab != -100:
-                t.append(id_to_label[lab])
-                pr.append(id_to_label[preds[i][j]])
-        true_labels.append(t)
-        pred_labels.append(pr)
-    return {
-        'precision': precision_score(true_labels, pred_labels),
-        'recall': recall_score(true_labels, pred_labels),
-        'f1': f1_score(true_labels, pred_labels),
-    }
-
-# Training arguments
-training_args = TrainingArguments(
-    output_dir='./results',
-    num_train_epochs=3,
-    per_device_train_batch_size=8,
-    per_device_eval_batch_size=8,
-    warmup_steps=500,
-    weight_decay=0.01,
-    logging_dir='./logs',
-    logging_steps=10,
-    eval_strategy="epoch",
-    save_strategy="epoch",
-    load_best_model_at_end=True,
-    metric_for_best_model='f1',
-)
-
-# Trainer
-trainer = Trainer(
-    model=model,
-    args=training_args,
-    train_dataset=train_dataset,
-    eval_dataset=test_dataset,
-)
-
-# Train
-trainer.train()
-
-# Save model
-model.save_pretrained('./model')
-tokenizer.save_pretrained('./model')
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Trains a BPE or Unigram tokenizer on the corpus segmentation: ThaiNER.jsonl
+`tokens` (training split only) plus the sentiment dataset when it is present.
+Words are fed separated by spaces and split on whitespace before the model
+sees them, so no subword crosses a word boundary of the corpus. Digits and
+ASCII punctuation are always in the alphabet.
+
+The result is saved in the same layout as the bundled tokenizer/ directory and
+compared with it (bpe_tokenizer.py benchmark) on the held-out ThaiNER split;
+subword ratios are taken over the held-out documents the bundled tokenizer
+encodes without <unk>.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from tokenizers import Tokenizer, models, normalizers, pre_tokenizers, trainers
+
+from bpe_tokenizer import (
+    DATA_FILE, MAX_LENGTHS, REPO_ROOT, TOKENIZER_FILE, encode_batch, file_tokenizer_results, load_tokenizer,
+    print_results,
+)
+from streaming_dataset import iter_corpus, split_of
+
+SENTIMENT_FILE = Path(os.getenv(
+    'SENTIMENT_FILE', str(REPO_ROOT / 'Text Classification' / 'data' / 'thai_sentiment_dataset.parquet')
+))
+OUTPUT_DIR = Path(os.getenv('OUTPUT_DIR', str(REPO_ROOT / 'tokenizer_corpus')))
+MODEL_TYPE = os.getenv('MODEL_TYPE', 'bpe')  # 'bpe' or 'unigram'
+VOCAB_SIZE = int(os.getenv('VOCAB_SIZE', '16000'))
+MIN_FREQUENCY = int(os.getenv('MIN_FREQUENCY', '2'))
+TEST_PERCENT = int(os.getenv('TEST_PERCENT', '20'))
+
+# Thai block and printable ASCII, so digits, Latin letters and punctuation
+# never fall back to <unk>
+ALPHABET = [chr(c) for c in range(0x0E01, 0x0E5C)] + [chr(c) for c in range(0x21, 0x7F)]
+
+
+def sentiment_documents(path=SENTIMENT_FILE):
+    """Sentiment texts, as their segmented `tokens` when the dataset has them"""
+    if not path.exists():
+        print(f'{path} not found; training on ThaiNER only')
+        return []
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        column = 'tokens' if 'tokens' in table.column_names else 'text'
+        values = table.column(column).to_pylist()
+    else:
+        with path.open('r', encoding='utf-8') as f:
+            values = [json.loads(line)['text'] for line in f if line.strip()]
+    return [' '.join(value) if isinstance(value, list) else value for value in values if value]
+
+
+def training_documents():
+    """Word-segmented training texts, words separated by single spaces"""
+    docs = [
+        ' '.join(item['tokens']) for item in iter_corpus(DATA_FILE) if split_of(item, TEST_PERCENT) == 'train'
+    ]
+    ner_count = len(docs)
+    docs.extend(sentiment_documents())
+    print(f'Training on {ner_count} ThaiNER and {len(docs) - ner_count} sentiment documents')
+    return docs
+
+
+def special_tokens(tokenizer_file=TOKENIZER_FILE):
+    """Special tokens of the bundled tokenizer, in id order, so their ids stay the same"""
+    added = load_tokenizer(tokenizer_file).get_added_tokens_decoder()
+    return [added[i].content for i in sorted(added)]
+
+
+def build_tokenizer(model_type=MODEL_TYPE, vocab_size=VOCAB_SIZE, min_frequency=MIN_FREQUENCY):
+    specials = special_tokens()
+    if model_type == 'bpe':
+        tokenizer = Tokenizer(models.BPE(unk_token='<unk>'))
+        trainer = trainers.BpeTrainer(
+            vocab_size=vocab_size,
+            min_frequency=min_frequency,
+            special_tokens=specials,
+            initial_alphabet=ALPHABET,
+        )
+    elif model_type == 'unigram':
+        tokenizer = Tokenizer(models.Unigram())
+        trainer = trainers.UnigramTrainer(
+            vocab_size=vocab_size,
+            special_tokens=specials,
+            unk_token='<unk>',
+            initial_alphabet=ALPHABET,
+        )
+    else:
+        raise ValueError(f"MODEL_TYPE must be 'bpe' or 'unigram', not {model_type!r}")
+
+    tokenizer.normalizer = normalizers.NFC()
+    # Corpus word boundaries are spaces in the training text; raw unspaced
+    # text becomes one pre-token per run of Thai characters
+    tokenizer.pre_tokenizer = pre_tokenizers.Sequence([
+        pre_tokenizers.WhitespaceSplit(),
+        pre_tokenizers.Punctuation(),
+        pre_tokenizers.Digits(individual_digits=True),
+    ])
+    return tokenizer, trainer
+
+
+def save_tokenizer(tokenizer, output_dir=OUTPUT_DIR):
+    """tokenizer.json plus the transformers config files, like tokenizer/"""
+    from transformers import PreTrainedTokenizerFast
+
+    wrapped = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        pad_token='<pad>',
+        unk_token='<unk>',
+        bos_token='<bos>',
+        eos_token='<eos>',
+    )
+    wrapped.save_pretrained(output_dir)
+    return Path(output_dir) / 'tokenizer.json'
+
+
+def held_out_documents():
+    words = [
+        item['tokens'] for item in iter_corpus(DATA_FILE) if item['tokens'] and split_of(item, TEST_PERCENT) == 'test'
+    ]
+    return words, [''.join(tokens) for tokens in words], sum(len(tokens) for tokens in words)
+
+
+def known_documents(words, raw, tokenizer_file=TOKENIZER_FILE):
+    """
+    The documents the tokenizer at `tokenizer_file` encodes without <unk>, both
+    segmented and raw. An <unk> stands for a whole run of unknown characters,
+    so counting it as one subword flatters that tokenizer's fertility.
+    """
+    tokenizer = load_tokenizer(Path(tokenizer_file))
+    unk_id = tokenizer.token_to_id('<unk>')
+    keep = [
+        unk_id not in segmented and unk_id not in unspaced
+        for segmented, unspaced in zip(encode_batch(words, tokenizer), encode_batch(raw, tokenizer))
+    ]
+    words = [tokens for tokens, known in zip(words, keep) if known]
+    return words, [''.join(tokens) for tokens in words], sum(len(tokens) for tokens in words)
+
+
+def main():
+    tokenizer, trainer = build_tokenizer()
+    tokenizer.train_from_iterator(training_documents(), trainer=trainer)
+    output_file = save_tokenizer(tokenizer)
+    print(f'Saved {MODEL_TYPE} tokenizer with {tokenizer.get_vocab_size()} tokens to {output_file.parent}')
+
+    words, raw, num_words = held_out_documents()
+    print(f'Comparing on {len(words)} held-out ThaiNER documents ({num_words} words)')
+    results = file_tokenizer_results(words, raw, num_words, TOKENIZER_FILE, 'bundled')
+    results += file_tokenizer_results(words, raw, num_words, output_file, f'retrained {MODEL_TYPE} {tokenizer.get_vocab_size()}')
+    print_results(results)
+
+    # Ratios only on documents without <unk> in the bundled encoding, where
+    # both tokenizers spell out every character
+    known_words, known_raw, known_num_words = known_documents(words, raw)
+    print(f'\nOn the {len(known_words)} of them the bundled tokenizer encodes without <unk> ({known_num_words} words):')
+    known = file_tokenizer_results(known_words, known_raw, known_num_words, TOKENIZER_FILE, 'bundled')
+    known += file_tokenizer_results(
+        known_words, known_raw, known_num_words, output_file, f'retrained {MODEL_TYPE} {tokenizer.get_vocab_size()}'
+    )
+    print_results(known)
+
+    # Transformer cost grows at least linearly with sequence length
+    for old, new in zip(known[:2], known[2:]):
+        print(f"{new['name']}: {new['fertility'] / old['fertility']:.2f}x the subwords of {old['name']}")
+
+    report = {
+        'model_type': MODEL_TYPE,
+        'vocab_size': tokenizer.get_vocab_size(),
+        'max_lengths': MAX_LENGTHS,
+        'results': results,
+        'unk_free_documents': len(known_words),
+        'unk_free_results': known,
+    }
+    with (OUTPUT_DIR / 'comparison.json').open('w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+CPU performance helpers for the NER Trainer: bf16/compile/fused-AdamW
+TrainingArguments and a callback that logs tokens/sec and peak RSS per epoch.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import torch
+from transformers import TrainerCallback
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))  # repo root, for common/
+from common.system import cpu_bf16_supported, peak_rss_mb
+
+
+def perf_training_kwargs(bf16='auto', compile_model=True, fused_adamw=True, grad_accum_steps=4):
+    """Extra TrainingArguments for the CPU performance mode"""
+    kwargs = {'gradient_accumulation_steps': grad_accum_steps}
+    if bf16 == '1' or (bf16 == 'auto' and cpu_bf16_supported()):
+        kwargs['bf16'] = True
+        if not torch.cuda.is_available():
+            # Trainer only accepts bf16 without a GPU when told to use the CPU
+            kwargs['use_cpu'] = True
+    if compile_model:
+        kwargs['torch_compile'] = True
+    if fused_adamw:
+        kwargs['optim'] = 'adamw_torch_fused'
+    return kwargs
+
+
+class TokenCountingCollator:
+    """Wraps a data collator and counts the real (unpadded) tokens it emits"""
+
+    def __init__(self, collator):
+        self.collator = collator
+        self.tokens = 0
+        self.samples = 0
+
+    def __call__(self, features):
+        batch = self.collator(features)
+        self.tokens += int(batch['attention_mask'].sum())
+        self.samples += batch['attention_mask'].shape[0]
+        return batch
+
+
+class ThroughputCallback(TrainerCallback):
+    """Prints training tokens/sec, samples/sec and peak RSS after every epoch"""
+
+    def __init__(self, counter):
+        self.counter = counter
+        self.start = None
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        # Evaluation batches of the previous epoch went through the same
+        # collator, so counting restarts here.
+        self.counter.tokens = 0
+        self.counter.samples = 0
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        seconds = time.perf_counter() - self.start
+        rss = peak_rss_mb()
+        rss_text = f', peak RSS {rss:.0f} MB' if rss is not None else ''
+        print(
+            f'Epoch {state.epoch:.0f}: {self.counter.tokens / seconds:.0f} tokens/s, '
+            f'{self.counter.samples / seconds:.1f} samples/s ({seconds:.1f}s){rss_text}'
+        )
@@ -0,0 +1,266 @@
+"""
+Streaming validator for NER corpus files (ThaiNER.jsonl and new batches in the
+same format). Files are split into byte ranges that are checked in parallel;
+per record it checks the schema keys, token/tag length parity, empty tokens,
+tag syntax (or membership of KNOWN_LABELS), BIO legality, and across all files
+duplicate ids. Tag checks run vectorised over chunks of records.
+
+    python src/validate_corpus.py [file ...]
+
+Writes a JSON report and exits with status 1 when any error is found.
+"""
+
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+DATA_FILE = Path(os.getenv('DATA_FILE', str(Path(__file__).resolve().parents[1] / 'data' / 'ThaiNER.jsonl')))
+REPORT_FILE = Path(os.getenv('REPORT_FILE', str(DATA_FILE.parent / 'validation_report.json')))
+# A model directory (config.json label2id) or a JSON list of tags; without it
+# tags are only checked for O / B-TYPE / I-TYPE syntax
+KNOWN_LABELS = os.getenv('KNOWN_LABELS', '')
+WORKERS = int(os.getenv('WORKERS', '0')) or os.cpu_count() or 1
+# Files smaller than this are checked in this process
+MIN_PARALLEL_BYTES = int(os.getenv('MIN_PARALLEL_BYTES', str(8 << 20)))
+CHUNK_RECORDS = 4096
+
+# Key set written by scripts/clean_thainer.py
+SCHEMA_KEYS = {'id', 'domain', 'tokens', 'tags'}
+TAG_PATTERN = re.compile(r'^(O|[BI]-[A-Z][A-Z0-9_]*)$')
+# Records that train_model.py skips or can still use are warnings, not errors
+WARNINGS = {'untagged', 'missing_domain'}
+
+
+def load_known_labels(source=KNOWN_LABELS):
+    if not source:
+        return None
+    path = Path(source)
+    if path.is_dir():
+        with (path / 'config.json').open('r', encoding='utf-8') as f:
+            return set(json.load(f)['label2id'])
+    with path.open('r', encoding='utf-8') as f:
+        return set(json.load(f))
+
+
+def byte_ranges(path, parts):
+    size = Path(path).stat().st_size
+    step = max(1, -(-size // parts))
+    return [(start, min(start + step, size)) for start in range(0, size, step)] or [(0, 0)]
+
+
+def read_range(path, start, end):
+    """(line index within the range, raw line) for every line starting in [start, end)"""
+    with Path(path).open('rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            if f.read(1) != b'\n':
+                f.readline()  # The partial line belongs to the previous range
+        index = 0
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield index, line
+            index += 1
+
+
+def check_record(item):
+    """
+    Schema, type and length issues of one parsed record as (check, detail),
+    and whether its tokens and tags are usable for the tag checks
+    """
+    if not isinstance(item, dict):
+        return [('schema', 'record is not a JSON object')], False
+    issues = []
+    extra = set(item) - SCHEMA_KEYS
+    if extra:
+        issues.append(('schema', f'unexpected keys {sorted(extra)}'))
+    if 'id' not in item:
+        issues.append(('schema', "missing key 'id'"))
+    if 'domain' not in item:
+        issues.append(('missing_domain', "missing key 'domain'"))
+    if 'tags' not in item:
+        issues.append(('untagged', "no 'tags'; train_model.py skips this record"))
+        return issues, False
+    for key in ('tokens', 'tags'):
+        value = item.get(key)
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            issues.append(('schema', f"'{key}' is not a list of strings"))
+            return issues, False
+    if len(item['tokens']) != len(item['tags']):
+        issues.append(('length_mismatch', f"{len(item['tokens'])} tokens, {len(item['tags'])} tags"))
+    return issues, True
+
+
+def flat_positions(lengths):
+    """Row of every element of the concatenated rows, and each row's start offset"""
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    return np.repeat(np.arange(len(lengths)), lengths), starts
+
+
+def check_tags(records, known_labels=None):
+    """
+    Vectorised checks over a chunk of (line, item) records: empty tokens, tag
+    syntax (or membership of known_labels), and I- tags that do not continue a
+    B-/I- tag of the same type. Returns (record, check, detail) issues.
+    """
+    issues = []
+    tags = [tag for _, item in records for tag in item['tags']]
+    if tags:
+        rows, starts = flat_positions([len(item['tags']) for _, item in records])
+        positions = np.arange(len(tags)) - starts[rows]
+        vocabulary, codes = np.unique(np.array(tags, dtype=object), return_inverse=True)
+        if known_labels is not None:
+            check, valid = 'unknown_tag', np.array([tag in known_labels for tag in vocabulary])
+        else:
+            check, valid = 'malformed_tag', np.array([bool(TAG_PATTERN.match(tag)) for tag in vocabulary])
+        for i in np.flatnonzero(~valid[codes]):
+            issues.append((records[rows[i]], check, f'tag {tags[i]!r} at position {positions[i]}'))
+
+        prefix = np.array([tag[:1] for tag in vocabulary])[codes]
+        entity = np.array([tag[2:] for tag in vocabulary], dtype=object)[codes]
+        first = positions == 0
+        previous_prefix = np.concatenate([['O'], prefix[:-1]])
+        previous_entity = np.concatenate([[''], entity[:-1]])
+        illegal = (prefix == 'I') & (first | (previous_prefix == 'O') | (previous_entity != entity))
+        for i in np.flatnonzero(illegal):
+            before = 'start' if first[i] else tags[i - 1]
+            issues.append((records[rows[i]], 'illegal_bio', f'{tags[i]} after {before} at position {positions[i]}'))
+
+    tokens = [token for _, item in records for token in item['tokens']]
+    if tokens:
+        rows, starts = flat_positions([len(item['tokens']) for _, item in records])
+        empty = np.array([len(token.strip()) for token in tokens]) == 0
+        for i in np.flatnonzero(empty):
+            issues.append((records[rows[i]], 'empty_token', f'empty token at position {i - starts[rows[i]]}'))
+    return issues
+
+
+def validate_range(path, start, end, known_labels=None):
+    """Issues and (id, line) pairs of the lines starting in one byte range; lines are range-relative"""
+    issues, ids = [], []
+    chunk = []
+    line_count = 0
+
+    def flush():
+        for (line, item), check, detail in check_tags(chunk, known_labels):
+            issues.append((line, item.get('id'), check, detail))
+        chunk.clear()
+
+    for line, raw in read_range(path, start, end):
+        line_count = line + 1
+        if not raw.strip():
+            continue
+        try:
+            item = json.loads(raw)
+        except ValueError as e:
+            issues.append((line, None, 'invalid_json', str(e)))
+            continue
+        record_issues, usable = check_record(item)
+        for check, detail in record_issues:
+            issues.append((line, item.get('id') if isinstance(item, dict) else None, check, detail))
+        if isinstance(item, dict) and 'id' in item:
+            ids.append((str(item['id']), line))
+        if usable:
+            chunk.append((line, item))
+            if len(chunk) >= CHUNK_RECORDS:
+                flush()
+    flush()
+    return line_count, issues, ids
+
+
+def validate_files(paths, known_labels=None, workers=WORKERS):
+    """Report dict covering every file; issues carry 1-based line numbers"""
+    issues = []
+    seen_ids = {}
+    records = 0
+    executor = None
+    try:
+        for path in paths:
+            path = Path(path)
+            parallel = workers > 1 and path.stat().st_size >= MIN_PARALLEL_BYTES
+            ranges = byte_ranges(path, workers if parallel else 1)
+            if parallel:
+                executor = executor or ProcessPoolExecutor(max_workers=workers)
+                results = executor.map(
+                    validate_range, [path] * len(ranges), *zip(*ranges), [known_labels] * len(ranges)
+                )
+            else:
+                results = (validate_range(path, start, end, known_labels) for start, end in ranges)
+
+            # Range-relative line numbers become file line numbers in range order
+            base = 0
+            for line_count, range_issues, ids in results:
+                for line, record_id, check, detail in range_issues:
+                    issues.append({'file': str(path), 'line': base + line + 1, 'id': record_id,
+                                   'check': check, 'detail': detail})
+                for record_id, line in ids:
+                    where = (str(path), base + line + 1)
+                    if record_id in seen_ids:
+                        first_file, first_line = seen_ids[record_id]
+                        issues.append({'file': where[0], 'line': where[1], 'id': record_id, 'check': 'duplicate_id',
+                                       'detail': f'first seen at {first_file}:{first_line}'})
+                    else:
+                        seen_ids[record_id] = where
+                base += line_count
+            records += base
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    issues.sort(key=lambda issue: (issue['file'], issue['line']))
+    counts = Counter(issue['check'] for issue in issues)
+    errors = sum(n for check, n in counts.items() if check not in WARNINGS)
+    return {
+        'files': [str(p) for p in paths],
+        'lines': records,
+        'errors': errors,
+        'warnings': sum(counts.values()) - errors,
+        'counts': dict(sorted(counts.items())),
+        'issues': issues,
+    }
+
+
+def error_lines(report, path):
+    """1-based line numbers of records in `path` with at least one error"""
+    return {
+        issue['line'] for issue in report['issues']
+        if issue['file'] == str(path) and issue['check'] not in WARNINGS
+    }
+
+
+def write_report(report, report_file=REPORT_FILE):
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    with report_file.open('w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+def print_summary(report, examples=5):
+    print(f"Checked {report['lines']} lines: {report['errors']} errors, {report['warnings']} warnings")
+    for check, count in report['counts'].items():
+        kind = 'warning' if check in WARNINGS else 'error'
+        print(f'  {check} ({kind}): {count}')
+        for issue in [i for i in report['issues'] if i['check'] == check][:examples]:
+            print(f"    {Path(issue['file']).name}:{issue['line']} {issue['id']}: {issue['detail']}")
+
+
+def main():
+    paths = [Path(p) for p in sys.argv[1:]] or [DATA_FILE]
+    start = time.perf_counter()
+    report = validate_files(paths, load_known_labels())
+    print_summary(report)
+    write_report(report)
+    print(f'Report written to {REPORT_FILE} ({time.perf_counter() - start:.2f}s)')
+    if report['errors']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
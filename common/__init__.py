@@ -0,0 +1,2 @@
+# Helpers shared by the Text Classification and NER projects. Scripts in
+# either project's src/ put the repository root on sys.path to import them.
@@ -0,0 +1,70 @@
+import os
+import statistics
+import time
+import traceback
+
+import torch
+import torch.multiprocessing as mp
+
+from common.system import partition_cores
+
+
+def _fold_main(run_fold, fold, train_idx, test_idx, args, cores, threads, results):
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+        start = time.perf_counter()
+        metrics = run_fold(fold, train_idx, test_idx, *args)
+        metrics["seconds"] = time.perf_counter() - start
+        results.put((fold, metrics, None))
+    except Exception:
+        results.put((fold, None, traceback.format_exc()))
+
+
+def run_folds(folds, run_fold, args, parallel, threads):
+    # Calls run_fold(fold, train_idx, test_idx, *args) for every (train_idx,
+    # test_idx) pair and returns its metrics dicts in fold order. Keeps
+    # `parallel` spawned processes running, each on its own slice of `threads`
+    # cores; a finished fold hands its cores to the next pending one.
+    # run_fold must be a module-level function so it can be pickled.
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    free_slots = partition_cores(parallel, threads)
+    pending = list(enumerate(folds))
+    running = {}
+    metrics = {}
+    while pending or running:
+        while pending and free_slots:
+            fold, (train_idx, test_idx) = pending.pop(0)
+            cores = free_slots.pop(0)
+            process = ctx.Process(
+                target=_fold_main,
+                args=(run_fold, fold, train_idx, test_idx, tuple(args), cores, threads, results),
+            )
+            process.start()
+            running[fold] = (process, cores)
+        fold, fold_metrics, error = results.get()
+        process, cores = running.pop(fold)
+        process.join()
+        if error is not None:
+            for other, _ in running.values():
+                other.terminate()
+            raise RuntimeError(f"Fold {fold} failed:\n{error}")
+        print(f"Fold {fold}: {fold_metrics}")
+        metrics[fold] = fold_metrics
+        free_slots.append(cores)
+    return [metrics[fold] for fold in sorted(metrics)]
+
+
+def summarize(fold_metrics):
+    # Mean and sample standard deviation of every metric across folds
+    summary = {}
+    for key in fold_metrics[0]:
+        values = [m[key] for m in fold_metrics]
+        summary[key] = {
+            "mean": statistics.mean(values),
+            "stdev": statistics.stdev(values) if len(values) > 1 else 0.0,
+        }
+    return summary
@@ -0,0 +1,11 @@
+import hashlib
+
+
+def file_hash(path, chunk_size=1 << 20):
+    # Content hash used in cache keys, so caches follow file contents rather
+    # than paths or modification times.
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(processes, threads_per_process, cores=None):
+    # Disjoint slices of threads_per_process cores, one per process
+    cores = cores if cores is not None else available_cores()
+    if processes * threads_per_process > len(cores):
+        raise ValueError(
+            f"{processes} processes x {threads_per_process} threads needs more than the {len(cores)} available cores"
+        )
+    return [cores[i * threads_per_process : (i + 1) * threads_per_process] for i in range(processes)]
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process in MB (None if unknown)
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # KiB on Linux, bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+
+
+def cpu_bf16_supported():
+    # AVX512-BF16 or AMX; without them bf16 autocast is emulated and slower.
+    checks = ("_is_avx512_bf16_supported", "_is_amx_tile_supported")
+    return any(getattr(torch.cpu, name, lambda: False)() for name in checks)